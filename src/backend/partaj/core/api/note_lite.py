@@ -2,10 +2,14 @@
 Referral lite related API endpoints.
 """
 
+import hashlib
+import json
+import time
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
@@ -14,10 +18,190 @@ from rest_framework.response import Response
 
 from ..forms import NoteListQueryForm
 from ..indexers import ES_CLIENT, NotesIndexer
+from ..search_cache import IndexResultsCache, get_query_cache_key
+from ..search_pagination import InvalidCursorError, search_with_cursor
+from ..services.facet_snapshot import FacetSnapshotService
 
 # pylint: disable=invalid-name
 User = get_user_model()
 
+# Fields of the notes documents the notes list shows, the extracted text is only
+# returned through its highlighted fragments
+NOTE_LITE_SOURCE_FIELDS = [
+    "id",
+    "referral_id",
+    "siblings",
+    "publication_date",
+    "object",
+    "topic",
+    "requesters_unit_names",
+    "assigned_units_names",
+    "document",
+]
+
+# Parts of the ElasticSearch response the notes list reads, leaving out shards metadata
+# and hits scores. "hits.total" is kept whole as ES6 returns it as an int.
+NOTE_LITE_FILTER_PATH = [
+    "hits.total",
+    "hits.hits._id",
+    "hits.hits._source",
+    "hits.hits.sort",
+    "pit_id",
+]
+
+# Unique field the notes are sorted on last, to paginate them with a cursor. Notes
+# indexed before it was mapped are sorted last
+NOTE_LITE_TIEBREAKER = {
+    "referral_id.keyword": {"order": "asc", "unmapped_type": "keyword"}
+}
+
+NOTE_LITE_HIGHLIGHT_FILTER_PATH = ["hits.hits._id", "hits.hits.highlight"]
+
+# Display order of the notes filters
+NOTES_FILTERS_ORDERS = {
+    "topic": 1,
+    "assigned_units_names": 2,
+    "contributors": 3,
+    "requesters_unit_names": 4,
+}
+
+# Results of the notes list and filters, until the notes index is written to
+NOTES_RESULTS_CACHE = IndexResultsCache(
+    NotesIndexer.index_name, maxsize=settings.KNOWLEDGE_BASE_CACHE_SIZE
+)
+
+
+def get_highlight_request(fragments, fragment_size):
+    """
+    Highlighting of the notes fields matching a full text query. Only the text gets
+    several fragments, the number and size of which make up the budget of a hit.
+    """
+    return {
+        "pre_tags": ['<span class="highlight">'],
+        "post_tags": ["</span>"],
+        "fields": {
+            "referral_id": {
+                "type": "plain",
+                "fragment_size": 1000,
+                "number_of_fragments": 1,
+            },
+            "text": {
+                "matched_fields": ["text", "text.4gram", "text.exact"],
+                "type": "fvh",
+                "fragment_size": fragment_size,
+                "number_of_fragments": fragments,
+            },
+            "object": {
+                "matched_fields": [
+                    "object",
+                    "object.exact",
+                ],
+                "type": "fvh",
+                "fragment_size": 1000,
+                "number_of_fragments": 1,
+            },
+            "author": {
+                "type": "plain",
+                "fragment_size": 1000,
+                "number_of_fragments": 1,
+            },
+            "contributors": {
+                "matched_fields": [
+                    "contributors",
+                    "contributors.exact",
+                ],
+                "type": "fvh",
+                "fragment_size": 1000,
+                "number_of_fragments": 1,
+            },
+            "topic": {
+                "matched_fields": ["topic", "topic.4gram", "topic.exact"],
+                "type": "fvh",
+            },
+        },
+    }
+
+
+def get_highlights_cache_key(full_text_query, hit, fragments, fragment_size):
+    """
+    Highlights of a hit only change with the query, the content of the note and the
+    highlight budget, the note content being identified by its fingerprint.
+    """
+    key = json.dumps(
+        [
+            full_text_query,
+            hit["_id"],
+            hit["_source"].get("fingerprint"),
+            fragments,
+            fragment_size,
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return f"note_lite_highlights:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def get_highlights(full_text_query, hits):
+    """
+    Highlight the fields of the given hits matching the full text query, in a search
+    restricted to these hits. Highlights are cached for each hit.
+    Return the highlights by hit id.
+    """
+    fragments = settings.KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENTS
+    fragment_size = settings.KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENT_SIZE
+    cache_keys = {
+        hit["_id"]: get_highlights_cache_key(
+            full_text_query, hit, fragments, fragment_size
+        )
+        for hit in hits
+    }
+    cached = cache.get_many(cache_keys.values())
+    highlights = {
+        hit_id: cached[cache_key]
+        for hit_id, cache_key in cache_keys.items()
+        if cache_key in cached
+    }
+
+    missing_ids = [hit_id for hit_id in cache_keys if hit_id not in highlights]
+    if not missing_ids:
+        return highlights
+
+    # pylint: disable=unexpected-keyword-arg
+    es_response = ES_CLIENT.search(
+        index=NotesIndexer.index_name,
+        body={
+            "size": len(missing_ids),
+            "query": {
+                "bool": {"filter": [full_text_query, {"ids": {"values": missing_ids}}]}
+            },
+            "_source": False,
+            "highlight": get_highlight_request(fragments, fragment_size),
+        },
+        filter_path=NOTE_LITE_HIGHLIGHT_FILTER_PATH,
+    )
+    missing_highlights = {hit_id: {} for hit_id in missing_ids}
+    for hit in es_response.get("hits", {}).get("hits", []):
+        missing_highlights[hit["_id"]] = hit.get("highlight", {})
+
+    cache.set_many(
+        {cache_keys[hit_id]: value for hit_id, value in missing_highlights.items()},
+        settings.KNOWLEDGE_BASE_HIGHLIGHT_CACHE_TIMEOUT,
+    )
+    return {**highlights, **missing_highlights}
+
+
+def get_note_lite(hit, highlight):
+    """
+    Normalize a notes search hit to the compact shape of the notes list.
+    """
+    return {
+        "_id": hit["_id"],
+        "_source": {
+            field: hit["_source"].get(field) for field in NOTE_LITE_SOURCE_FIELDS
+        },
+        "highlight": highlight,
+    }
+
 
 class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     """
@@ -26,7 +210,6 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
 
     permission_classes = [IsAuthenticated]
 
-    # pylint: disable=too-many-locals,too-many-branches
     def list(self, request, *args, **kwargs):
         """
         Handle requests for lists of notes.
@@ -37,15 +220,47 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         if not form.is_valid():
             return Response(status=400, data={"errors": form.errors})
 
+        timings = {}
+        started_at = time.monotonic()
+        cursor = form.cleaned_data.get("cursor")
+        try:
+            if form.cleaned_data.get("pit") or (cursor and cursor.get("pit")):
+                # Points in time expire, their cursors must not be cached
+                data = self.search_notes(form.cleaned_data, timings)
+            else:
+                data = NOTES_RESULTS_CACHE.get_or_search(
+                    ("list", get_query_cache_key(form.cleaned_data)),
+                    lambda: self.search_notes(form.cleaned_data, timings),
+                )
+        except InvalidCursorError as error:
+            return Response(status=400, data={"errors": {"cursor": [str(error)]}})
+
+        response = Response(data)
+        # Timings are empty when the results were cached
+        response["Server-Timing"] = ", ".join(
+            f"{name};dur={duration * 1000:.1f}"
+            for name, duration in (
+                timings or {"cache": time.monotonic() - started_at}
+            ).items()
+        )
+        return response
+
+    # pylint: disable=too-many-locals,too-many-branches
+    @staticmethod
+    def search_notes(cleaned_data, timings):
+        """
+        Search the notes matching the query and filters of the list form, in two phases
+        whose durations are recorded in `timings`.
+        """
         es_query_filters = []
 
-        topic_filters = form.cleaned_data.get("topic")
+        topic_filters = cleaned_data.get("topic")
         if len(topic_filters):
             es_query_filters += [
                 {"bool": {"must": [{"terms": {"topic.filter_keyword": topic_filters}}]}}
             ]
 
-        requesters_unit_names = form.cleaned_data.get("requesters_unit_names")
+        requesters_unit_names = cleaned_data.get("requesters_unit_names")
         if len(requesters_unit_names):
             es_query_filters += [
                 {
@@ -57,7 +272,7 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        assigned_units_names = form.cleaned_data.get("assigned_units_names")
+        assigned_units_names = cleaned_data.get("assigned_units_names")
         if len(assigned_units_names):
             es_query_filters += [
                 {
@@ -69,7 +284,7 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        contributors = form.cleaned_data.get("contributors")
+        contributors = cleaned_data.get("contributors")
         if len(contributors):
             es_query_filters += [
                 {
@@ -81,7 +296,7 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        publication_date_after = form.cleaned_data.get("publication_date_after")
+        publication_date_after = cleaned_data.get("publication_date_after")
         if publication_date_after:
             es_query_filters += [
                 {
@@ -97,7 +312,7 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        publication_date_before = form.cleaned_data.get("publication_date_before")
+        publication_date_before = cleaned_data.get("publication_date_before")
         if publication_date_before:
             publication_date_before += timedelta(days=1)
 
@@ -115,7 +330,7 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        full_text = form.cleaned_data.get("query") or ""
+        full_text = cleaned_data.get("query") or ""
 
         if full_text:
             quoted_texts = full_text.split('"')[1::2]
@@ -165,17 +380,19 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 else []
             )
 
-            es_query_filters += [
-                {"bool": {"must": quoted_text_queries + not_quoted_text_query}}
-            ]
+            full_text_query = {
+                "bool": {"must": quoted_text_queries + not_quoted_text_query}
+            }
+            es_query_filters += [full_text_query]
             sort = []
         else:
+            full_text_query = None
             es_query_filters += [{"match_all": {}}]
             sort = [{"publication_date": {"order": "desc"}}]
 
-        # Paginate
+        # Paginate, by page or after the cursor of the previous page
         es_size = settings.KNOWLEDGE_BASE_PAGINATION_SIZE
-        current_page = max(form.cleaned_data.get("page") or 1, 1)
+        current_page = max(cleaned_data.get("page") or 1, 1)
         es_from = (current_page - 1) * es_size
 
         es_body_request = {
@@ -183,64 +400,48 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             "size": es_size,
             "query": {"bool": {"filter": es_query_filters}},
             "sort": sort,
-            "highlight": {
-                "pre_tags": ['<span class="highlight">'],
-                "post_tags": ["</span>"],
-                "fields": {
-                    "referral_id": {
-                        "type": "plain",
-                        "fragment_size": 1000,
-                        "number_of_fragments": 1,
-                    },
-                    "text": {
-                        "matched_fields": ["text", "text.4gram", "text.exact"],
-                        "type": "fvh",
-                    },
-                    "object": {
-                        "matched_fields": [
-                            "object",
-                            "object.exact",
-                        ],
-                        "type": "fvh",
-                        "fragment_size": 1000,
-                        "number_of_fragments": 1,
-                    },
-                    "author": {
-                        "type": "plain",
-                        "fragment_size": 1000,
-                        "number_of_fragments": 1,
-                    },
-                    "contributors": {
-                        "matched_fields": [
-                            "contributors",
-                            "contributors.exact",
-                        ],
-                        "type": "fvh",
-                        "fragment_size": 1000,
-                        "number_of_fragments": 1,
-                    },
-                    "topic": {
-                        "matched_fields": ["topic", "topic.4gram", "topic.exact"],
-                        "type": "fvh",
-                    },
-                },
-            },
+            # The fingerprint identifies the content of the notes for the highlights
+            # cache, it is not returned
+            "_source": NOTE_LITE_SOURCE_FIELDS + ["fingerprint"],
         }
 
-        # pylint: disable=unexpected-keyword-arg
-        es_response = ES_CLIENT.search(
-            index=NotesIndexer.index_name, body=es_body_request
+        # First phase: find the hits of the page, without highlighting them
+        search_started_at = time.monotonic()
+        es_response, next_cursor = search_with_cursor(
+            ES_CLIENT,
+            NotesIndexer.index_name,
+            es_body_request,
+            es_size,
+            NOTE_LITE_TIEBREAKER,
+            cursor=cleaned_data.get("cursor"),
+            use_pit=cleaned_data.get("pit"),
+            filter_path=NOTE_LITE_FILTER_PATH,
         )
+        # Filtered out by ElasticSearch when there is no hit
+        hits = es_response["hits"].get("hits", [])
+        timings["search"] = time.monotonic() - search_started_at
 
-        return Response(
-            {
-                "count": len(es_response["hits"]["hits"]),
-                "next": None,
-                "previous": None,
-                "results": es_response,
-                "pageSize": es_size,
-            }
-        )
+        # Second phase: highlight the hits of the page only, there is nothing to
+        # highlight without a full text query
+        highlight_started_at = time.monotonic()
+        highlights = get_highlights(full_text_query, hits) if full_text_query else {}
+        timings["highlight"] = time.monotonic() - highlight_started_at
+
+        return {
+            "count": len(hits),
+            "next": next_cursor,
+            "previous": None,
+            "results": {
+                "hits": {
+                    "total": es_response["hits"]["total"],
+                    "hits": [
+                        get_note_lite(hit, highlights.get(hit["_id"], {}))
+                        for hit in hits
+                    ],
+                }
+            },
+            "pageSize": es_size,
+        }
 
     @action(
         detail=False,
@@ -252,95 +453,15 @@ class NoteLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         """
         GET all notes filters and aggregated values
         """
-
-        es_response = ES_CLIENT.search(
-            index=NotesIndexer.index_name,
-            body={
-                "aggs": {
-                    "topic": {
-                        "terms": {
-                            "field": "topic.filter_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 1},
-                    },
-                    "contributors": {
-                        "terms": {
-                            "field": "contributors.filter_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 3},
-                    },
-                    "requesters_unit_names": {
-                        "terms": {
-                            "field": "requesters_unit_names",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 4},
-                    },
-                    "assigned_units_names": {
-                        "terms": {
-                            "field": "assigned_units_names",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 2},
-                    },
-                },
-            },
-            size=0,
+        return Response(
+            data=NOTES_RESULTS_CACHE.get_or_search(("filters",), self.search_filters)
         )
 
-        response = {
-            "topic": {
-                "order": 1,
-                "results": [
-                    {
-                        "name": topic["key"],
-                        "id": topic["key"],
-                    }
-                    for topic in es_response["aggregations"]["topic"]["buckets"]
-                ],
-            },
-            "assigned_units_names": {
-                "order": 2,
-                "results": [
-                    {
-                        "name": contributors_unit_name["key"],
-                        "id": contributors_unit_name["key"],
-                    }
-                    for contributors_unit_name in es_response["aggregations"][
-                        "assigned_units_names"
-                    ]["buckets"]
-                ],
-            },
-            "contributors": {
-                "order": 3,
-                "results": [
-                    {
-                        "name": assignee["key"],
-                        "id": assignee["key"],
-                    }
-                    for assignee in es_response["aggregations"]["contributors"][
-                        "buckets"
-                    ]
-                ],
-            },
-            "requesters_unit_names": {
-                "order": 4,
-                "results": [
-                    {
-                        "name": requesters_unit_name["key"],
-                        "id": requesters_unit_name["key"],
-                    }
-                    for requesters_unit_name in es_response["aggregations"][
-                        "requesters_unit_names"
-                    ]["buckets"]
-                ],
-            },
-        }
-
-        return Response(data=response)
+    @staticmethod
+    def search_filters():
+        """
+        Get the values of the notes filters from their snapshot.
+        """
+        return FacetSnapshotService.format_filters(
+            FacetSnapshotService.get_notes_snapshot(), NOTES_FILTERS_ORDERS
+        )
@@ -1707,11 +1707,11 @@ class ReferralViewSet(viewsets.ModelViewSet):
                 data={"errors": "Title is missing"},
             )
         try:
+            # The transition saves the referral itself
             referral.update_title(
                 title=request.data.get("title"),
                 created_by=request.user,
             )
-            referral.save()
         except TransitionNotAllowed:
             return Response(
                 status=400,
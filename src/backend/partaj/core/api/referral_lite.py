@@ -3,12 +3,11 @@
 Referral-lite-related API endpoints.
 """
 
-import codecs
-import csv
+import json
 from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
 from django.utils.translation import gettext as _
 
 from rest_framework import mixins, viewsets
@@ -21,7 +20,11 @@ from .. import models
 from ..forms import DashboardReferralListQueryForm, ReferralListQueryForm
 from ..indexers import ES_CLIENT, ReferralsIndexer
 from ..models import MemberRoleAccess, ReportEventVerb
+from ..search_cache import IndexResultsCache, get_query_cache_key
+from ..search_pagination import InvalidCursorError, iter_hits, search_with_cursor
 from ..serializers import ReferralLiteSerializer
+from ..services.csv_stream import stream_csv
+from ..services.facet_snapshot import REFERRALS_FACETS, FacetSnapshotService
 from ..services.factories.error_response import ErrorResponseFactory
 from ..services.mappers import ESSortMapper
 
@@ -29,6 +32,58 @@ User = get_user_model()
 
 PAGINATION = 10
 
+# Unique field the referrals are sorted on last, to paginate them with a cursor
+REFERRALS_TIEBREAKER = {"case_number": {"order": "asc"}}
+
+# Fields of the referral documents the lists return
+REFERRAL_LITE_SOURCE = ["_lite"]
+
+# Number of referrals the CSV export searches at a time
+EXPORT_PAGE_SIZE = 1000
+
+# Fields of the referral documents the CSV export writes
+REFERRAL_EXPORT_SOURCE = [
+    "referral_id",
+    "sent_at",
+    "due_date",
+    "state",
+    "theme.name_search",
+    "object",
+    "users_unit_name",
+    "requester_users.name_search",
+    "contributors_unit_names.name_search",
+    "assigned_users.name_search",
+    "status",
+    "published_date",
+]
+
+# Parts of the responses of the lists multi searches that are used, the status keeps
+# a response for each search
+REFERRAL_MSEARCH_FILTER_PATH = [
+    "responses.status",
+    "responses.aggregations.tabs.buckets.*.doc_count",
+    "responses.hits.hits._source",
+]
+
+# Display order of the referrals filters
+REFERRALS_FILTERS_ORDERS = {
+    "contributors_unit_names": 4,
+    "requesters_unit_names": 2,
+    "assignees": 5,
+    "requesters": 3,
+    "topics": 1,
+}
+
+# Values of the referrals filters for each scope of referrals, until the referrals index
+# is written to
+REFERRALS_RESULTS_CACHE = IndexResultsCache(ReferralsIndexer.index_name)
+
+# Dashboard responses of each user for each query, until the referrals index is written
+# to
+REFERRALS_DASHBOARD_CACHE = IndexResultsCache(
+    ReferralsIndexer.index_name, maxsize=settings.DASHBOARD_CACHE_SIZE
+)
+
 
 class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     """
@@ -349,27 +404,128 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         sort_field = form.cleaned_data.get("sort") or "created_at"
         sort_dir = form.cleaned_data.get("sort_dir") or "desc"
 
-        # pylint: disable=unexpected-keyword-arg
-        es_response = ES_CLIENT.search(
-            index=ReferralsIndexer.index_name,
-            body={
-                "query": {"bool": {"filter": es_query_filters}},
-                "sort": [{sort_field: {"order": sort_dir}}],
-            },
-            size=form.cleaned_data.get("limit") or 1000,
+        return self.get_referrals_page(
+            form, {"bool": {"filter": es_query_filters}}, sort_field, sort_dir
         )
 
+    @staticmethod
+    def get_referrals_page(form, query, sort_field, sort_dir):
+        """
+        Respond with a page of the referrals matching the query, of `limit` referrals,
+        starting after the cursor of the previous page if any. The response holds the
+        cursor of the next page.
+        """
+        try:
+            es_response, next_cursor = search_with_cursor(
+                ES_CLIENT,
+                ReferralsIndexer.index_name,
+                {
+                    "query": query,
+                    "sort": [{sort_field: {"order": sort_dir}}],
+                    "_source": REFERRAL_LITE_SOURCE,
+                },
+                form.cleaned_data.get("limit") or 1000,
+                REFERRALS_TIEBREAKER,
+                cursor=form.cleaned_data.get("cursor"),
+                use_pit=form.cleaned_data.get("pit"),
+                filter_path=["hits.hits._source._lite", "hits.hits.sort", "pit_id"],
+            )
+        except InvalidCursorError as error:
+            return Response(status=400, data={"errors": {"cursor": [str(error)]}})
+
+        # Hits are left out of the filtered response when there are none
+        hits = es_response.get("hits", {}).get("hits", [])
         return Response(
             {
-                "count": len(es_response["hits"]["hits"]),
-                "next": None,
+                "count": len(hits),
+                "next": next_cursor,
                 "previous": None,
-                "results": [
-                    item["_source"]["_lite"] for item in es_response["hits"]["hits"]
-                ],
+                "results": [item["_source"]["_lite"] for item in hits],
             }
         )
 
+    @staticmethod
+    def get_user_cache_key(user):
+        """
+        Identify what the dashboards of a user depend on besides their query: the user,
+        their unit name and their unit memberships.
+        """
+        return (
+            user.id,
+            user.unit_name,
+            tuple(
+                sorted(
+                    models.UnitMembership.objects.filter(user=user).values_list(
+                        "unit_id", "role"
+                    )
+                )
+            ),
+        )
+
+    @staticmethod
+    def msearch_referrals(searches, names, tabs=None):
+        """
+        Run the searches of the tabs of a list, each one a header and a body, and name
+        their results. The referrals of the tabs are counted at once with an aggregation
+        on the `all` tab, which matches the referrals of every other tab, and only the
+        `tabs` whose items are needed (all of them by default) are searched for the lite
+        payload of their referrals.
+        """
+        if not names:
+            return []
+
+        bodies = dict(zip(names, searches[1::2]))
+        counts_search = {
+            "query": bodies["all"]["query"],
+            "size": 0,
+            "track_total_hits": False,
+            "aggs": {
+                "tabs": {
+                    "filters": {
+                        "filters": {
+                            name: body["query"] for name, body in bodies.items()
+                        }
+                    }
+                }
+            },
+        }
+        items_names = [name for name in names if tabs is None or name in tabs]
+
+        request = [{"index": ReferralsIndexer.index_name}, counts_search]
+        for name in items_names:
+            request.extend(
+                [
+                    {"index": ReferralsIndexer.index_name},
+                    {
+                        **bodies[name],
+                        "_source": REFERRAL_LITE_SOURCE,
+                        "track_total_hits": False,
+                    },
+                ]
+            )
+
+        # pylint: disable=unexpected-keyword-arg
+        counts_response, *items_responses = ES_CLIENT.msearch(
+            body=request, filter_path=REFERRAL_MSEARCH_FILTER_PATH
+        )["responses"]
+        buckets = counts_response["aggregations"]["tabs"]["buckets"]
+        items = {
+            name: [
+                # Hits are left out of the filtered response when there are none
+                hit["_source"]
+                for hit in response.get("hits", {}).get("hits", [])
+            ]
+            for name, response in zip(items_names, items_responses)
+        }
+        return [
+            {
+                "name": name,
+                "count": buckets[name]["doc_count"],
+                "items": items.get(name, []),
+            }
+            for name in names
+        ]
+
     @staticmethod
     def __get_dashboard_query(request, form, sorting, pagination):
         unit_memberships = models.UnitMembership.objects.filter(
@@ -392,7 +548,7 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 )
 
         if len(roles) == 0:
-            return []
+            return [], []
 
         role = roles[0]
 
@@ -850,8 +1006,6 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             req_head = {"index": ReferralsIndexer.index_name}
             req_body = {
                 "query": {"bool": {"filter": in_validation_es_query_filters}},
-                "from": 0,
-                "size": 1000,
             }
 
             if "in_validation" in sorting:
@@ -898,18 +1052,7 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         request.extend([req_head, req_body])
         req_types.append("done")
 
-        # pylint: disable=unexpected-keyword-arg
-        es_responses = ES_CLIENT.msearch(body=request)
-        normalized_response = [
-            {
-                "name": req_types[index],
-                "count": response["hits"]["total"]["value"],
-                "items": [hit["_source"] for hit in response["hits"]["hits"]],
-            }
-            for index, response in enumerate(es_responses["responses"])
-        ]
-
-        return normalized_response
+        return request, req_types
 
     @action(
         detail=False,
@@ -951,25 +1094,37 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 "size": PAGINATION,
             }
 
-        normalized_es_response = self.__get_dashboard_query(
-            request, form, sorting, pagination
-        )
+        def get_response():
+            normalized_es_response = self.msearch_referrals(
+                *self.__get_dashboard_query(request, form, sorting, pagination),
+                # Only the referrals of the tabs shown are needed, the others are counted
+                tabs=form.cleaned_data.get("tabs") or None,
+            )
 
-        final_response = {"pagination": PAGINATION}
+            final_response = {"pagination": PAGINATION}
 
-        for value in normalized_es_response:
-            final_response[value["name"]] = {
-                "count": value["count"],
-                "items": [item["_lite"] for item in value["items"]],
-            }
+            for value in normalized_es_response:
+                final_response[value["name"]] = {
+                    "count": value["count"],
+                    "items": [item["_lite"] for item in value["items"]],
+                }
 
-        return Response(data=final_response)
+            return final_response
+
+        return Response(
+            data=REFERRALS_DASHBOARD_CACHE.get_or_search(
+                (
+                    "dashboard",
+                    self.get_user_cache_key(request.user),
+                    get_query_cache_key(form.cleaned_data),
+                ),
+                get_response,
+            )
+        )
 
     @staticmethod
     def __get_unit_query(request, form, sorting, pagination):
         unit_id = form.cleaned_data.get("unit_id")
-        if not unit_id:
-            return ErrorResponseFactory.create_error("Unit params is needed")
 
         unit_membership = models.UnitMembership.objects.filter(
             user=request.user,
@@ -1440,8 +1595,6 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             req_head = {"index": ReferralsIndexer.index_name}
             req_body = {
                 "query": {"bool": {"filter": in_validation_es_query_filters}},
-                "from": 0,
-                "size": 1000,
             }
 
             if "in_validation" in sorting:
@@ -1469,8 +1622,6 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         req_head = {"index": ReferralsIndexer.index_name}
         req_body = {
             "query": {"bool": {"filter": done_query_filters}},
-            "from": 0,
-            "size": 1000,
         }
 
         if "done" in sorting:
@@ -1490,19 +1641,7 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         request.extend([req_head, req_body])
         req_types.append("done")
 
-        # pylint: disable=unexpected-keyword-arg
-        es_responses = ES_CLIENT.msearch(body=request)
-
-        normalized_response = [
-            {
-                "name": req_types[index],
-                "count": response["hits"]["total"]["value"],
-                "items": [hit["_source"] for hit in response["hits"]["hits"]],
-            }
-            for index, response in enumerate(es_responses["responses"])
-        ]
-
-        return normalized_response
+        return request, req_types
 
     @action(
         detail=False,
@@ -1520,6 +1659,9 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         if not form.is_valid():
             return Response(status=400, data={"errors": form.errors})
 
+        if not form.cleaned_data.get("unit_id"):
+            return ErrorResponseFactory.create_error("Unit params is needed")
+
         # SORTING
         sorting = {}
 
@@ -1543,21 +1685,35 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 "size": PAGINATION,
             }
 
-        normalized_es_response = self.__get_unit_query(
-            request, form, sorting, pagination
-        )
-
-        final_response = {
-            "pagination": PAGINATION,
-        }
+        def get_response():
+            normalized_es_response = self.msearch_referrals(
+                *self.__get_unit_query(request, form, sorting, pagination),
+                # Only the referrals of the tabs shown are needed, the others are counted
+                tabs=form.cleaned_data.get("tabs") or None,
+            )
 
-        for value in normalized_es_response:
-            final_response[value["name"]] = {
-                "count": value["count"],
-                "items": [item["_lite"] for item in value["items"]],
+            final_response = {
+                "pagination": PAGINATION,
             }
 
-        return Response(data=final_response)
+            for value in normalized_es_response:
+                final_response[value["name"]] = {
+                    "count": value["count"],
+                    "items": [item["_lite"] for item in value["items"]],
+                }
+
+            return final_response
+
+        return Response(
+            data=REFERRALS_DASHBOARD_CACHE.get_or_search(
+                (
+                    "unit",
+                    self.get_user_cache_key(request.user),
+                    get_query_cache_key(form.cleaned_data),
+                ),
+                get_response,
+            )
+        )
 
     @action(
         detail=False,
@@ -1637,25 +1793,8 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        # pylint: disable=unexpected-keyword-arg
-        es_response = ES_CLIENT.search(
-            index=ReferralsIndexer.index_name,
-            body={
-                "query": {"bool": {"filter": es_query_filters}},
-                "sort": [{sort_field: {"order": sort_dir}}],
-            },
-            size=form.cleaned_data.get("limit") or 1000,
-        )
-
-        return Response(
-            {
-                "count": len(es_response["hits"]["hits"]),
-                "next": None,
-                "previous": None,
-                "results": [
-                    item["_source"]["_lite"] for item in es_response["hits"]["hits"]
-                ],
-            }
+        return self.get_referrals_page(
+            form, {"bool": {"filter": es_query_filters}}, sort_field, sort_dir
         )
 
     @action(
@@ -1726,117 +1865,18 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 }
             ]
 
-        es_response = ES_CLIENT.search(
-            index=ReferralsIndexer.index_name,
-            body={
-                "query": {"bool": {"filter": es_query_filters}},
-                "aggs": {
-                    "topics": {
-                        "terms": {
-                            "field": "theme.name_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 1},
-                    },
-                    "assignees": {
-                        "terms": {
-                            "field": "assigned_users.name_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 2},
-                    },
-                    "requesters": {
-                        "terms": {
-                            "field": "requester_users.name_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 3},
-                    },
-                    "contributors_unit_names": {
-                        "terms": {
-                            "field": "contributors_unit_names.name_keyword",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 4},
-                    },
-                    "requesters_unit_names": {
-                        "terms": {
-                            "field": "users_unit_name",
-                            "size": 1000,
-                            "order": {"_key": "asc"},
-                        },
-                        "meta": {"order": 5},
-                    },
-                },
-            },
-            size=0,
+        return Response(
+            data=REFERRALS_RESULTS_CACHE.get_or_search(
+                ("filters", json.dumps(es_query_filters, sort_keys=True)),
+                lambda: FacetSnapshotService.format_filters(
+                    FacetSnapshotService.get_snapshot(
+                        ReferralsIndexer.index_name, REFERRALS_FACETS, es_query_filters
+                    ),
+                    REFERRALS_FILTERS_ORDERS,
+                ),
+            )
         )
 
-        response = {
-            "contributors_unit_names": {
-                "order": 4,
-                "results": [
-                    {
-                        "name": contributors_unit_name["key"],
-                        "id": contributors_unit_name["key"],
-                    }
-                    for contributors_unit_name in es_response["aggregations"][
-                        "contributors_unit_names"
-                    ]["buckets"]
-                ],
-            },
-            "requesters_unit_names": {
-                "order": 2,
-                "results": [
-                    {
-                        "name": requesters_unit_name["key"],
-                        "id": requesters_unit_name["key"],
-                    }
-                    for requesters_unit_name in es_response["aggregations"][
-                        "requesters_unit_names"
-                    ]["buckets"]
-                ],
-            },
-            "assignees": {
-                "order": 5,
-                "results": [
-                    {
-                        "name": assignee["key"],
-                        "id": assignee["key"],
-                    }
-                    for assignee in es_response["aggregations"]["assignees"]["buckets"]
-                ],
-            },
-            "requesters": {
-                "order": 3,
-                "results": [
-                    {
-                        "name": requester["key"],
-                        "id": requester["key"],
-                    }
-                    for requester in es_response["aggregations"]["requesters"][
-                        "buckets"
-                    ]
-                ],
-            },
-            "topics": {
-                "order": 1,
-                "results": [
-                    {
-                        "name": topic["key"],
-                        "id": topic["key"],
-                    }
-                    for topic in es_response["aggregations"]["topics"]["buckets"]
-                ],
-            },
-        }
-
-        return Response(data=response)
-
     @action(
         detail=False,
         methods=["get"],
@@ -1864,93 +1904,100 @@ class ReferralLiteViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 "dir": config[2],
             }
 
-        # PAGINATION
-        pagination = {}
-        pagination["default"] = {"from": 0, "size": 1000}
+        if scope == "unit" and not form.cleaned_data.get("unit_id"):
+            return ErrorResponseFactory.create_error("Unit params is needed")
 
-        referral_groups = (
-            self.__get_unit_query(request, form, sorting, pagination)
-            if scope == "unit"
-            else self.__get_dashboard_query(request, form, sorting, pagination)
+        get_query = (
+            self.__get_unit_query if scope == "unit" else self.__get_dashboard_query
         )
+        searches, names = get_query(
+            request, form, sorting, {"default": {"from": 0, "size": EXPORT_PAGE_SIZE}}
+        )
+        bodies = dict(zip(names, searches[1::2]))
+        current_tab = tab if tab is not None else "all"
 
-        return self.__export_referrals(tab, referral_groups)
-
-    def __export_referrals(self, tab, referral_groups):
-        referrals = []
+        header = [
+            _("export id"),
+            _("export send at"),
+            _("export due date"),
+            _("export status"),
+            _("export topic"),
+            _("export object"),
+            _("export requester unit"),
+            _("export requesters"),
+            _("export units"),
+            _("export assignees"),
+            _("export state"),
+            _("export published date"),
+        ]
+        if current_tab not in bodies:
+            # The tab is not shown to this user
+            return stream_csv("export.csv", header, [])
 
-        current_tab = tab if tab is not None else "all"
+        referrals = iter_hits(
+            ES_CLIENT,
+            ReferralsIndexer.index_name,
+            {
+                "query": bodies[current_tab]["query"],
+                "sort": bodies[current_tab]["sort"],
+                "_source": REFERRAL_EXPORT_SOURCE,
+            },
+            EXPORT_PAGE_SIZE,
+            REFERRALS_TIEBREAKER,
+            filter_path=["hits.hits._source", "hits.hits.sort", "pit_id"],
+        )
+        return stream_csv(
+            "export.csv",
+            header,
+            (self.get_export_row(referral["_source"]) for referral in referrals),
+        )
 
-        for res in referral_groups:
-            if res["name"] == current_tab:
-                for ref in res["items"]:
-                    referrals.append(ref)
-
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=export.csv"
-        response.write(codecs.BOM_UTF8)
-
-        writer = csv.writer(response, delimiter=";", quoting=csv.QUOTE_ALL)
-        writer.writerow(
-            [
-                _("export id"),
-                _("export send at"),
-                _("export due date"),
-                _("export status"),
-                _("export topic"),
-                _("export object"),
-                _("export requester unit"),
-                _("export requesters"),
-                _("export units"),
-                _("export assignees"),
-                _("export state"),
-                _("export published date"),
-            ]
+    @staticmethod
+    def get_export_row(ref):
+        """
+        Format the exported columns of a referral document as a row of the CSV export.
+        """
+        referral_id = ref["referral_id"]
+        sent_date = datetime.fromisoformat(ref["sent_at"])
+        due_date = datetime.fromisoformat(ref["due_date"])
+        state = models.ReferralState(ref["state"]).label
+        theme = ref["theme"]["name_search"]
+        title = ref["object"]
+        # Source filtering leaves out the lists it finds no requested field in
+        requester_unit_names = " - ".join(
+            [unit for unit in ref.get("users_unit_name", [])]
+        )
+        requester_names = " - ".join(
+            [user["name_search"] for user in ref.get("requester_users", [])]
+        )
+        assignee_unit_names = " - ".join(
+            [unit["name_search"] for unit in ref.get("contributors_unit_names", [])]
+        )
+        assignee_names = " - ".join(
+            [user["name_search"] for user in ref.get("assigned_users", [])]
+        )
+        status = models.ReferralStatus(ref["status"]).label
+        published_date = (
+            datetime.fromisoformat(ref["published_date"])
+            if ref.get("published_date") is not None
+            else None
         )
 
-        for ref in referrals:
-            referral_id = ref["referral_id"]
-            sent_date = datetime.fromisoformat(ref["sent_at"])
-            due_date = datetime.fromisoformat(ref["due_date"])
-            state = models.ReferralState(ref["state"]).label
-            theme = ref["theme"]["name_search"]
-            title = ref["object"]
-            requester_unit_names = " - ".join([unit for unit in ref["users_unit_name"]])
-            requester_names = " - ".join(
-                [user["name_search"] for user in ref["requester_users"]]
-            )
-            assignee_unit_names = " - ".join(
-                [unit["name_search"] for unit in ref["contributors_unit_names"]]
-            )
-            assignee_names = " - ".join(
-                [user["name_search"] for user in ref["assigned_users"]]
-            )
-            status = models.ReferralStatus(ref["status"]).label
-            published_date = (
-                datetime.fromisoformat(ref["published_date"])
-                if ref["published_date"] is not None
+        return [
+            referral_id,
+            sent_date.strftime("%Y-%m-%d"),
+            due_date.strftime("%Y-%m-%d"),
+            status,
+            theme,
+            title,
+            requester_unit_names,
+            requester_names,
+            assignee_unit_names,
+            assignee_names,
+            state,
+            (
+                published_date.strftime("%Y-%m-%d")
+                if published_date is not None
                 else None
-            )
-
-            writer.writerow(
-                [
-                    referral_id,
-                    sent_date.strftime("%Y-%m-%d"),
-                    due_date.strftime("%Y-%m-%d"),
-                    status,
-                    theme,
-                    title,
-                    requester_unit_names,
-                    requester_names,
-                    assignee_unit_names,
-                    assignee_names,
-                    state,
-                    (
-                        published_date.strftime("%Y-%m-%d")
-                        if published_date is not None
-                        else None
-                    ),
-                ]
-            )
-
-        return response
+            ),
+        ]
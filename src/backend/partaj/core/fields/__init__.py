@@ -5,3 +5,4 @@ Re-export all field to make them easier to import.
 # flake8: noqa
 
 from .array import *
+from .cursor import *
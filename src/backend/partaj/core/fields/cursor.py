@@ -0,0 +1,27 @@
+"""
+Cursor field for the forms of the paginated API list endpoints.
+"""
+
+from django import forms
+from django.core.exceptions import ValidationError
+
+from ..search_pagination import InvalidCursorError, decode_cursor
+
+
+class CursorField(forms.CharField):
+    """
+    Read the opaque cursor token of a page of search results, cleaned as the cursor it
+    encodes, or None.
+    """
+
+    def clean(self, value):
+        """
+        Validate the cursor token and decode it.
+        """
+        value = super().clean(value)  # pylint: disable=no-member
+        if not value:
+            return None
+        try:
+            return decode_cursor(value)
+        except InvalidCursorError as error:
+            raise ValidationError(str(error)) from error
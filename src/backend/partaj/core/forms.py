@@ -8,7 +8,7 @@ from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.utils.translation import gettext_lazy as _
 
-from .fields import ArrayField
+from .fields import ArrayField, CursorField
 
 from .models import (  # isort:skip
     Referral,
@@ -226,10 +226,12 @@ class ReferralListQueryForm(BaseApiListQueryForm):
     """
 
     assignee = ArrayField(required=False, base_type=forms.CharField(max_length=50))
+    cursor = CursorField(required=False, max_length=4096)
     due_date_after = forms.DateTimeField(required=False)
     due_date_before = forms.DateTimeField(required=False)
     limit = forms.IntegerField(required=False)
     offset = forms.IntegerField(required=False)
+    pit = forms.BooleanField(required=False)
     query = forms.CharField(required=False, max_length=100)
     sort = forms.ChoiceField(
         required=False,
@@ -281,6 +283,7 @@ class DashboardReferralListQueryForm(BaseApiListQueryForm):
 
     sort = ArrayField(required=False, base_type=forms.CharField(max_length=50))
     page = ArrayField(required=False, base_type=forms.CharField(max_length=50))
+    tabs = ArrayField(required=False, base_type=forms.CharField(max_length=50))
 
     topics = ArrayField(required=False, base_type=forms.CharField(max_length=256))
     assignees = ArrayField(required=False, base_type=forms.CharField(max_length=256))
@@ -299,9 +302,11 @@ class NoteListQueryForm(BaseApiListQueryForm):
     Form to validate query parameters for note list requests on the API.
     """
 
+    cursor = CursorField(required=False, max_length=4096)
     limit = forms.IntegerField(required=False)
     offset = forms.IntegerField(required=False)
     page = forms.IntegerField(required=False)
+    pit = forms.BooleanField(required=False)
     query = forms.CharField(required=False, max_length=100)
     topic = ArrayField(required=False, base_type=forms.CharField(max_length=255))
     requesters_unit_names = ArrayField(
@@ -2,18 +2,51 @@
 Helpers for Elasticsearch indices management.
 """
 
+import math
+import multiprocessing
 import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from functools import reduce
 
 from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
 from django.utils import timezone
 
 from elasticsearch.exceptions import NotFoundError, RequestError
 
 from partaj.core.indexers import NotesIndexer, ReferralsIndexer
 
-from .indexers import ES_INDICES, ES_INDICES_CLIENT
-from .indexers.common import partaj_bulk
+from . import models
+from .indexers import ES_CLIENT, ES_INDICES, ES_INDICES_CLIENT
+from .indexers.common import (
+    REBUILD_INDICES,
+    REBUILD_INDICES_TTL,
+    BulkLoadStats,
+    get_document_fingerprint,
+    get_es_client,
+    partaj_bulk,
+    partaj_bulk_load,
+)
+
+# Number of id ranges handed to each worker process during a parallel indexing: smaller
+# ranges balance the load between workers when referrals are unevenly distributed.
+PARTITIONS_PER_WORKER = 4
+
+# An incremental indexing resumed from a watermark looks back a bit further, to catch
+# changes committed by transactions that were still running when the watermark was taken.
+INCREMENTAL_INDEXING_OVERLAP = timedelta(minutes=5)
+
+# Settings of a new index while it is populated: no refresh and no replica to keep up with,
+# until all documents are loaded and the settings restored
+BULK_LOAD_SETTINGS = {"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+
+# Elasticsearch client of a worker process, set up by `init_indexing_worker`
+# pylint: disable=invalid-name
+worker_es_client = None
 
 
 def get_indices_by_alias(existing_indices, alias):
@@ -26,9 +59,322 @@ def get_indices_by_alias(existing_indices, alias):
             yield index, alias
 
 
-def perform_create_index(indexable, logger=None):
+def get_id_partitions(from_id, to_id, partitions):
+    """
+    Split the [from_id, to_id] range of ids in at most `partitions` contiguous ranges.
+    """
+    size = max(1, math.ceil((to_id - from_id + 1) / partitions))
+    return [
+        (start, min(start + size - 1, to_id))
+        for start in range(from_id, to_id + 1, size)
+    ]
+
+
+def init_indexing_worker():
+    """
+    Set up a process of the indexing pool with its own Elasticsearch client. Database
+    connections are closed before the pool is forked so each worker opens its own.
+    """
+    # pylint: disable=global-statement
+    global worker_es_client
+    worker_es_client = get_es_client()
+
+
+def index_referrals_partition(partition):
+    """
+    Index the referrals of one (index, from_id, to_id) id range from a worker process,
+    building documents by chunks while previous chunks are sent to Elasticsearch by
+    bulk threads.
+    Return the range and the stats of the load.
+    """
+    index, from_id, to_id = partition
+    stats = partaj_bulk_load(
+        ReferralsIndexer.get_es_documents_by_id_range(
+            index=index, from_id=from_id, to_id=to_id
+        ),
+        BulkLoadStats(),
+        client=worker_es_client,
+        thread_count=2,
+    )
+
+    return from_id, to_id, stats
+
+
+# pylint: disable=too-many-arguments
+def perform_parallel_referrals_indexing(
+    index, workers, from_id=None, to_id=None, logger=None, stats=None
+):
+    """
+    Index referrals into an index using a pool of worker processes, each of them handling
+    contiguous ranges of referral ids. Raise if any range fails, so callers never swap
+    aliases to a partially populated index.
+    Stats of the workers are merged into `stats` when given.
+    Return the number of indexed documents.
+    """
+    bounds = models.Referral.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+    if bounds["max_id"] is None:
+        return 0
+    from_id = bounds["min_id"] if from_id is None else max(from_id, bounds["min_id"])
+    to_id = bounds["max_id"] if to_id is None else min(to_id, bounds["max_id"])
+    if from_id > to_id:
+        return 0
+
+    partitions = get_id_partitions(from_id, to_id, workers * PARTITIONS_PER_WORKER)
+    if logger:
+        logger.info(
+            "Indexing referrals %s to %s in %s ranges with %s workers...",
+            from_id,
+            to_id,
+            len(partitions),
+            workers,
+        )
+
+    # Forked workers must not reuse the connections of the parent process
+    connections.close_all()
+
+    indexed = 0
+    with multiprocessing.get_context("fork").Pool(
+        processes=workers, initializer=init_indexing_worker
+    ) as pool:
+        # Log progress as ranges complete, a failing range raises here and the pool
+        # is terminated when leaving the context manager
+        for done, (start, end, partition_stats) in enumerate(
+            pool.imap_unordered(
+                index_referrals_partition,
+                [(index, *partition) for partition in partitions],
+            ),
+            start=1,
+        ):
+            count = partition_stats.documents
+            indexed += count
+            if stats is not None:
+                stats.merge(partition_stats)
+            if logger:
+                logger.info(
+                    "Referrals %s to %s indexed (%s documents, %s/%s ranges)",
+                    start,
+                    end,
+                    count,
+                    done,
+                    len(partitions),
+                )
+
+    if logger:
+        logger.info("%s referrals indexed in %s", indexed, index)
+
+    return indexed
+
+
+def parse_since(value):
+    """
+    Parse the start of an incremental indexing from an ISO date or datetime, naive values
+    being in the current timezone. Meant to be used as an argparse type.
+    """
+    since = datetime.fromisoformat(value)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def perform_incremental_indexing(
+    indexable, upsert_changed_since, since=None, logger=None
+):
+    """
+    Send to an index the documents changed since a datetime, or since the watermark of
+    the last successful incremental indexing if none is given, then move the watermark
+    to the time this indexing started.
+    """
+    started_at = timezone.now()
+
+    if since is None:
+        watermark = models.IndexState.objects.get_watermark(indexable.index_name)
+        if watermark is None:
+            raise ValueError(
+                f"No watermark recorded for {indexable.index_name}, "
+                "a first incremental indexing needs an explicit start date"
+            )
+        since = watermark - INCREMENTAL_INDEXING_OVERLAP
+
+    result = upsert_changed_since(since, logger=logger)
+
+    # Only reached if every document was sent, a failed run is retried from the
+    # previous watermark
+    models.IndexState.objects.set_watermark(indexable.index_name, started_at)
+
+    return result
+
+
+# Kinds of differences between an index and the database
+MISSING, STALE, ORPHANED = "missing", "stale", "orphaned"
+
+
+def get_index_fingerprints(indexable, chunk_size=None):
+    """
+    Stream the id and the stored fingerprint of every document in an index, in the order
+    of `indexable.get_fingerprints`. Documents without a stored fingerprint, eg. partially
+    updated ones, get the fingerprint of their current content.
+    """
+    chunk_size = chunk_size or settings.ELASTICSEARCH["CHUNK_SIZE"]
+    body = {
+        "query": {"match_all": {}},
+        "size": chunk_size,
+        "sort": indexable.fingerprints_sort,
+        "_source": ["fingerprint"],
+    }
+
+    while True:
+        hits = ES_CLIENT.search(index=indexable.index_name, body=body)["hits"]["hits"]
+        if not hits:
+            return
+
+        unknown_ids = [
+            hit["_id"] for hit in hits if not hit["_source"].get("fingerprint")
+        ]
+        sources = {}
+        if unknown_ids:
+            sources = {
+                hit["_id"]: hit["_source"]
+                for hit in ES_CLIENT.search(
+                    index=indexable.index_name,
+                    body={
+                        "query": {"ids": {"values": unknown_ids}},
+                        "size": chunk_size,
+                    },
+                )["hits"]["hits"]
+            }
+
+        for hit in hits:
+            yield indexable.get_document_id(hit), (
+                hit["_source"].get("fingerprint")
+                or get_document_fingerprint(sources[hit["_id"]])
+            )
+
+        body["search_after"] = hits[-1]["sort"]
+
+
+def compare_fingerprints(database_fingerprints, index_fingerprints):
+    """
+    Walk two streams of (id, fingerprint) sorted by id, from the database and from the
+    index, and yield (id, difference) for each document that is missing from the index,
+    stale, or orphaned ie. present in the index only.
+    """
+    database_fingerprints = iter(database_fingerprints)
+    index_fingerprints = iter(index_fingerprints)
+    database_item = next(database_fingerprints, None)
+    index_item = next(index_fingerprints, None)
+
+    while database_item is not None or index_item is not None:
+        if index_item is None or (
+            database_item is not None and database_item[0] < index_item[0]
+        ):
+            yield database_item[0], MISSING
+            database_item = next(database_fingerprints, None)
+        elif database_item is None or index_item[0] < database_item[0]:
+            yield index_item[0], ORPHANED
+            index_item = next(index_fingerprints, None)
+        else:
+            if database_item[1] != index_item[1]:
+                yield database_item[0], STALE
+            database_item = next(database_fingerprints, None)
+            index_item = next(index_fingerprints, None)
+
+
+def reconcile_index(indexable, repair=False, logger=None):
+    """
+    Compare an index with the database, document by document, using fingerprints of their
+    content. With `repair`, missing and stale documents are sent again and orphaned ones
+    deleted, by chunks as differences are found.
+    Return the number of documents found for each kind of difference.
+    """
+    chunk_size = settings.ELASTICSEARCH["CHUNK_SIZE"]
+    differences = Counter()
+    ids_to_repair = []
+
+    def repair_documents():
+        # Deleting a document that is already gone is not an error
+        partaj_bulk(
+            indexable.get_es_documents_by_ids(ids_to_repair), ignore_status=[404]
+        )
+        ids_to_repair.clear()
+
+    for document_id, difference in compare_fingerprints(
+        indexable.get_fingerprints(), get_index_fingerprints(indexable)
+    ):
+        differences[difference] += 1
+        if logger:
+            logger.info(
+                "%s: document %s is %s", indexable.index_name, document_id, difference
+            )
+
+        if repair:
+            ids_to_repair.append(document_id)
+            if len(ids_to_repair) >= chunk_size:
+                repair_documents()
+
+    if repair and ids_to_repair:
+        repair_documents()
+
+    return differences
+
+
+@contextmanager
+def bulk_load_profile(index, logger=None):
+    """
+    Disable refresh and replicas on an index while it is bulk loaded. Once the load
+    succeeded, restore its settings, refresh it and merge its segments so it is ready to
+    be searched. Settings are restored even if the load fails.
+    """
+    index_settings = ES_INDICES_CLIENT.get_settings(index=index)[index]["settings"]
+    restored_settings = {
+        "index": {
+            # A missing refresh interval is reset to the default one
+            "refresh_interval": index_settings["index"].get("refresh_interval"),
+            "number_of_replicas": index_settings["index"]["number_of_replicas"],
+        }
+    }
+    ES_INDICES_CLIENT.put_settings(body=BULK_LOAD_SETTINGS, index=index)
+    try:
+        yield
+    finally:
+        ES_INDICES_CLIENT.put_settings(body=restored_settings, index=index)
+
+    if logger:
+        logger.info(f'Refreshing and merging "{index:s}"...')
+    ES_INDICES_CLIENT.refresh(index=index)
+    # elasticsearch-py injects query parameters as kwargs
+    # pylint: disable=unexpected-keyword-arg
+    ES_INDICES_CLIENT.forcemerge(index=index, max_num_segments=1)
+
+
+def perform_rebuild_catch_up(indexable, index, started_at, logger=None):
+    """
+    Send again to a new index the documents that changed since its rebuild started: the
+    load may have overwritten mirrored writes with documents built before the change.
+    Indexers that do not track changes only rely on mirrored writes.
+    """
+    if not hasattr(indexable, "get_es_documents_changed_since"):
+        return 0
+
+    since = started_at - INCREMENTAL_INDEXING_OVERLAP
+    # Deleting a document the load did not send is not an error
+    sent, _ = partaj_bulk(
+        indexable.get_es_documents_changed_since(since, index=index),
+        ignore_status=[404],
+    )
+    if logger:
+        logger.info("%s documents changed during the load sent to %s", sent, index)
+
+    return sent
+
+
+def perform_create_index(indexable, logger=None, workers=1):
     """
     Create a new index in ElasticSearch from an indexable instance.
+    Referrals can be indexed by several worker processes.
+    The index is loaded with a bulk load profile and the throughput of the load is logged,
+    to help tune ES_CHUNK_SIZE.
+    The rebuild is registered so writes to the alias are mirrored to the new index until
+    `regenerate_indices` swaps it in. A failure cancels the rebuild.
     """
     # Create a new index name, suffixing its name with a timestamp
     new_index = f"{indexable.index_name:s}_{timezone.now():%Y-%m-%d-%Hh%Mm%S.%fs}"
@@ -45,8 +391,42 @@ def perform_create_index(indexable, logger=None):
 
     ES_INDICES_CLIENT.put_mapping(body=indexable.mapping, index=new_index)
 
+    # From now on, live writes to the alias are mirrored to the new index
+    started_at = models.IndexState.objects.start_rebuild(
+        indexable.index_name, new_index
+    )
+    # Give every process the time to read the rebuild again before loading the database.
+    # This is only a handshake: a write missed by a process still caching the previous
+    # rebuilds is sent again by the catch-up, which reads the changes since `started_at`
+    # minus INCREMENTAL_INDEXING_OVERLAP once the load is over
+    REBUILD_INDICES.clear()
+    time.sleep(REBUILD_INDICES_TTL)
+
     # Populate the new index with data provided from our indexable class
-    partaj_bulk(indexable.get_es_documents(new_index))
+    stats = BulkLoadStats()
+    try:
+        with bulk_load_profile(new_index, logger=logger):
+            if workers > 1 and indexable is ReferralsIndexer:
+                perform_parallel_referrals_indexing(
+                    new_index, workers, logger=logger, stats=stats
+                )
+            else:
+                partaj_bulk_load(
+                    indexable.get_es_documents(new_index), stats, logger=logger
+                )
+            perform_rebuild_catch_up(indexable, new_index, started_at, logger=logger)
+    except Exception:
+        # The new index will never be swapped in, stop mirroring writes to it
+        models.IndexState.objects.finish_rebuilds([indexable.index_name])
+        raise
+    finally:
+        if logger:
+            logger.info(
+                "Bulk load of %s (chunk size %s): %s",
+                new_index,
+                settings.ELASTICSEARCH["CHUNK_SIZE"],
+                stats.get_summary(),
+            )
 
     # Return the name of the index we just created in ElasticSearch
     return new_index
@@ -75,7 +455,7 @@ def perform_create_empty_index(indexable, logger=None):
     return new_index
 
 
-def regenerate_indices(logger=None):
+def regenerate_indices(logger=None, workers=1):
     """
     Create new indices for our indexables and replace possible existing indices with
     a new one only once it has successfully built it.
@@ -89,9 +469,15 @@ def regenerate_indices(logger=None):
 
     # Create a new index for each of those modules
     # NB: we're mapping perform_create_index which produces side effects
-    indices_to_create = zip(
-        list(map(lambda ix: perform_create_index(ix, logger), ES_INDICES)), ES_INDICES
-    )
+    try:
+        indices_to_create = zip(
+            list(map(lambda ix: perform_create_index(ix, logger, workers), ES_INDICES)),
+            ES_INDICES,
+        )
+    except Exception:
+        # Indices already built will not be swapped in either, stop mirroring writes to them
+        models.IndexState.objects.finish_rebuilds([ix.index_name for ix in ES_INDICES])
+        raise
 
     # ->
 
@@ -149,7 +535,16 @@ def regenerate_indices(logger=None):
             else:
                 raise exception
 
-    perform_aliases_update()
+    try:
+        perform_aliases_update()
+    finally:
+        # The new indices are now behind the aliases, or will never be
+        models.IndexState.objects.finish_rebuilds(
+            [indexable.index_name for indexable in ES_INDICES]
+        )
+        models.IndexGeneration.objects.bump_generations(
+            [indexable.index_name for indexable in ES_INDICES]
+        )
 
     for useless_index in useless_indices:
         # Disable keyword arguments checking as elasticsearch-py uses a decorator to list
@@ -223,6 +618,7 @@ def regenerate_note_index(logger=None):
                 raise exception
 
     perform_aliases_update()
+    models.IndexGeneration.objects.bump_generations([NotesIndexer.index_name])
 
 
 def regenerate_referral_index(logger=None):
@@ -290,3 +686,4 @@ def regenerate_referral_index(logger=None):
                 raise exception
 
     perform_aliases_update()
+    models.IndexGeneration.objects.bump_generations([ReferralsIndexer.index_name])
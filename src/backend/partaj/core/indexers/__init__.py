@@ -5,7 +5,7 @@ Indexing tooling and specialized classes matched with models to index.
 # flake8: noqa
 from .common import *
 from .notes import NotesIndexer
-from .referrals import ReferralsIndexer
+from .referrals import ReferralsIndexer, referral_index_scope
 from .topics import TopicsIndexer
 from .units import UnitsIndexer
 from .users import UsersIndexer
@@ -2,9 +2,22 @@
 Helpers and config for indexing, common to all indexing tasks.
 """
 
+import hashlib
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 from django.conf import settings
+from django.db import transaction
+
+from elasticsearch.helpers import BulkIndexError, expand_action
 
+from partaj.core import models
 from partaj.core.elasticsearch import (
+    DOC_TYPE,
     ElasticsearchClientCompat7to6,
     ElasticsearchIndicesClientCompat7to6,
     bulk_compat,
@@ -98,19 +111,280 @@ COMMON_ANALYSIS_SETTINGS = {
     "max_ngram_diff": "20",
 }
 
-ES_CLIENT = ElasticsearchClientCompat7to6([settings.ELASTICSEARCH["HOST"]], timeout=30)
+
+def get_es_client(timeout=30, **kwargs):
+    """
+    Instantiate a new Elasticsearch client. Processes forked to index in parallel must use
+    their own client instead of sharing the connections of the module client.
+    """
+    return ElasticsearchClientCompat7to6(
+        [settings.ELASTICSEARCH["HOST"]], timeout=timeout, **kwargs
+    )
+
+
+ES_CLIENT = get_es_client()
+# Client for the writes made while a user waits for the response: it fails fast instead
+# of retrying, the outbox worker sends what it could not
+ES_FLUSH_CLIENT = get_es_client(timeout=2, max_retries=0, retry_on_timeout=False)
 ES_INDICES_CLIENT = ElasticsearchIndicesClientCompat7to6(ES_CLIENT)
 
 
-def partaj_bulk(actions, **kwargs):
-    """Wrap bulk helper to set default parameters."""
-    return bulk_compat(
-        actions=actions,
-        chunk_size=settings.ELASTICSEARCH["CHUNK_SIZE"],
-        client=ES_CLIENT,
-        stats_only=True,
-        **kwargs
+# Seconds during which each process reuses the rebuilds in progress it read last
+REBUILD_INDICES_TTL = 2
+
+
+class RebuildIndicesCache:
+    """
+    Rebuilds in progress, read from the database at most once every `ttl` seconds by
+    each process instead of on every write.
+    """
+
+    def __init__(self, ttl=REBUILD_INDICES_TTL):
+        self.ttl = ttl
+        self.last_read = (None, None)
+
+    def get(self):
+        """
+        Return the new index being built for each alias, reading it again if stale.
+        """
+        rebuild_indices, read_at = self.last_read
+        now = time.monotonic()
+        if read_at is None or now - read_at >= self.ttl:
+            rebuild_indices = models.IndexState.objects.get_rebuild_indices()
+            self.last_read = (rebuild_indices, now)
+        return rebuild_indices
+
+    def clear(self):
+        """
+        Forget the last read, for the next write to read the rebuilds again.
+        """
+        self.last_read = (None, None)
+
+
+REBUILD_INDICES = RebuildIndicesCache()
+
+
+def mirror_actions(actions, rebuild_indices, mirrored):
+    """
+    Collect a copy of the actions on an alias that is being rebuilt, for the new index
+    of this alias, in `mirrored`.
+    """
+    for action in actions:
+        yield action
+        rebuild_index = rebuild_indices.get(action.get("_index"))
+        if rebuild_index:
+            mirrored.append({**action, "_index": rebuild_index})
+
+
+def track_indices(actions, indices):
+    """
+    Collect the indices the actions are sent to as they go through.
+    """
+    for action in actions:
+        indices.add(action.get("_index"))
+        yield action
+
+
+def bump_generations_on_commit(indices):
+    """
+    Bump the generation of the indices written to once the current transaction, if any,
+    is committed, so the generations are never locked while Elasticsearch is written to.
+    """
+    indices = set(indices) - {None}
+    if indices:
+        transaction.on_commit(
+            lambda: models.IndexGeneration.objects.bump_generations(indices)
+        )
+
+
+def partaj_bulk(actions, client=None, **kwargs):
+    """
+    Wrap bulk helper to set default parameters, sending with the module client unless
+    another one is given. Writes to an alias are mirrored to the new index being built
+    for it, if any, so they are not lost when it is swapped in.
+    The generation of the indices written to is bumped after commit, even if the bulk
+    failed midway.
+    """
+    client = client or ES_CLIENT
+    kwargs.setdefault("stats_only", True)
+    written_indices = set()
+    mirrored = []
+    actions = track_indices(actions, written_indices)
+    rebuild_indices = REBUILD_INDICES.get()
+    if rebuild_indices:
+        actions = mirror_actions(actions, rebuild_indices, mirrored)
+    try:
+        result = bulk_compat(
+            actions=actions,
+            chunk_size=settings.ELASTICSEARCH["CHUNK_SIZE"],
+            client=client,
+            **kwargs,
+        )
+        if mirrored:
+            # The document may not be loaded in the new index yet: the bulk load or
+            # the catch-up that follows it writes its latest version anyway
+            bulk_compat(
+                actions=mirrored,
+                chunk_size=settings.ELASTICSEARCH["CHUNK_SIZE"],
+                client=client,
+                **{
+                    **kwargs,
+                    "ignore_status": (404, *kwargs.get("ignore_status", ())),
+                },
+            )
+        return result
+    finally:
+        bump_generations_on_commit(written_indices)
+
+
+class BulkLoadStats:
+    """
+    Throughput of a bulk load: documents and bytes sent, latency and failures of each
+    chunk. Stats of worker processes can be merged into the stats of the whole load.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.documents = 0
+        self.bytes_sent = 0
+        # (documents, bytes sent, latency in seconds, failures) of each chunk
+        self.chunks = []
+
+    def add_chunk(self, documents, bytes_sent, latency, failures):
+        """Record a bulk request."""
+        self.documents += documents
+        self.bytes_sent += bytes_sent
+        self.chunks.append((documents, bytes_sent, latency, failures))
+
+    def merge(self, other):
+        """Add the chunks recorded by another load, eg. from a worker process."""
+        for chunk in other.chunks:
+            self.add_chunk(*chunk)
+
+    @property
+    def failures(self):
+        """Number of actions that failed, over all chunks."""
+        return sum(chunk[3] for chunk in self.chunks)
+
+    def get_latency_percentile(self, percentile):
+        """Latency of bulk requests at a percentile, in seconds (nearest rank)."""
+        latencies = sorted(chunk[2] for chunk in self.chunks)
+        if not latencies:
+            return 0
+        return latencies[max(0, math.ceil(percentile / 100 * len(latencies)) - 1)]
+
+    def get_summary(self):
+        """Sum up the load, to be logged once it is over."""
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "documents": self.documents,
+            "chunks": len(self.chunks),
+            "bytes_sent": self.bytes_sent,
+            "elapsed": round(elapsed, 3),
+            "docs_per_second": round(self.documents / elapsed, 1) if elapsed else 0,
+            "latency_p50": round(self.get_latency_percentile(50), 3),
+            "latency_p95": round(self.get_latency_percentile(95), 3),
+            "latency_max": round(self.get_latency_percentile(100), 3),
+            "failures": self.failures,
+            "chunks_with_failures": sum(1 for chunk in self.chunks if chunk[3]),
+        }
+
+
+def serialize_bulk_chunk(actions, serializer):
+    """Serialize a chunk of actions to the body of a bulk request."""
+    lines = []
+    for action in actions:
+        operation, data = expand_action(action)
+        lines.append(serializer.dumps(operation))
+        if data is not None:
+            lines.append(serializer.dumps(data))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def partaj_bulk_load(actions, stats, client=None, thread_count=1, logger=None):
+    """
+    Send actions to Elasticsearch by chunks of CHUNK_SIZE, recording the size, latency and
+    failures of each bulk request in `stats`. The next chunk is serialized while up to
+    `thread_count` chunks are being sent.
+    Like the bulk helper, raise a BulkIndexError once a chunk has failed actions.
+    """
+    client = client or ES_CLIENT
+    chunk_size = settings.ELASTICSEARCH["CHUNK_SIZE"]
+    if client.__es_version__ == "6":
+        actions = ({**action, "_type": DOC_TYPE} for action in actions)
+    actions = iter(actions)
+
+    def send_chunk(body, documents):
+        started_at = time.monotonic()
+        response = client.bulk(body=body)
+        latency = time.monotonic() - started_at
+        errors = [
+            item
+            for item in response["items"]
+            if not 200 <= next(iter(item.values())).get("status", 500) < 300
+        ]
+        return documents, len(body), latency, errors
+
+    def record_chunk(future):
+        documents, bytes_sent, latency, errors = future.result()
+        stats.add_chunk(documents, bytes_sent, latency, len(errors))
+        if errors:
+            if logger:
+                logger.warning(
+                    "Chunk %s: %s of %s actions failed",
+                    len(stats.chunks),
+                    len(errors),
+                    documents,
+                )
+            raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+
+    serializer = client.transport.serializer
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        while chunk := list(islice(actions, chunk_size)):
+            body = serialize_bulk_chunk(chunk, serializer)
+            pending.append(executor.submit(send_chunk, body, len(chunk)))
+            if len(pending) >= thread_count:
+                record_chunk(pending.popleft())
+
+        while pending:
+            record_chunk(pending.popleft())
+
+    return stats
+
+
+# Keys of a document that are not part of its content
+DOCUMENT_METADATA_KEYS = {"_id", "_index", "_op_type", "_type", "fingerprint"}
+
+
+def get_document_fingerprint(document):
+    """
+    Hash the content of a document, as sent to or returned by Elasticsearch. Keys are
+    sorted, so a document partially updated in the index gets the same fingerprint as the
+    same document indexed at once.
+    """
+    content = {
+        key: value
+        for key, value in document.items()
+        if key not in DOCUMENT_METADATA_KEYS
+    }
+    serialized = json.dumps(
+        content,
+        default=ES_CLIENT.transport.serializer.default,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
     )
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def add_document_fingerprint(document):
+    """
+    Store the fingerprint of its content in a document, so the index can be compared with
+    the database without fetching whole documents.
+    """
+    document["fingerprint"] = get_document_fingerprint(document)
+    return document
 
 
 DEFAULT_DELIMITERS = [" ", "/", "|"]
@@ -4,11 +4,14 @@ Methods and configuration related to the indexing of Notes objects.
 """
 
 import datetime
+from collections import defaultdict
+from itertools import islice
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Collate
 
-from partaj.core.indexers import partaj_bulk
+from partaj.core.indexers import add_document_fingerprint, partaj_bulk
 
 from .. import models
 from ..serializers import NoteDocumentSerializer
@@ -110,8 +113,14 @@ class NotesIndexer:
             "referral_id": {
                 "type": "text",
                 "analyzer": "french",
+                "fields": {
+                    # Unique value to sort on, to paginate with search_after
+                    "keyword": {"type": "keyword"},
+                },
             },
             "publication_date": {"type": "date"},
+            # Hash of the document content, used to compare the index with the database
+            "fingerprint": {"type": "keyword", "index": False},
             "object": {
                 "type": "text",
                 "analyzer": "french",
@@ -203,18 +212,25 @@ class NotesIndexer:
     }
 
     @classmethod
-    def get_es_document_for_note(cls, note, index=None, action="index"):
-        """Build an Elasticsearch document from the note instance."""
+    def get_es_document_for_note(
+        cls, note, index=None, action="index", siblings_ids=None
+    ):
+        """
+        Build an Elasticsearch document from the note instance. Pass the ids of its
+        published siblings when they were preloaded for a batch of notes.
+        """
         index = index or cls.index_name
+        if siblings_ids is None:
+            siblings_ids = [sibling.id for sibling in note.get_published_siblings()]
 
         # Conditionally use the first user in those lists for sorting
-        return {
+        document = {
             "_id": note.referral_id,
             "_index": index,
             "_op_type": action,
             "id": note.id,
             "referral_id": note.referral_id,
-            "siblings": [sibling.id for sibling in note.get_published_siblings()],
+            "siblings": sorted(siblings_ids),
             "publication_date": note.publication_date,
             "object": note.object,
             "topic": note.topic,
@@ -226,6 +242,120 @@ class NotesIndexer:
             "document": NoteDocumentSerializer(note.document).data,
         }
 
+        return add_document_fingerprint(document)
+
+    @classmethod
+    def get_published_siblings_ids(cls, notes):
+        """
+        Get the ids of the published siblings of each note of a batch, in a single query.
+        Same as `ReferralNote.get_published_siblings`, for notes loaded with their referral
+        and its section.
+        """
+        sections = {}
+        for note in notes:
+            # Missing reverse relations raise an AttributeError subclass
+            referral = getattr(note, "referral", None)
+            section = getattr(referral, "section", None)
+            if section is not None:
+                sections[note.id] = section
+
+        siblings_by_group = defaultdict(list)
+        for group_id, section_id, referral_id in models.ReferralSection.objects.filter(
+            group_id__in={section.group_id for section in sections.values()},
+            referral__state=models.ReferralState.ANSWERED,
+        ).values_list("group_id", "id", "referral_id"):
+            siblings_by_group[group_id].append((section_id, referral_id))
+
+        return {
+            note_id: [
+                referral_id
+                for section_id, referral_id in siblings_by_group[section.group_id]
+                if section_id != section.id
+            ]
+            for note_id, section in sections.items()
+        }
+
+    @classmethod
+    def get_es_documents_for_queryset(cls, queryset, index=None, action="index"):
+        """
+        Build Elasticsearch documents for the notes of a queryset, streamed by chunks of
+        CHUNK_SIZE notes. Each chunk is loaded with the documents, referrals and sections
+        of its notes, plus one query for their siblings.
+        """
+        index = index or cls.index_name
+        chunk_size = settings.ELASTICSEARCH["CHUNK_SIZE"]
+        notes = queryset.select_related("document", "referral__section").iterator(
+            chunk_size=chunk_size
+        )
+
+        while chunk := list(islice(notes, chunk_size)):
+            siblings_ids = cls.get_published_siblings_ids(chunk)
+            for note in chunk:
+                yield cls.get_es_document_for_note(
+                    note,
+                    index=index,
+                    action=action,
+                    siblings_ids=siblings_ids.get(note.id, []),
+                )
+
+    # Sort of the documents in the index matching the order of `get_fingerprints`:
+    # documents are identified by their referral id, sorted on its doc-valued subfield
+    # rather than on `_id`, which has no doc values to sort on
+    fingerprints_sort = [
+        {"referral_id.keyword": {"order": "asc", "unmapped_type": "keyword"}}
+    ]
+
+    # States of the notes that have a document in the index
+    INDEXED_STATES = [
+        models.ReferralNoteStatus.TO_SEND,
+        models.ReferralNoteStatus.ACTIVE,
+    ]
+
+    @classmethod
+    def get_document_id(cls, hit):
+        """
+        Get the id of a document returned by Elasticsearch, as used in the database.
+        """
+        return hit["_id"]
+
+    @classmethod
+    def get_fingerprints(cls):
+        """
+        Stream the id and the fingerprint of the document that each indexed note in the
+        database should have in the index, ordered like document ids in Elasticsearch.
+        """
+        notes = models.ReferralNote.objects.filter(
+            state__in=cls.INDEXED_STATES
+        ).order_by(Collate("referral_id", "C"))
+        previous_id = None
+        for document in cls.get_es_documents_for_queryset(notes):
+            # Notes of the same referral share a document
+            if document["_id"] == previous_id:
+                continue
+            previous_id = document["_id"]
+            yield document["_id"], document["fingerprint"]
+
+    @classmethod
+    def get_es_documents_by_ids(cls, referral_ids, index=None):
+        """
+        Build index actions for the indexed notes of the given referral ids, which are
+        also their document ids, and delete actions for the ids without an indexed note.
+        """
+        index = index or cls.index_name
+        missing_ids = set(referral_ids)
+
+        for document in cls.get_es_documents_for_queryset(
+            models.ReferralNote.objects.filter(
+                referral_id__in=referral_ids, state__in=cls.INDEXED_STATES
+            ),
+            index=index,
+        ):
+            missing_ids.discard(document["_id"])
+            yield document
+
+        for referral_id in sorted(missing_ids):
+            yield {"_id": referral_id, "_index": index, "_op_type": "delete"}
+
     @classmethod
     def get_es_documents_by_publication_date(
         cls, from_date, to_date, index=None, action="index", logger=None
@@ -245,23 +375,76 @@ class NotesIndexer:
         from_year, from_month, from_day = get_spliced_date(from_date)
         to_year, to_month, to_day = get_spliced_date(to_date)
 
-        for note in models.ReferralNote.objects.filter(
-            publication_date__range=(
-                datetime.date(from_year, from_month, from_day),
-                datetime.date(to_year, to_month, to_day),
-            )
-        ).all():
-            yield cls.get_es_document_for_note(note, index=index, action=action)
+        yield from cls.get_es_documents_for_queryset(
+            models.ReferralNote.objects.filter(
+                publication_date__range=(
+                    datetime.date(from_year, from_month, from_day),
+                    datetime.date(to_year, to_month, to_day),
+                )
+            ),
+            index=index,
+            action=action,
+        )
 
     @classmethod
-    def get_es_documents_by_state(cls, states, index=None, action="index", logger=None):
+    # pylint: disable=too-many-arguments
+    def get_es_documents_by_state(
+        cls, states, index=None, action="index", logger=None, updated_before=None
+    ):
         """
         Loop on all the referrals in database and format them for the ElasticSearch index.
+        Notes updated after `updated_before` are left out when it is given.
+        """
+        index = index or cls.index_name
+
+        notes = models.ReferralNote.objects.filter(state__in=states)
+        if updated_before is not None:
+            notes = notes.filter(updated_at__lte=updated_before)
+
+        yield from cls.get_es_documents_for_queryset(
+            notes,
+            index=index,
+            action=action,
+        )
+
+    @classmethod
+    def get_es_documents_changed_since(cls, since, index=None):
+        """
+        Build index actions for the notes updated since the given datetime that belong
+        in the index, and delete actions for the ones that were removed from it.
         """
         index = index or cls.index_name
+        removed_states = [
+            models.ReferralNoteStatus.TO_DELETE,
+            models.ReferralNoteStatus.INACTIVE,
+        ]
+
+        notes = models.ReferralNote.objects.filter(updated_at__gte=since).exclude(
+            # Text extraction is not done yet, `update_notes` will send these ones
+            state=models.ReferralNoteStatus.RECEIVED
+        )
+
+        # Deletions go first, a referral whose old note was removed may have a new one
+        yield from cls.get_es_documents_for_queryset(
+            notes.filter(state__in=removed_states), index=index, action="delete"
+        )
+        yield from cls.get_es_documents_for_queryset(
+            notes.exclude(state__in=removed_states), index=index
+        )
 
-        for note in models.ReferralNote.objects.filter(state__in=states).all():
-            yield cls.get_es_document_for_note(note, index=index, action=action)
+    @classmethod
+    def upsert_notes_documents_changed_since(cls, since, logger=None):
+        """
+        Upsert or delete the notes updated since the given datetime
+        """
+        if logger:
+            logger.info("Sending notes changed since %s to ES", since)
+
+        # Ignore 404 on notes that were removed before they reached the index
+        return partaj_bulk(
+            cls.get_es_documents_changed_since(since=since, index=cls.index_name),
+            ignore_status=[404],
+        )
 
     @classmethod
     def upsert_notes_documents_by_publication_date(
@@ -285,7 +468,7 @@ class NotesIndexer:
         )
 
     @classmethod
-    def upsert_notes_documents_by_state(cls, states, logger=None):
+    def upsert_notes_documents_by_state(cls, states, updated_before=None, logger=None):
         """
         Upsert notes to elastic search index
         """
@@ -299,11 +482,12 @@ class NotesIndexer:
                 index=cls.index_name,
                 action="index",
                 logger=logger,
+                updated_before=updated_before,
             )
         )
 
     @classmethod
-    def delete_notes_documents_by_state(cls, states, logger=None):
+    def delete_notes_documents_by_state(cls, states, updated_before=None, logger=None):
         """
         Delete notes in elastic search notes index
         """
@@ -318,6 +502,7 @@ class NotesIndexer:
                 index=cls.index_name,
                 action="delete",
                 logger=logger,
+                updated_before=updated_before,
             ),
             ignore_status=[404],
         )
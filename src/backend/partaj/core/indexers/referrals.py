@@ -1,19 +1,47 @@
+# pylint: disable=C0302
+# Too many lines in module
 """
 Methods and configuration related to the indexing of Referral objects.
 """
 
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Max
+
+from elasticsearch.exceptions import ElasticsearchException
+from elasticsearch.helpers import BulkIndexError
 
 from .. import models, services
 from ..indexers import COMMON_ANALYSIS_SETTINGS
-from ..models import ReferralUserLinkRoles, ReportEventState
-from ..serializers import EventLiteSerializer, ReferralLiteSerializer
-from .common import partaj_bulk
+from ..models import ReferralIndexFieldGroup, ReferralUserLinkRoles, ReportEventState
+from ..serializers import (
+    EventLiteSerializer,
+    ReferralLitePreloadedSerializer,
+    ReferralLiteSerializer,
+    UserLiteSerializer,
+)
+from .common import ES_FLUSH_CLIENT, add_document_fingerprint, partaj_bulk
 
 User = get_user_model()
 
+# Groups of fields of the referral documents that depend on a related model, used to know
+# what to update when this model changes. None means the whole document depends on it,
+# an empty list means no field of the document does: eg. memberships are checked against
+# the `units` of the documents at query time, never stored in them.
+# Links and assignments are not listed: they are changed through the referral, which
+# marks the groups of fields they affect and is saved afterwards.
+REFERRAL_DOCUMENT_DEPENDENCIES = {
+    "core.unitmembership": [],
+    "core.referralurgency": [ReferralIndexFieldGroup.DUE_DATE],
+}
+
 STATE_TO_NUMBER = {
     models.ReferralState.DRAFT: 7,
     models.ReferralState.RECEIVED: 6,
@@ -25,6 +53,277 @@ STATE_TO_NUMBER = {
 }
 
 
+# pylint: disable=too-many-instance-attributes
+class ReferralsDocumentsBatch:
+    """
+    Preload, in a fixed number of queries, all the related data needed to build the
+    Elasticsearch documents for a chunk of referrals.
+    Documents built from a batch are identical to the ones built one by one by
+    `ReferralsIndexer.get_es_document_for_referral`.
+    """
+
+    def __init__(self, referrals):
+        """
+        Load related data for referrals fetched with `ReferralsIndexer.get_referrals_chunks`.
+        """
+        self.referrals = list(referrals)
+        referral_ids = [referral.id for referral in self.referrals]
+        report_ids = [
+            referral.report_id for referral in self.referrals if referral.report_id
+        ]
+
+        feature_flags = {
+            feature_flag.tag: feature_flag
+            for feature_flag in models.FeatureFlag.objects.filter(
+                tag__in=["referral_version", "working_day_urgency"]
+            )
+        }
+        self.referral_version_flag = feature_flags.get("referral_version")
+        self.working_day_urgency_flag = feature_flags.get("working_day_urgency")
+
+        # Requesters and observers, with their user
+        self.userlinks = defaultdict(list)
+        for userlink in models.ReferralUserLink.objects.filter(
+            referral_id__in=referral_ids
+        ).select_related("user"):
+            self.userlinks[userlink.referral_id].append(userlink)
+
+        # Last version of each report, as returned by `ReferralReport.get_last_version`
+        self.last_versions = {
+            version.report_id: version
+            for version in models.ReferralReportVersion.objects.filter(
+                report_id__in=report_ids
+            )
+            .order_by("report_id", "-created_at")
+            .distinct("report_id")
+        }
+
+        # Active events of the last versions
+        self.events = defaultdict(list)
+        for event in (
+            models.ReportEvent.objects.filter(
+                version_id__in=[version.id for version in self.last_versions.values()],
+                state=ReportEventState.ACTIVE,
+            )
+            .select_related("metadata", "user")
+            .order_by("created_at")
+        ):
+            self.events[event.version_id].append(event)
+        self.serialized_events = {}
+
+        # Validators asked for a report validation (referral answer version 2)
+        self.report_validators = defaultdict(list)
+        for report_id, validator_id in (
+            models.ReferralReportValidationRequest.validators.through.objects.filter(
+                referralreportvalidationrequest__report_id__in=report_ids
+            )
+            .order_by("id")
+            .values_list("referralreportvalidationrequest__report_id", "user_id")
+        ):
+            self.report_validators[report_id].append(validator_id)
+
+        # Validators with a pending answer validation (referral answer version 1)
+        self.answer_validators = defaultdict(list)
+        for (
+            referral_id,
+            validator_id,
+        ) in models.ReferralAnswerValidationRequest.objects.filter(
+            answer__referral_id__in=referral_ids,
+            response=None,
+        ).values_list(
+            "answer__referral_id", "validator_id"
+        ):
+            self.answer_validators[referral_id].append(validator_id)
+
+        # Last published answer date (referral answer version 1)
+        self.answer_published_dates = dict(
+            models.ReferralAnswer.objects.filter(
+                referral_id__in=referral_ids,
+                state=models.ReferralAnswerState.PUBLISHED,
+            )
+            .order_by()
+            .values("referral_id")
+            .annotate(published_date=Max("created_at"))
+            .values_list("referral_id", "published_date")
+        )
+
+        # First users in alphabetical order, used for sorting
+        self.assignees_sorting = {
+            assignment.referral_id: assignment.assignee
+            for assignment in models.ReferralAssignment.objects.filter(
+                referral_id__in=referral_ids
+            )
+            .select_related("assignee")
+            .order_by("referral_id", "assignee__first_name")
+            .distinct("referral_id")
+        }
+        self.users_unit_name_sorting = {
+            userlink.referral_id: userlink.user
+            for userlink in models.ReferralUserLink.objects.filter(
+                referral_id__in=referral_ids
+            )
+            .select_related("user")
+            .order_by("referral_id", "user__unit_name")
+            .distinct("referral_id")
+        }
+
+    def is_referral_answer_v2(self, referral):
+        """
+        Same as `FeatureFlagService.get_referral_version`, with the preloaded feature flag.
+        """
+        return services.FeatureFlagService.get_referral_state(
+            self.referral_version_flag, referral
+        )
+
+    def get_due_date(self, referral):
+        """
+        Same as `Referral.get_due_date`, with the preloaded feature flag.
+        """
+        return referral.get_due_date(
+            use_working_day_urgency=services.FeatureFlagService.get_referral_state(
+                self.working_day_urgency_flag, referral
+            )
+        )
+
+    def get_userlinks(self, referral, role=None):
+        """
+        Get the user links of the referral, optionally restricted to one role.
+        """
+        return [
+            userlink
+            for userlink in self.userlinks[referral.id]
+            if role is None or userlink.role == role
+        ]
+
+    def get_last_version(self, referral):
+        """
+        Get the last version of the referral report if any.
+        """
+        if not referral.report_id:
+            return None
+        return self.last_versions.get(referral.report_id)
+
+    def get_serialized_events(self, referral):
+        """
+        Serialize the active events of the last report version, only once per referral.
+        """
+        if referral.id not in self.serialized_events:
+            self.serialized_events[referral.id] = EventLiteSerializer(
+                self.events[self.get_last_version(referral).id], many=True
+            ).data
+        return self.serialized_events[referral.id]
+
+    def get_answer_published_date(self, referral):
+        """
+        Get the date of the last published answer (referral answer version 1).
+        """
+        return self.answer_published_dates.get(referral.id)
+
+    def get_es_document(self, referral, index, action="index"):
+        """Build an Elasticsearch document from a referral of the batch."""
+        expected_validators = []
+        serialized_events = []
+        last_version = self.get_last_version(referral)
+        # If the referral is in referral answer version 2 (referral_report etc..)
+        if self.is_referral_answer_v2(referral):
+            if last_version:
+                serialized_events = self.get_serialized_events(referral)
+                # Deduplicate validators the same way as the one by one build does
+                expected_validators = list(
+                    set(self.report_validators[referral.report_id])
+                )
+                published_date = referral.report.published_at
+            else:
+                published_date = None
+        else:
+            expected_validators = self.answer_validators[referral.id]
+            published_date = self.get_answer_published_date(referral)
+
+        userlinks = self.userlinks[referral.id]
+        requesters = self.get_userlinks(referral, ReferralUserLinkRoles.REQUESTER)
+        assignees = list(referral.assignees.all())
+        units = list(referral.units.all())
+        assignees_sorting = self.assignees_sorting.get(referral.id)
+        users_unit_name_sorting = self.users_unit_name_sorting.get(referral.id)
+        document = {
+            "_id": referral.id,
+            "_index": index,
+            "_op_type": action,
+            # _source._lite will be used to return serialized referral lites on the API
+            # that are identical to what Postgres-based referral lite endpoints returned
+            "_lite": ReferralLitePreloadedSerializer(
+                referral, context={"batch": self}
+            ).data,
+            "assignees": [user.id for user in assignees],
+            "assignees_sorting": (
+                assignees_sorting.get_full_name() if assignees_sorting else ""
+            ),
+            "case_number": referral.id,
+            "referral_id": referral.id,
+            "context": referral.context,
+            "due_date": self.get_due_date(referral),
+            "created_at": referral.created_at,
+            "sent_at": referral.sent_at,
+            "expected_validators": expected_validators,
+            "object": referral.object,
+            "prior_work": referral.prior_work,
+            "question": referral.question,
+            "state": referral.state,
+            "state_number": STATE_TO_NUMBER.get(referral.state, 0),
+            "topic": referral.topic.id if referral.topic else None,
+            "topic_text": referral.topic.name if referral.topic else None,
+            "sub_title": referral.sub_title,
+            "theme": {
+                "id": referral.topic.id if referral.topic else None,
+                "name_keyword": referral.topic.name if referral.topic else None,
+                "name_search": referral.topic.name if referral.topic else None,
+            },
+            "assigned_users": [
+                {
+                    "id": user.id,
+                    "name_keyword": user.get_full_name(),
+                    "name_search": user.get_full_name(),
+                }
+                for user in assignees
+            ],
+            "requester_users": [
+                {
+                    "id": userlink.user.id,
+                    "name_keyword": userlink.user.get_full_name(),
+                    "name_search": userlink.user.get_full_name(),
+                }
+                for userlink in requesters
+            ],
+            "contributors_unit_names": [
+                {
+                    "id": unit.id,
+                    "name_keyword": unit.name,
+                    "name_search": unit.name,
+                }
+                for unit in units
+            ],
+            "units": [unit.id for unit in units],
+            "users": [userlink.user.id for userlink in userlinks],
+            "observers": [
+                userlink.user.id
+                for userlink in self.get_userlinks(
+                    referral, ReferralUserLinkRoles.OBSERVER
+                )
+            ],
+            "published_date": published_date,
+            "users_unit_name": [userlink.user.unit_name for userlink in requesters],
+            "users_unit_name_sorting": (
+                users_unit_name_sorting.unit_name if users_unit_name_sorting else ""
+            ),
+            "status": referral.status,
+            "title": referral.title,
+            "events": serialized_events,
+            "last_author": last_version.created_by_id if last_version else None,
+        }
+
+        return add_document_fingerprint(document)
+
+
 class ReferralsIndexer:
     """
     Makes available the parameters the indexer requires as well as functions to shape
@@ -36,6 +335,9 @@ class ReferralsIndexer:
 
     mapping = {
         "properties": {
+            # Only returned as is by the API, never searched: keep it in the source
+            # without indexing it
+            "_lite": {"type": "object", "enabled": False},
             # Role-based filtering fields
             "assignees": {"type": "keyword"},
             "events": {
@@ -116,6 +418,8 @@ class ReferralsIndexer:
             "observers": {"type": "keyword"},
             # Data and filtering fields
             "case_number": {"type": "integer"},
+            # Hash of the document content, used to compare the index with the database
+            "fingerprint": {"type": "keyword", "index": False},
             "referral_id": {
                 "type": "text",
                 "fields": {
@@ -298,7 +602,7 @@ class ReferralsIndexer:
         # Conditionally use the first user in those lists for sorting
         assignees_sorting = referral.assignees.order_by("first_name").first()
         users_unit_name_sorting = referral.users.order_by("unit_name").first()
-        return {
+        document = {
             "_id": referral.id,
             "_index": index,
             "_op_type": action,
@@ -386,19 +690,131 @@ class ReferralsIndexer:
             ),
         }
 
+        return add_document_fingerprint(document)
+
     @classmethod
-    def get_es_documents(cls, index=None, action="index"):
+    def get_partial_es_document_for_referral(cls, referral, field_groups, index=None):
         """
-        Loop on all the referrals in database and format them for the ElasticSearch index.
+        Build a partial update action for some groups of fields of the referral document.
+        Elasticsearch merges the `_lite` object of the update into the stored one.
         """
         index = index or cls.index_name
+        lite_serializer = ReferralLiteSerializer()
+        document = {}
+        lite = {}
 
-        for referral in (
-            models.Referral.objects.all()
-            .select_related("topic", "urgency_level")
-            .prefetch_related("assignees", "units", "user")
-        ):
-            yield cls.get_es_document_for_referral(referral, index=index, action=action)
+        if ReferralIndexFieldGroup.TITLE in field_groups:
+            document.update(title=referral.title, sub_title=referral.sub_title)
+            lite.update(title=referral.title, sub_title=referral.sub_title)
+
+        if ReferralIndexFieldGroup.DUE_DATE in field_groups:
+            document.update(due_date=referral.get_due_date())
+            lite.update(due_date=lite_serializer.get_due_date(referral))
+
+        if ReferralIndexFieldGroup.ASSIGNEES in field_groups:
+            assignees = referral.assignees.all()
+            assignees_sorting = referral.assignees.order_by("first_name").first()
+            document.update(
+                assignees=[user.id for user in assignees],
+                assignees_sorting=(
+                    assignees_sorting.get_full_name() if assignees_sorting else ""
+                ),
+                assigned_users=[
+                    {
+                        "id": user.id,
+                        "name_keyword": user.get_full_name(),
+                        "name_search": user.get_full_name(),
+                    }
+                    for user in assignees
+                ],
+            )
+            lite.update(assignees=UserLiteSerializer(assignees, many=True).data)
+
+        if ReferralIndexFieldGroup.USERS in field_groups:
+            requesters = referral.users.filter(
+                referraluserlink__role=ReferralUserLinkRoles.REQUESTER
+            ).all()
+            users_unit_name_sorting = referral.users.order_by("unit_name").first()
+            document.update(
+                requester_users=[
+                    {
+                        "id": user.id,
+                        "name_keyword": user.get_full_name(),
+                        "name_search": user.get_full_name(),
+                    }
+                    for user in requesters
+                ],
+                users=[user.id for user in referral.users.all()],
+                observers=[
+                    user.id
+                    for user in referral.users.filter(
+                        referraluserlink__role=ReferralUserLinkRoles.OBSERVER
+                    ).all()
+                ],
+                users_unit_name=[user.unit_name for user in requesters],
+                users_unit_name_sorting=(
+                    users_unit_name_sorting.unit_name if users_unit_name_sorting else ""
+                ),
+            )
+            lite.update(
+                requesters=lite_serializer.get_requesters(referral),
+                users=lite_serializer.get_users(referral),
+                observers=lite_serializer.get_observers(referral),
+            )
+
+        return {
+            "_id": referral.id,
+            "_index": index,
+            "_op_type": "update",
+            # The stored fingerprint does not match the updated content anymore
+            "doc": {"_lite": lite, **document, "fingerprint": None},
+        }
+
+    @classmethod
+    def get_referrals_chunks(cls, queryset, chunk_size=None):
+        """
+        Iterate on the referrals of a queryset by chunks of bounded size, paginating on ids
+        so a chunk never holds more than `chunk_size` referrals in memory.
+        """
+        chunk_size = chunk_size or settings.ELASTICSEARCH["CHUNK_SIZE"]
+        queryset = (
+            queryset.order_by("id")
+            .select_related("topic", "urgency_level", "report")
+            .prefetch_related("assignees", "units")
+        )
+
+        last_id = None
+        while True:
+            chunk_queryset = (
+                queryset.filter(id__gt=last_id) if last_id is not None else queryset
+            )
+            chunk = list(chunk_queryset[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].id
+
+    @classmethod
+    def get_es_documents_for_queryset(cls, queryset, index=None, action="index"):
+        """
+        Stream the documents for the referrals in a queryset, building them chunk by chunk
+        with a constant number of queries per chunk.
+        """
+        index = index or cls.index_name
+
+        for chunk in cls.get_referrals_chunks(queryset):
+            batch = ReferralsDocumentsBatch(chunk)
+            for referral in batch.referrals:
+                yield batch.get_es_document(referral, index=index, action=action)
+
+    @classmethod
+    def get_es_documents(cls, index=None, action="index"):
+        """
+        Loop on all the referrals in database and format them for the ElasticSearch index.
+        """
+        return cls.get_es_documents_for_queryset(
+            models.Referral.objects.all(), index=index, action=action
+        )
 
     @classmethod
     def get_es_documents_by_id_range(
@@ -407,15 +823,256 @@ class ReferralsIndexer:
         """
         Loop on all the referrals in database and format them for the ElasticSearch index.
         """
+        return cls.get_es_documents_for_queryset(
+            models.Referral.objects.filter(id__gte=from_id, id__lte=to_id),
+            index=index,
+            action=action,
+        )
+
+    @classmethod
+    def get_es_documents_by_ids(cls, referral_ids, index=None):
+        """
+        Build index actions for the given referral ids, and delete actions for the ids that
+        do not match any referral in the database anymore.
+        """
         index = index or cls.index_name
+        missing_ids = set(referral_ids)
 
-        for referral in (
-            models.Referral.objects.filter(id__gte=from_id, id__lte=to_id)
-            .all()
-            .select_related("topic", "urgency_level")
-            .prefetch_related("assignees", "units", "user")
+        for document in cls.get_es_documents_for_queryset(
+            models.Referral.objects.filter(id__in=referral_ids), index=index
         ):
-            yield cls.get_es_document_for_referral(referral, index=index, action=action)
+            missing_ids.discard(document["_id"])
+            yield document
+
+        for referral_id in sorted(missing_ids):
+            yield {"_id": referral_id, "_index": index, "_op_type": "delete"}
+
+    # Sort of the documents in the index matching the order of `get_fingerprints`
+    fingerprints_sort = [{"case_number": "asc"}]
+
+    @classmethod
+    def get_document_id(cls, hit):
+        """
+        Get the id of a document returned by Elasticsearch, as used in the database.
+        """
+        return int(hit["_id"])
+
+    @classmethod
+    def get_fingerprints(cls):
+        """
+        Stream the id and the fingerprint of the document that each referral in the
+        database should have in the index, ordered by id.
+        """
+        for document in cls.get_es_documents():
+            yield document["_id"], document["fingerprint"]
+
+    @classmethod
+    def get_referral_ids_changed_since(cls, since):
+        """
+        Return the ids of the referrals whose document may have changed since the given
+        datetime: the referral itself or one of the rows that feed its document was
+        created or updated. Removing a link or an assignment goes through a referral
+        transition, which saves the referral and bumps its own `updated_at`.
+        """
+        querysets = [
+            models.Referral.objects.filter(updated_at__gte=since).values_list("id"),
+            models.ReferralUserLink.objects.filter(updated_at__gte=since).values_list(
+                "referral_id"
+            ),
+            models.ReferralAssignment.objects.filter(updated_at__gte=since).values_list(
+                "referral_id"
+            ),
+            models.ReferralUnitAssignment.objects.filter(
+                updated_at__gte=since
+            ).values_list("referral_id"),
+            models.ReferralAnswer.objects.filter(updated_at__gte=since).values_list(
+                "referral_id"
+            ),
+            models.ReferralReportVersion.objects.filter(
+                updated_at__gte=since
+            ).values_list("report__referral__id"),
+            models.ReportEvent.objects.filter(updated_at__gte=since).values_list(
+                "report__referral__id"
+            ),
+        ]
+
+        return {
+            referral_id
+            for queryset in querysets
+            for (referral_id,) in queryset.iterator()
+            if referral_id is not None
+        }
+
+    @classmethod
+    def get_es_documents_changed_since(cls, since, index=None):
+        """
+        Build index actions for the referrals that changed since the given datetime.
+        """
+        return cls.get_es_documents_by_ids(
+            cls.get_referral_ids_changed_since(since), index=index
+        )
+
+    @classmethod
+    def upsert_referrals_documents_changed_since(cls, since, logger=None):
+        """
+        Send to Elasticsearch the documents of the referrals that changed since the given
+        datetime. Return the number of referral documents that were sent.
+        """
+        referral_ids = cls.get_referral_ids_changed_since(since)
+        if logger:
+            logger.info(
+                "Sending %s referrals changed since %s to ES", len(referral_ids), since
+            )
+
+        if referral_ids:
+            partaj_bulk(cls.get_es_documents_by_ids(referral_ids), ignore_status=[404])
+
+        return len(referral_ids)
+
+    @classmethod
+    def update_referrals_field_groups(cls, field_groups_by_referral_id, client=None):
+        """
+        Partially update the documents of some referrals, given the groups of fields to
+        update for each referral id. Documents missing from the index, eg. referrals that
+        were never indexed, are built and sent in full instead.
+        """
+        referrals = models.Referral.objects.filter(
+            id__in=field_groups_by_referral_id.keys()
+        ).select_related("urgency_level")
+        _, errors = partaj_bulk(
+            (
+                cls.get_partial_es_document_for_referral(
+                    referral, field_groups_by_referral_id[referral.id]
+                )
+                for referral in referrals
+            ),
+            client=client,
+            stats_only=False,
+            raise_on_error=False,
+        )
+
+        missing_ids = {
+            int(error["update"]["_id"])
+            for error in errors
+            if error.get("update", {}).get("status") == 404
+        }
+        if len(missing_ids) < len(errors):
+            raise BulkIndexError(
+                f"{len(errors) - len(missing_ids)} document(s) failed to update.",
+                errors,
+            )
+        if missing_ids:
+            partaj_bulk(cls.get_es_documents_by_ids(missing_ids), client=client)
+
+    @classmethod
+    def enqueue_dependent_referrals(cls, model, queryset, chunk_size=None):
+        """
+        Schedule the update of the documents of the referrals in a queryset after a change
+        on a related model, restricted to the fields that depend on this model. Referral
+        ids are streamed to the outbox by chunks so a large queryset is never loaded at
+        once. Return the number of referrals scheduled.
+        """
+        field_groups = REFERRAL_DOCUMENT_DEPENDENCIES[model._meta.label_lower]
+        if field_groups is not None and not field_groups:
+            return 0
+
+        chunk_size = chunk_size or settings.ELASTICSEARCH["CHUNK_SIZE"]
+        referral_ids = queryset.values_list("id", flat=True).iterator(
+            chunk_size=chunk_size
+        )
+
+        count = 0
+        while chunk := list(islice(referral_ids, chunk_size)):
+            models.ReferralIndexOutbox.objects.enqueue_many(
+                chunk, field_groups=field_groups
+            )
+            count += len(chunk)
+
+        return count
+
+    @classmethod
+    def send_outbox_entries(cls, entries, logger=None, client=None):
+        """
+        Send the documents for outbox entries locked by the current transaction, given as
+        (id, referral id, field groups) tuples, in as few bulk calls as possible, then
+        remove the entries. Return the ids of the referrals that were sent.
+        """
+        # A referral is rebuilt in full as soon as one of its entries asks for it,
+        # otherwise the groups of fields of all its entries are updated together
+        full_ids = set()
+        field_groups_by_referral_id = defaultdict(set)
+        for _, referral_id, field_groups in entries:
+            if field_groups:
+                field_groups_by_referral_id[referral_id].update(field_groups)
+            else:
+                full_ids.add(referral_id)
+        for referral_id in full_ids:
+            field_groups_by_referral_id.pop(referral_id, None)
+
+        if logger:
+            logger.info(
+                "Sending %s referrals from the outbox to ES, %s partially",
+                len(full_ids) + len(field_groups_by_referral_id),
+                len(field_groups_by_referral_id),
+            )
+
+        # Deleting a document that was never indexed is not an error
+        if full_ids:
+            partaj_bulk(
+                cls.get_es_documents_by_ids(full_ids),
+                client=client,
+                ignore_status=[404],
+            )
+        if field_groups_by_referral_id:
+            cls.update_referrals_field_groups(
+                field_groups_by_referral_id, client=client
+            )
+
+        models.ReferralIndexOutbox.objects.filter(
+            id__in=[entry_id for entry_id, _, _ in entries]
+        ).delete()
+
+        return full_ids | set(field_groups_by_referral_id)
+
+    @classmethod
+    def process_outbox(cls, batch_size=None, logger=None):
+        """
+        Drain one batch of the referral index outbox: rebuild the documents for all the
+        distinct referral ids it holds in a single bulk call, then remove the processed
+        entries. If Elasticsearch fails, the transaction is rolled back and the entries
+        are kept for the next attempt.
+        Return the number of referral documents that were sent.
+        """
+        batch_size = batch_size or settings.ELASTICSEARCH["CHUNK_SIZE"]
+
+        with transaction.atomic():
+            # Skip entries locked by another worker so several workers can run side by side
+            entries = list(
+                models.ReferralIndexOutbox.objects.select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "referral_id", "field_groups")[:batch_size]
+            )
+            if not entries:
+                return 0
+
+            return len(cls.send_outbox_entries(entries, logger=logger))
+
+    @classmethod
+    def process_outbox_entries(cls, entry_ids, client=None):
+        """
+        Process some outbox entries right away, skipping the ones a worker is already
+        processing. Return the ids of the referrals that were sent.
+        """
+        with transaction.atomic():
+            entries = list(
+                models.ReferralIndexOutbox.objects.filter(id__in=entry_ids)
+                .select_for_update(skip_locked=True)
+                .values_list("id", "referral_id", "field_groups")
+            )
+            if not entries:
+                return set()
+
+            return cls.send_outbox_entries(entries, client=client)
 
     @classmethod
     def update_referral_document(cls, referral):
@@ -458,3 +1115,42 @@ class ReferralsIndexer:
                 action="index",
             )
         )
+
+
+def flush_referral_index_scope(scope):
+    """
+    Send the documents of the referrals changed in a closed referral index scope. This is
+    best effort: if Elasticsearch fails or is slow, the outbox entries are left to the
+    worker rather than holding the response.
+    """
+    try:
+        sent = ReferralsIndexer.process_outbox_entries(
+            [entry_id for entry_id, _ in scope.entries.values()],
+            client=ES_FLUSH_CLIENT,
+        )
+    except ElasticsearchException as error:
+        logging.getLogger("partaj").warning(
+            "Unable to send referrals changed in the request: %s", error
+        )
+        return
+
+    for referral_id in sent:
+        scope.written[referral_id] = scope.written.get(referral_id, 0) + 1
+
+
+@contextmanager
+def referral_index_scope():
+    """
+    Coalesce the referral index updates made inside the block, eg. a request: each changed
+    referral gets a single outbox entry, and all of them are sent to Elasticsearch in one
+    go once the current transaction is committed.
+    """
+    scope = models.ReferralIndexScope()
+    token = models.current_referral_index_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        models.current_referral_index_scope.reset(token)
+
+    if scope.entries:
+        transaction.on_commit(lambda: flush_referral_index_scope(scope))
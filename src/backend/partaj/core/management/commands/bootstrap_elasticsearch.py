@@ -20,13 +20,24 @@ class Command(BaseCommand):
 
     help = __doc__
 
+    def add_arguments(self, parser):
+        """
+        Define arguments
+        """
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes used to index referrals",
+        )
+
     def handle(self, *args, **options):
         # Keep track of starting time for logging purposes
         logger.info("Starting to regenerate ES indices...")
 
         # Creates new indices each time, populates them, and atomically replaces
         # the old indices once the new ones are ready.
-        regenerate_indices(logger)
+        regenerate_indices(logger, workers=options["workers"])
 
         # Confirm operation success through the logger
         logger.info("ES indices regenerated.")
@@ -4,8 +4,9 @@ Handle ElasticSearch setup that needs to be done at bootstrap time.
 
 import logging
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from partaj.core.index_manager import parse_since, perform_incremental_indexing
 from partaj.core.indexers import NotesIndexer
 
 logger = logging.getLogger("partaj")
@@ -16,6 +17,9 @@ class Command(BaseCommand):
     Send notes to ElasticSearch depending on publication date's range
     specified in args.
     Ex: docker-compose exec app python manage.py es_index_notes 2020-10-10 2024-12-10
+    Use --since to only send notes changed since a date, or --resume to only send
+    notes changed since the last successful --since/--resume run.
+    Ex: docker-compose exec app python manage.py es_index_notes --resume
     """
 
     help = __doc__
@@ -24,10 +28,43 @@ class Command(BaseCommand):
         """
         Define arguments
         """
-        parser.add_argument("from", type=str)
-        parser.add_argument("to", type=str)
+        parser.add_argument("from", type=str, nargs="?")
+        parser.add_argument("to", type=str, nargs="?")
+        parser.add_argument(
+            "--since",
+            type=parse_since,
+            help="Only send notes changed since this ISO date or datetime",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Only send notes changed since the last incremental indexing",
+        )
+
+    def handle_incremental(self, since):
+        """
+        Send notes changed since a datetime, or since the stored watermark.
+        """
+        logger.info("Starting to send changed notes to the Note index...")
+        try:
+            result = perform_incremental_indexing(
+                NotesIndexer,
+                NotesIndexer.upsert_notes_documents_changed_since,
+                since=since,
+                logger=logger,
+            )
+        except ValueError as error:
+            raise CommandError(error) from error
+        logger.info("ES notes sent: %s", result)
 
     def handle(self, *args, **options):
+        if options["since"] or options["resume"]:
+            self.handle_incremental(options["since"])
+            return
+
+        if options["from"] is None or options["to"] is None:
+            raise CommandError("Give a publication date range, --since or --resume")
+
         # Keep track of starting time for logging purposes
         from_date = options["from"]
         to_date = options["to"]
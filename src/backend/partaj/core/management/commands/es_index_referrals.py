@@ -4,8 +4,13 @@ Handle ElasticSearch setup that needs to be done at bootstrap time.
 
 import logging
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from partaj.core.index_manager import (
+    parse_since,
+    perform_incremental_indexing,
+    perform_parallel_referrals_indexing,
+)
 from partaj.core.indexers import ReferralsIndexer
 
 logger = logging.getLogger("partaj")
@@ -16,6 +21,10 @@ class Command(BaseCommand):
     Send referrals to ElasticSearch depending on id range
     specified in args.
     Ex: docker-compose exec app python manage.py es_index_referrals 0 1000
+    Use --workers to split the range between several processes.
+    Use --since to only send referrals changed since a date, or --resume to only send
+    referrals changed since the last successful --since/--resume run.
+    Ex: docker-compose exec app python manage.py es_index_referrals --resume
     """
 
     help = __doc__
@@ -24,10 +33,49 @@ class Command(BaseCommand):
         """
         Define arguments
         """
-        parser.add_argument("from", type=int)
-        parser.add_argument("to", type=int)
+        parser.add_argument("from", type=int, nargs="?")
+        parser.add_argument("to", type=int, nargs="?")
+        parser.add_argument(
+            "--since",
+            type=parse_since,
+            help="Only send referrals changed since this ISO date or datetime",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Only send referrals changed since the last incremental indexing",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes used to index referrals",
+        )
+
+    def handle_incremental(self, since):
+        """
+        Send referrals changed since a datetime, or since the stored watermark.
+        """
+        logger.info("Starting to send changed referrals to the Referrals index...")
+        try:
+            sent = perform_incremental_indexing(
+                ReferralsIndexer,
+                ReferralsIndexer.upsert_referrals_documents_changed_since,
+                since=since,
+                logger=logger,
+            )
+        except ValueError as error:
+            raise CommandError(error) from error
+        logger.info("ES Referrals sent: %s", sent)
 
     def handle(self, *args, **options):
+        if options["since"] or options["resume"]:
+            self.handle_incremental(options["since"])
+            return
+
+        if options["from"] is None or options["to"] is None:
+            raise CommandError("Give an id range, --since or --resume")
+
         # Keep track of starting time for logging purposes
         from_id = options["from"]
         to_id = options["to"]
@@ -37,8 +85,17 @@ class Command(BaseCommand):
             to_id,
         )
 
-        ReferralsIndexer.insert_referrals_documents_by_id_range(
-            from_id=from_id, to_id=to_id, logger=logger
-        )
+        if options["workers"] > 1:
+            perform_parallel_referrals_indexing(
+                ReferralsIndexer.index_name,
+                options["workers"],
+                from_id=from_id,
+                to_id=to_id,
+                logger=logger,
+            )
+        else:
+            ReferralsIndexer.insert_referrals_documents_by_id_range(
+                from_id=from_id, to_id=to_id, logger=logger
+            )
 
         logger.info("ES Referrals sent")
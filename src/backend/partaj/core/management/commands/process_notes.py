@@ -0,0 +1,71 @@
+"""
+Bring published notes to the knowledge base index as they come.
+"""
+
+import logging
+import time
+
+from django.core.management.base import CommandError
+from django.db import close_old_connections
+
+from partaj.core.services.note_pipeline import NotePipeline, has_pending_notes
+
+from .update_notes import Command as UpdateNotesCommand
+
+logger = logging.getLogger("partaj")
+
+
+class Command(UpdateNotesCommand):
+    """
+    Extract, send and remove the pending notes, as update_notes does.
+    Without --loop, process the pending notes once and exit. With --loop, keep polling
+    the notes published or removed since, this is meant to run as a worker process.
+    Ex: docker-compose exec app python manage.py process_notes --loop
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """
+        Define arguments
+        """
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the pending notes instead of exiting once they are done",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds to wait between two polls when no note is pending",
+        )
+
+    def handle(self, *args, **options):
+        if not options["loop"]:
+            super().handle(*args, **options)
+            return
+
+        if options["force"]:
+            # Active notes would be sent again on every poll
+            raise CommandError("--force cannot be used with --loop")
+
+        logger.info("Starting to process notes...")
+        pipeline = NotePipeline(
+            workers=options["workers"],
+            timeout=options["timeout"],
+            memory_limit=options["memory_limit"] * 1024 * 1024,
+            budget={
+                "max_pages": options["max_pages"],
+                "max_chars": options["max_chars"],
+            },
+            logger=logger,
+        )
+
+        while True:
+            # Long running process: do not keep using a connection the database dropped
+            close_old_connections()
+            if has_pending_notes():
+                pipeline.run()
+            time.sleep(options["interval"])
@@ -0,0 +1,79 @@
+"""
+Drain the referral index outbox and send the pending referral documents to ElasticSearch.
+"""
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from elasticsearch.exceptions import ElasticsearchException
+
+from partaj.core.indexers import ReferralsIndexer
+
+logger = logging.getLogger("partaj")
+
+
+class Command(BaseCommand):
+    """
+    Send pending referrals from the outbox to ElasticSearch, in batches.
+    Without --loop, drain the outbox once and exit. With --loop, keep polling the outbox,
+    this is meant to run as a worker process.
+    Ex: docker-compose exec app python manage.py process_referral_index_outbox --loop
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """
+        Define arguments
+        """
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting once it is empty",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait between two polls of an empty outbox",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Maximum number of outbox entries to send in one bulk request",
+        )
+
+    def drain(self, batch_size):
+        """
+        Process outbox batches until the outbox is empty.
+        """
+        sent = 0
+        while True:
+            batch_sent = ReferralsIndexer.process_outbox(
+                batch_size=batch_size, logger=logger
+            )
+            if not batch_sent:
+                return sent
+            sent += batch_sent
+
+    def handle(self, *args, **options):
+        logger.info("Starting to process the referral index outbox...")
+
+        if not options["loop"]:
+            sent = self.drain(options["batch_size"])
+            logger.info("Referral index outbox processed, %s documents sent", sent)
+            return
+
+        while True:
+            # Long running process: do not keep using a connection the database dropped
+            close_old_connections()
+            try:
+                self.drain(options["batch_size"])
+            except ElasticsearchException as error:
+                # Entries are kept in the outbox, they will be retried on the next poll
+                logger.warning("Unable to process the referral index outbox: %s", error)
+            time.sleep(options["interval"])
@@ -0,0 +1,59 @@
+"""
+Compare the referrals and notes indices with the database and optionally repair them.
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from partaj.core.index_manager import MISSING, ORPHANED, STALE, reconcile_index
+from partaj.core.indexers import NotesIndexer, ReferralsIndexer
+
+logger = logging.getLogger("partaj")
+
+INDEXERS = {"referrals": ReferralsIndexer, "notes": NotesIndexer}
+
+
+class Command(BaseCommand):
+    """
+    Compare the documents in the referrals and notes indices with the ones built from the
+    database, using the fingerprint of their content, and report missing, stale and
+    orphaned documents. Use --repair to send or delete them.
+    Ex: docker-compose exec app python manage.py reconcile_indices --repair
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        """
+        Define arguments
+        """
+        parser.add_argument(
+            "--index",
+            choices=INDEXERS.keys(),
+            action="append",
+            help="Index to reconcile, all of them by default",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Send missing and stale documents and delete orphaned ones",
+        )
+
+    def handle(self, *args, **options):
+        for name in options["index"] or INDEXERS.keys():
+            indexer = INDEXERS[name]
+            logger.info("Starting to reconcile the %s index...", indexer.index_name)
+
+            differences = reconcile_index(
+                indexer, repair=options["repair"], logger=logger
+            )
+
+            logger.info(
+                "%s index: %s missing, %s stale, %s orphaned documents%s",
+                indexer.index_name,
+                differences[MISSING],
+                differences[STALE],
+                differences[ORPHANED],
+                ", repaired" if options["repair"] else "",
+            )
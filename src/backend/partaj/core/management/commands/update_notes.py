@@ -3,17 +3,13 @@ Handle ElasticSearch setup that needs to be done at bootstrap time.
 """
 
 import logging
+import os
 
 from django.core.management.base import BaseCommand, CommandParser
 
-from partaj.core.indexers import NotesIndexer
-from partaj.core.management.commands.generate_notes import SupportedExtensionTypes
-from partaj.core.models import ReferralNote, ReferralNoteStatus
-from partaj.core.services.file_handler import HtmlConverter, TextExtractor
+from partaj.core.services.note_pipeline import NotePipeline
 
 logger = logging.getLogger("partaj")
-# pylint: disable=broad-except
-# pylint: disable=too-many-branches
 
 
 class Command(BaseCommand):
@@ -21,6 +17,8 @@ class Command(BaseCommand):
     Update notes
     - 1- Extract and save text from RECEIVED status notes files
     - 2- Create / Remove notes in elastic search index
+    The process_notes worker does this as notes are published, this command is the
+    nightly sweep catching up on anything it missed.
     """
 
     help = __doc__
@@ -31,79 +29,49 @@ class Command(BaseCommand):
             action="store_true",
             help="Force the update on active not as well",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of documents extracted in parallel, one process each",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=300,
+            help="Seconds of CPU and wall time after which a document extraction is killed",
+        )
+        parser.add_argument(
+            "--memory-limit",
+            type=int,
+            default=1024,
+            help="Megabytes a document extraction can allocate before it fails",
+        )
+        parser.add_argument(
+            "--max-pages",
+            type=int,
+            default=None,
+            help="Only extract the text of the first pages of pdf documents",
+        )
+        parser.add_argument(
+            "--max-chars",
+            type=int,
+            default=None,
+            help="Truncate the text extracted from pdf documents",
+        )
 
     def handle(self, *args, **options):
         logger.info("Starting to update notes...")
 
-        # 1- Extract and save text from RECEIVED status notes files
-        received_notes = ReferralNote.objects.filter(
-            state=ReferralNoteStatus.RECEIVED
-        ).all()
-
-        for note in received_notes:
-            try:
-                extension = note.document.get_extension()
-                logger.info("Found %s type", extension)
-
-                if extension not in SupportedExtensionTypes.values:
-                    logger.warning("Extension %s not supported, ignoring", extension)
-                    note.state = ReferralNoteStatus.ERROR
-                    note.save()
-                    continue
-
-                if extension == SupportedExtensionTypes.DOCX:
-                    if not note.text:
-                        note.text = TextExtractor().from_docx(note.document)
-                    if not note.html:
-                        note.html = HtmlConverter().from_docx(note.document)
-
-                elif extension == SupportedExtensionTypes.PDF:
-                    if not note.text:
-                        note.text = TextExtractor.from_pdf(note.document)
-
-                note.state = ReferralNoteStatus.TO_SEND
-                note.save()
-            except (ValueError, Exception) as error:
-                note.state = ReferralNoteStatus.ERROR
-                note.save()
-                logger.warning(
-                    "Value Error: Referral n° %s :failed to create notice :",
-                    note.referral.id,
-                )
-                for i in error.args:
-                    logger.info(i)
-
-        # 2- Create / Remove notes in elastic search index
-        try:
-            referral_note_status_to_upsert = (
-                [ReferralNoteStatus.TO_SEND, ReferralNoteStatus.ACTIVE]
-                if options["force"]
-                else [ReferralNoteStatus.TO_SEND]
-            )
-            upsert_result = NotesIndexer.upsert_notes_documents_by_state(
-                states=referral_note_status_to_upsert,
-                logger=logger,
-            )
-            logger.info("Result: %s", upsert_result)
-            ReferralNote.objects.filter(state=ReferralNoteStatus.TO_SEND).update(
-                state=ReferralNoteStatus.ACTIVE
-            )
-        except (ValueError, Exception) as error:
-            logger.error("Unable to upsert notes:")
-            for i in error.args:
-                logger.error(i)
-
-        try:
-            delete_result = NotesIndexer.delete_notes_documents_by_state(
-                states=[ReferralNoteStatus.TO_DELETE], logger=logger
-            )
-            logger.info("Delete result: %s", delete_result)
-            ReferralNote.objects.filter(state=ReferralNoteStatus.TO_DELETE).update(
-                state=ReferralNoteStatus.INACTIVE
-            )
-        except (ValueError, Exception) as error:
-            logger.error("Unable to delete notes:")
-            for i in error.args:
-                logger.error(i)
+        NotePipeline(
+            workers=options["workers"],
+            timeout=options["timeout"],
+            memory_limit=options["memory_limit"] * 1024 * 1024,
+            budget={
+                "max_pages": options["max_pages"],
+                "max_chars": options["max_chars"],
+            },
+            logger=logger,
+        ).run(force=options["force"])
 
         logger.info("Notes updated.")
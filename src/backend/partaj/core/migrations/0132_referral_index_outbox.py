@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0131_convert_unique_together_to_constraints"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReferralIndexOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        editable=False,
+                        help_text="Primary key for the referral index outbox entry",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="id",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created at"),
+                ),
+                (
+                    "referral_id",
+                    models.IntegerField(
+                        help_text="Id of the referral whose document must be refreshed",
+                        verbose_name="referral id",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "referral index outbox entry",
+                "db_table": "partaj_referral_index_outbox",
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0132_referral_index_outbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexState",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Name of the Elasticsearch index alias",
+                        max_length=255,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="name",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="updated at"),
+                ),
+                (
+                    "watermark",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Start time of the last successful incremental indexing, changes made before it are in the index",
+                        null=True,
+                        verbose_name="watermark",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "index state",
+                "db_table": "partaj_index_state",
+            },
+        ),
+        migrations.AddField(
+            model_name="referralassignment",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="updated at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="referralunitassignment",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="updated at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="referraluserlink",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="updated at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="reportevent",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="updated at"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="referral",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="updated at"
+            ),
+        ),
+    ]
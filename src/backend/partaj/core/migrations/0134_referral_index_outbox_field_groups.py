@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:24
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0133_index_state_and_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="referralindexoutbox",
+            name="field_groups",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(
+                    choices=[
+                        ("title", "title"),
+                        ("due_date", "due date"),
+                        ("assignees", "assignees"),
+                        ("users", "users"),
+                    ],
+                    max_length=32,
+                ),
+                blank=True,
+                default=list,
+                help_text="Groups of fields to update in the document, the whole document is rebuilt when empty",
+                size=None,
+                verbose_name="field groups",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0134_referral_index_outbox_field_groups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="indexstate",
+            name="rebuild_index",
+            field=models.CharField(
+                blank=True,
+                help_text="Name of the index being built to replace the one behind the alias, writes to the alias are mirrored to it",
+                max_length=255,
+                null=True,
+                verbose_name="rebuild index",
+            ),
+        ),
+        migrations.AddField(
+            model_name="indexstate",
+            name="rebuild_started_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Start time of the rebuild in progress",
+                null=True,
+                verbose_name="rebuild started at",
+            ),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0135_index_state_rebuild"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentExtraction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        editable=False,
+                        help_text="Primary key for the document extraction",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="id",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created at"),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(
+                        help_text="SHA-256 of the content of the extracted file",
+                        max_length=64,
+                        verbose_name="content hash",
+                    ),
+                ),
+                (
+                    "extractor",
+                    models.CharField(
+                        help_text="What was extracted from the file, eg. text from a pdf",
+                        max_length=32,
+                        verbose_name="extractor",
+                    ),
+                ),
+                (
+                    "extractor_version",
+                    models.CharField(
+                        help_text="Version of the extraction and of the library used for it",
+                        max_length=64,
+                        verbose_name="extractor version",
+                    ),
+                ),
+                (
+                    "text",
+                    models.TextField(
+                        blank=True,
+                        help_text="Text or html extracted from the file",
+                        verbose_name="text",
+                    ),
+                ),
+                (
+                    "messages",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="Warnings of the extractor, as [type, message] pairs",
+                        verbose_name="messages",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "document extraction",
+                "db_table": "partaj_document_extraction",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("content_hash", "extractor", "extractor_version"),
+                        name="unique_document_extraction",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0136_document_extraction"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexGeneration",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Name of the Elasticsearch index alias",
+                        max_length=255,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="name",
+                    ),
+                ),
+                (
+                    "generation",
+                    models.PositiveBigIntegerField(
+                        default=0,
+                        help_text="Incremented each time the index is written to",
+                        verbose_name="generation",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="updated at"),
+                ),
+            ],
+            options={
+                "verbose_name": "index generation",
+                "db_table": "partaj_index_generation",
+            },
+        ),
+    ]
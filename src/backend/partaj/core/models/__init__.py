@@ -5,12 +5,16 @@ Make models.py a module containing one file per model as it was getting too long
 # flake8: noqa
 
 from .attachment import *
+from .document_extraction import *
 from .featureflag import *
+from .index_generation import *
+from .index_state import *
 from .notification import *
 from .referral import *
 from .referral_activity import *
 from .referral_answer import *
 from .referral_group import *
+from .referral_index_outbox import *
 from .referral_message import *
 from .referral_note import *
 from .referral_relationship import *
@@ -0,0 +1,98 @@
+"""
+Document extraction model in our core app.
+"""
+
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class DocumentExtractionManager(models.Manager):
+    """
+    Add helpers to read and write the cache of document extractions.
+    """
+
+    def get_cached(self, content_hash, extractor, extractor_version):
+        """
+        Return the (text, messages) extracted from a file content by this version of an
+        extractor, or None if it was never extracted.
+        """
+        return (
+            self.filter(
+                content_hash=content_hash,
+                extractor=extractor,
+                extractor_version=extractor_version,
+            )
+            .values_list("text", "messages")
+            .first()
+        )
+
+    def store(self, content_hash, extractor, extractor_version, text, messages=()):
+        """
+        Record what this version of an extractor extracted from a file content. Another
+        process may have stored it in the meantime, which is fine.
+        """
+        self.get_or_create(
+            content_hash=content_hash,
+            extractor=extractor,
+            extractor_version=extractor_version,
+            defaults={"text": text, "messages": list(messages)},
+        )
+
+
+class DocumentExtraction(models.Model):
+    """
+    Text or html extracted from a file, identified by the hash of its content, so the same
+    file is never parsed twice by the same version of an extractor.
+    """
+
+    id = models.BigAutoField(
+        verbose_name=_("id"),
+        help_text=_("Primary key for the document extraction"),
+        primary_key=True,
+        editable=False,
+    )
+    created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+
+    content_hash = models.CharField(
+        verbose_name=_("content hash"),
+        help_text=_("SHA-256 of the content of the extracted file"),
+        max_length=64,
+    )
+    extractor = models.CharField(
+        verbose_name=_("extractor"),
+        help_text=_("What was extracted from the file, eg. text from a pdf"),
+        max_length=32,
+    )
+    extractor_version = models.CharField(
+        verbose_name=_("extractor version"),
+        help_text=_("Version of the extraction and of the library used for it"),
+        max_length=64,
+    )
+
+    text = models.TextField(
+        verbose_name=_("text"),
+        help_text=_("Text or html extracted from the file"),
+        blank=True,
+    )
+    messages = models.JSONField(
+        verbose_name=_("messages"),
+        help_text=_("Warnings of the extractor, as [type, message] pairs"),
+        blank=True,
+        default=list,
+    )
+
+    objects = DocumentExtractionManager()
+
+    class Meta:
+        db_table = "partaj_document_extraction"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_hash", "extractor", "extractor_version"],
+                name="unique_document_extraction",
+            )
+        ]
+        verbose_name = _("document extraction")
+
+    def __str__(self):
+        """Get the string representation of a document extraction."""
+        return f"{self._meta.verbose_name.title()} {self.extractor} {self.content_hash}"
@@ -0,0 +1,68 @@
+"""
+Index generation model in our core app.
+"""
+
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class IndexGenerationManager(models.Manager):
+    """
+    Add helpers to read and bump the generation of an Elasticsearch index.
+    """
+
+    def get_generation(self, name):
+        """
+        Return the generation of this index with the time it was last bumped, to tell
+        apart search results cached before and after a write. The generation of an index
+        is created on its first read, for the writes to it to bump it from then.
+        """
+        generation = (
+            self.filter(name=name).values_list("generation", "updated_at").first()
+        )
+        if generation is None:
+            self.get_or_create(name=name)
+            return (0, None)
+        return generation
+
+    def bump_generations(self, names):
+        """
+        Record that these indices were written to, invalidating the search results cached
+        for them. Only indices whose generation is read are bumped: names of the physical
+        indices behind the aliases are skipped.
+        """
+        self.filter(name__in=names).update(
+            generation=F("generation") + 1, updated_at=timezone.now()
+        )
+
+
+class IndexGeneration(models.Model):
+    """
+    Generation of an Elasticsearch index, bumped by every write to it. It is kept apart
+    from the index state so writers never wait on the watermark or rebuild state.
+    """
+
+    name = models.CharField(
+        verbose_name=_("name"),
+        help_text=_("Name of the Elasticsearch index alias"),
+        max_length=255,
+        primary_key=True,
+    )
+    generation = models.PositiveBigIntegerField(
+        verbose_name=_("generation"),
+        help_text=_("Incremented each time the index is written to"),
+        default=0,
+    )
+    updated_at = models.DateTimeField(verbose_name=_("updated at"), auto_now=True)
+
+    objects = IndexGenerationManager()
+
+    class Meta:
+        db_table = "partaj_index_generation"
+        verbose_name = _("index generation")
+
+    def __str__(self):
+        """Get the string representation of an index generation."""
+        return f"{self._meta.verbose_name.title()} {self.name}"
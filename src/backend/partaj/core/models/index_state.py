@@ -0,0 +1,110 @@
+"""
+Index state model in our core app.
+"""
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class IndexStateManager(models.Manager):
+    """
+    Add helpers to read and write the state of an Elasticsearch index.
+    """
+
+    def get_watermark(self, name):
+        """
+        Return the start time of the last successful incremental indexing of this index,
+        or None if it never ran.
+        """
+        return (
+            self.filter(name=name).values_list("watermark", flat=True).first() or None
+        )
+
+    def set_watermark(self, name, watermark):
+        """
+        Record that every change made before `watermark` has reached this index.
+        """
+        self.update_or_create(name=name, defaults={"watermark": watermark})
+
+    def start_rebuild(self, name, index):
+        """
+        Record that a new index is being built for this alias, so writes to the alias are
+        mirrored to it until it is swapped in. Return the start time of the rebuild.
+        """
+        started_at = timezone.now()
+        self.update_or_create(
+            name=name,
+            defaults={"rebuild_index": index, "rebuild_started_at": started_at},
+        )
+        return started_at
+
+    def finish_rebuilds(self, names=None):
+        """
+        Stop mirroring writes to the indices built for these aliases, or for all aliases.
+        """
+        queryset = self.filter(rebuild_index__isnull=False)
+        if names is not None:
+            queryset = queryset.filter(name__in=names)
+        queryset.update(rebuild_index=None, rebuild_started_at=None)
+
+    def get_rebuild_indices(self):
+        """
+        Return the index being built for each alias with a rebuild in progress.
+        """
+        return dict(
+            self.filter(rebuild_index__isnull=False).values_list(
+                "name", "rebuild_index"
+            )
+        )
+
+
+class IndexState(models.Model):
+    """
+    State of an Elasticsearch index, shared by all the processes that write to it.
+    """
+
+    name = models.CharField(
+        verbose_name=_("name"),
+        help_text=_("Name of the Elasticsearch index alias"),
+        max_length=255,
+        primary_key=True,
+    )
+    updated_at = models.DateTimeField(verbose_name=_("updated at"), auto_now=True)
+
+    watermark = models.DateTimeField(
+        verbose_name=_("watermark"),
+        help_text=_(
+            "Start time of the last successful incremental indexing, "
+            "changes made before it are in the index"
+        ),
+        blank=True,
+        null=True,
+    )
+
+    rebuild_index = models.CharField(
+        verbose_name=_("rebuild index"),
+        help_text=_(
+            "Name of the index being built to replace the one behind the alias, "
+            "writes to the alias are mirrored to it"
+        ),
+        max_length=255,
+        blank=True,
+        null=True,
+    )
+    rebuild_started_at = models.DateTimeField(
+        verbose_name=_("rebuild started at"),
+        help_text=_("Start time of the rebuild in progress"),
+        blank=True,
+        null=True,
+    )
+
+    objects = IndexStateManager()
+
+    class Meta:
+        db_table = "partaj_index_state"
+        verbose_name = _("index state")
+
+    def __str__(self):
+        """Get the string representation of an index state."""
+        return f"{self._meta.verbose_name.title()} {self.name}"
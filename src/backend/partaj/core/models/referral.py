@@ -23,6 +23,7 @@ from .referral_answer import (
     ReferralAnswerValidationRequest,
     ReferralAnswerValidationResponse,
 )
+from .referral_index_outbox import ReferralIndexFieldGroup, ReferralIndexOutbox
 from .referral_note import ReferralNote, ReferralNoteStatus
 from .referral_reopened_history import ReferralReopenedHistory
 from .referral_report import ReferralReport
@@ -109,7 +110,9 @@ class Referral(models.Model):
         editable=False,
     )
     created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
-    updated_at = models.DateTimeField(verbose_name=_("updated at"), auto_now=True)
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"), auto_now=True, db_index=True
+    )
     sent_at = models.DateTimeField(
         verbose_name=_("sent at"),
         blank=True,
@@ -378,32 +381,95 @@ class Referral(models.Model):
         """Get the string representation of a referral."""
         return f"{self._meta.verbose_name.title()} #{self.id}"
 
-    def save(self, *args, **kwargs):
+    # Fields of the referral that feed only some groups of fields of its document, other
+    # fields are used all over the document and changing them requires a full rebuild.
+    # This includes the state: transitions also write the answers, reports, validation
+    # requests and events the published date, validators and events are built from.
+    INDEX_FIELD_GROUPS = {
+        "title": ReferralIndexFieldGroup.TITLE,
+        "sub_title": ReferralIndexFieldGroup.TITLE,
+        "urgency_level_id": ReferralIndexFieldGroup.DUE_DATE,
+        "updated_at": None,
+        "default_send_to_knowledge_base": None,
+        "override_send_to_knowledge_base": None,
+    }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Keep the values loaded from the database to know which fields changed on save.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance.set_index_snapshot()
+        return instance
+
+    def set_index_snapshot(self):
+        """
+        Record the current value of the loaded fields, and forget the field groups marked
+        as changed so far.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        self._index_snapshot = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+        self._index_field_groups = set()
+
+    def mark_index_field_groups(self, *field_groups):
+        """
+        Declare groups of fields of the document changed by an update of related objects,
+        they are sent to Elasticsearch on the next save.
         """
-        Override the default save method to update the Elasticsearch entry for the
-        referral whenever it is updated.
+        # pylint: disable=attribute-defined-outside-init
+        self._index_field_groups = getattr(self, "_index_field_groups", set())
+        self._index_field_groups.update(field_groups)
+
+    def get_index_field_groups(self):
+        """
+        Return the groups of fields of the document to update on save, or None if the whole
+        document has to be rebuilt: the referral is new, a field used all over the document
+        changed, or nothing tells what changed.
         """
-        super().save(*args, **kwargs)
-        # There is a necessary circular dependency between the referral indexer and
-        # the referral model (and models in general)
-        # We handled it by importing the indexer only at the point we need it here.
-        # pylint: disable=import-outside-toplevel
-        from ..indexers import ReferralsIndexer
+        snapshot = getattr(self, "_index_snapshot", None)
+        if snapshot is None:
+            return None
 
-        return ReferralsIndexer.update_referral_document(self)
+        field_groups = set(getattr(self, "_index_field_groups", set()))
+        for attname, value in snapshot.items():
+            if self.__dict__.get(attname, value) == value:
+                continue
+            if attname not in self.INDEX_FIELD_GROUPS:
+                return None
+            if self.INDEX_FIELD_GROUPS[attname]:
+                field_groups.add(self.INDEX_FIELD_GROUPS[attname])
+
+        return field_groups or None
+
+    def save(self, *args, **kwargs):
+        """
+        Override the default save method to schedule an update of the Elasticsearch entry
+        for the referral whenever it is updated.
+        The outbox entry is written in the same transaction as the referral itself, the
+        document is then rebuilt, or partially updated when we know which fields changed,
+        by the `process_referral_index_outbox` worker.
+        """
+        field_groups = self.get_index_field_groups()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ReferralIndexOutbox.objects.enqueue(self.id, field_groups=field_groups)
+        self.set_index_snapshot()
 
     def delete(self, *args, **kwargs):
         """
-        Override the default delete method to delete the Elasticsearch entry whenever it is deleted.
+        Override the default delete method to schedule the deletion of the Elasticsearch entry
+        whenever it is deleted.
         """
         with transaction.atomic():
             if self.report and self.report.id:
                 self.report.delete()
 
-            # pylint: disable=import-outside-toplevel
-            from ..indexers import ReferralsIndexer
-
-            ReferralsIndexer.delete_referral_document(self)
+            ReferralIndexOutbox.objects.enqueue(self.id)
 
             super().delete(*args, **kwargs)
 
@@ -440,15 +506,18 @@ class Referral(models.Model):
 
         return days
 
-    def get_due_date(self):
+    def get_due_date(self, use_working_day_urgency=None):
         """
         Use the linked ReferralUrgency to calculate the expected answer date from the day the
         referral was created.
+        The working day urgency feature state can be passed when it is already known, to
+        avoid querying the feature flag for each referral.
         """
 
-        use_working_day_urgency = services.FeatureFlagService.get_working_day_urgency(
-            self
-        )
+        if use_working_day_urgency is None:
+            use_working_day_urgency = (
+                services.FeatureFlagService.get_working_day_urgency(self)
+            )
 
         if self.urgency_level and self.sent_at:
             initial_due_date = self.sent_at + self.urgency_level.duration
@@ -681,6 +750,7 @@ class Referral(models.Model):
         ReferralUserLink.objects.create(
             referral=self, user=requester, notifications=notifications
         )
+        self.mark_index_field_groups(ReferralIndexFieldGroup.USERS)
 
         signals.requester_added.send(
             sender="models.referral.add_requester",
@@ -725,6 +795,7 @@ class Referral(models.Model):
             role=ReferralUserLinkRoles.OBSERVER,
             notifications=notifications,
         )
+        self.mark_index_field_groups(ReferralIndexFieldGroup.USERS)
 
         signals.observer_added.send(
             sender="models.referral.add_observer",
@@ -798,6 +869,7 @@ class Referral(models.Model):
             referral=self,
             unit=unit,
         )
+        self.mark_index_field_groups(ReferralIndexFieldGroup.ASSIGNEES)
 
         signals.unit_member_assigned.send(
             sender="models.referral.assign",
@@ -1107,6 +1179,7 @@ class Referral(models.Model):
         Remove a user from the list of requesters for a referral.
         """
         referral_user_link.delete()
+        self.mark_index_field_groups(ReferralIndexFieldGroup.USERS)
         signals.requester_deleted.send(
             sender="models.referral.remove_requester",
             referral=self,
@@ -1121,6 +1194,7 @@ class Referral(models.Model):
         Remove a user from the list of observers for a referral.
         """
         referral_user_link.delete()
+        self.mark_index_field_groups(ReferralIndexFieldGroup.USERS)
         signals.observer_deleted.send(
             sender="models.referral.remove_observer",
             referral=self,
@@ -1206,6 +1280,7 @@ class Referral(models.Model):
         assignee = assignment.assignee
         assignment.delete()
         self.refresh_from_db()
+        self.mark_index_field_groups(ReferralIndexFieldGroup.ASSIGNEES)
 
         signals.unit_member_unassigned.send(
             sender="models.referral.unassign",
@@ -1642,6 +1717,9 @@ class ReferralUnitAssignment(models.Model):
         editable=False,
     )
     created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"), auto_now=True, db_index=True
+    )
 
     unit = models.ForeignKey(
         verbose_name=_("unit"),
@@ -1681,6 +1759,9 @@ class ReferralAssignment(models.Model):
         editable=False,
     )
     created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"), auto_now=True, db_index=True
+    )
 
     # Point to each of the two models we're associating
     assignee = models.ForeignKey(
@@ -0,0 +1,137 @@
+"""
+Referral index outbox model in our core app.
+"""
+
+from contextvars import ContextVar
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ReferralIndexFieldGroup(models.TextChoices):
+    """
+    Groups of fields of a referral document that can be updated on their own, without
+    rebuilding the whole document.
+    """
+
+    TITLE = "title", _("title")
+    DUE_DATE = "due_date", _("due date")
+    ASSIGNEES = "assignees", _("assignees")
+    USERS = "users", _("users")
+
+
+class ReferralIndexScope:
+    """
+    Collect the outbox entries written while the scope is open, eg. during a request, so
+    each referral gets a single entry that can be sent to Elasticsearch when it closes.
+    """
+
+    def __init__(self):
+        # Outbox entry id and field groups for each referral id
+        self.entries = {}
+        # Number of times each referral document was written to Elasticsearch on flush
+        self.written = {}
+
+
+current_referral_index_scope = ContextVar("current_referral_index_scope", default=None)
+
+
+def merge_field_groups(field_groups, other_field_groups):
+    """
+    Merge the field groups of two outbox entries, a full rebuild wins over field groups.
+    """
+    if not field_groups or not other_field_groups:
+        return []
+    return sorted(set(field_groups) | set(other_field_groups))
+
+
+class ReferralIndexOutboxManager(models.Manager):
+    """
+    Add helpers to record referrals whose Elasticsearch document needs to be refreshed.
+    """
+
+    def enqueue(self, referral_id, field_groups=None):
+        """
+        Record that the document for this referral id is out of date. The entry is written
+        in the current database transaction, so it is committed or rolled back together with
+        the change that made the document stale.
+        Pass `field_groups` when only some groups of fields changed, the document is then
+        partially updated instead of rebuilt.
+        Inside a referral index scope, the entry already written for this referral in the
+        scope is updated instead, unless it was processed in the meantime.
+        """
+        field_groups = sorted(field_groups or [])
+        scope = current_referral_index_scope.get()
+
+        if scope is not None and referral_id in scope.entries:
+            entry_id, pending_field_groups = scope.entries[referral_id]
+            merged_field_groups = merge_field_groups(pending_field_groups, field_groups)
+            if self.filter(id=entry_id).update(field_groups=merged_field_groups):
+                scope.entries[referral_id] = (entry_id, merged_field_groups)
+                return entry_id
+
+        entry = self.create(referral_id=referral_id, field_groups=field_groups)
+        if scope is not None:
+            scope.entries[referral_id] = (entry.id, field_groups)
+        return entry.id
+
+    def enqueue_many(self, referral_ids, field_groups=None):
+        """
+        Record that the documents for these referral ids are out of date, in a single
+        query. Entries are not coalesced with the ones of the current referral index scope.
+        """
+        field_groups = sorted(field_groups or [])
+        return self.bulk_create(
+            [
+                self.model(referral_id=referral_id, field_groups=field_groups)
+                for referral_id in referral_ids
+            ]
+        )
+
+
+class ReferralIndexOutbox(models.Model):
+    """
+    Transactional outbox for the referrals index.
+    Each entry records a referral id whose document must be rebuilt (or deleted if the referral
+    does not exist anymore). Entries are drained in batches by the
+    `process_referral_index_outbox` management command.
+    """
+
+    id = models.BigAutoField(
+        verbose_name=_("id"),
+        help_text=_("Primary key for the referral index outbox entry"),
+        primary_key=True,
+        editable=False,
+    )
+    created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+
+    # Not a foreign key on purpose: entries must survive the deletion of their referral
+    # so the matching document can be removed from the index.
+    referral_id = models.IntegerField(
+        verbose_name=_("referral id"),
+        help_text=_("Id of the referral whose document must be refreshed"),
+    )
+
+    field_groups = ArrayField(
+        base_field=models.CharField(
+            max_length=32, choices=ReferralIndexFieldGroup.choices
+        ),
+        verbose_name=_("field groups"),
+        help_text=_(
+            "Groups of fields to update in the document, the whole document is "
+            "rebuilt when empty"
+        ),
+        blank=True,
+        default=list,
+    )
+
+    objects = ReferralIndexOutboxManager()
+
+    class Meta:
+        db_table = "partaj_referral_index_outbox"
+        verbose_name = _("referral index outbox entry")
+
+    def __str__(self):
+        """Get the string representation of a referral index outbox entry."""
+        return f"{self._meta.verbose_name.title()} #{self.id} (referral #{self.referral_id})"
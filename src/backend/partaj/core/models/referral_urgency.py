@@ -36,3 +36,23 @@ class ReferralUrgency(models.Model):
     def __str__(self):
         """Human representation of a referral urgency."""
         return f"{self._meta.verbose_name.title()}: {self.name}"
+
+
+def referralurgency_post_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Listen to the saves of referral urgencies to update the due date in the Elasticsearch
+    entry of the referrals with this urgency, as it depends on the urgency duration.
+    """
+    # pylint: disable=import-outside-toplevel
+    from ..indexers import ReferralsIndexer
+    from .referral import Referral
+
+    if created or (update_fields is not None and "duration" not in update_fields):
+        return
+
+    ReferralsIndexer.enqueue_dependent_referrals(
+        ReferralUrgency, Referral.objects.filter(urgency_level=instance)
+    )
+
+
+models.signals.post_save.connect(referralurgency_post_save, ReferralUrgency)
@@ -36,6 +36,9 @@ class ReferralUserLink(models.Model):
         editable=False,
     )
     created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"), auto_now=True, db_index=True
+    )
 
     user = models.ForeignKey(
         verbose_name=_("user"),
@@ -8,6 +8,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from .notification import Notification
@@ -63,6 +64,20 @@ class ReportEventType(models.TextChoices):
     APPENDIX = "appendix", _("appendix event")
 
 
+class ReportEventQuerySet(models.QuerySet):
+    """
+    Keep `updated_at` current on bulk updates, which bypass `auto_now`.
+    """
+
+    def update(self, **kwargs):
+        """
+        Events states are changed in bulk, the referrals index relies on `updated_at`
+        to find the documents they feed.
+        """
+        kwargs.setdefault("updated_at", timezone.now())
+        return super().update(**kwargs)
+
+
 class ReportEvent(models.Model):
     """
     An activity related to a report, created by any unit member.
@@ -77,6 +92,9 @@ class ReportEvent(models.Model):
         editable=False,
     )
     created_at = models.DateTimeField(verbose_name=_("created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name=_("updated at"), auto_now=True, db_index=True
+    )
 
     type = models.CharField(
         verbose_name=_("type"),
@@ -193,6 +211,8 @@ class ReportEvent(models.Model):
 
     is_granted_user_notified = False
 
+    objects = ReportEventQuerySet.as_manager()
+
     class Meta:
         db_table = "partaj_report_message"
         verbose_name = _("report activity")
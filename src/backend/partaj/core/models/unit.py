@@ -215,21 +215,22 @@ class UnitMembership(models.Model):
 def unitmembership_m2m_changed(signal, sender, **kwargs):
     """
     Listen to the ManyToMany signal for Unit memberships to update the Elasticsearch
-    entry for all referrals linked with the relevant unit when its membership changes.
+    entry for all referrals linked with the relevant units when their membership changes,
+    as far as referral documents depend on unit memberships.
     """
     # pylint: disable=import-outside-toplevel
-    from ..indexers import ReferralsIndexer, partaj_bulk
-
-    unit = kwargs["instance"]
-    if kwargs["pk_set"]:
-        partaj_bulk(
-            [
-                ReferralsIndexer.get_es_document_for_referral(referral)
-                for referral in unit.referrals_assigned.all()
-                .select_related("topic", "urgency_level")
-                .prefetch_related("assignees", "units", "user")
-            ]
-        )
+    from ..indexers import ReferralsIndexer
+    from .referral import Referral
+
+    if kwargs["action"] not in ["post_add", "post_remove"] or not kwargs["pk_set"]:
+        return
+
+    # The signal is sent by `user.unit_set` too, then the instance is the user
+    unit_ids = kwargs["pk_set"] if kwargs["reverse"] else [kwargs["instance"].id]
+    ReferralsIndexer.enqueue_dependent_referrals(
+        UnitMembership,
+        Referral.objects.filter(units__id__in=unit_ids).distinct(),
+    )
 
 
 models.signals.m2m_changed.connect(unitmembership_m2m_changed, Unit.members.through)
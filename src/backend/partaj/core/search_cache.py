@@ -0,0 +1,145 @@
+"""
+In-process cache of search results, invalidated when the searched index is written to.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from . import models
+
+# Seconds after a write before search results can be cached, Elasticsearch refreshes its
+# indices every second by default
+SETTLE_DELAY = 2
+
+
+def is_generation_settled(generation, settle_delay=SETTLE_DELAY):
+    """
+    Whether the last write of this (generation, updated_at) of an index is old enough to
+    be searchable.
+    """
+    updated_at = generation[1]
+    return (
+        updated_at is None
+        or (timezone.now() - updated_at).total_seconds() >= settle_delay
+    )
+
+
+def get_query_cache_key(cleaned_data):
+    """
+    Normalize the data of a list query form, so that the same search gets the same key
+    whatever the order of its filters.
+    """
+    return json.dumps(
+        {
+            field: sorted(value) if isinstance(value, list) else value
+            for field, value in cleaned_data.items()
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: while a call runs, the other callers for
+    its key wait for it and share its results instead of making the same call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def run(self, key, function):
+        """
+        Return the results of `function`, called once for all the concurrent callers
+        for this key. Should the call fail, the callers waiting for it make it again.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = {"done": threading.Event()}
+
+        if not is_leader:
+            call["done"].wait()
+            return call["results"] if "results" in call else function()
+
+        try:
+            call["results"] = function()
+            return call["results"]
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+# pylint: disable=too-many-instance-attributes
+class IndexResultsCache:
+    """
+    LRU cache of the results of searches on an Elasticsearch index. Results are cached
+    along the generation of the index, which is bumped on every write, so results cached
+    before a write are never served after it.
+
+    The generation is read from the database at most every `generation_ttl` seconds.
+    Results are not cached until `settle_delay` seconds after a write, as documents only
+    become searchable once Elasticsearch refreshed the index. Concurrent searches for
+    the same key are made once.
+    """
+
+    def __init__(
+        self, index_name, maxsize=256, generation_ttl=1, settle_delay=SETTLE_DELAY
+    ):
+        self.index_name = index_name
+        self.maxsize = maxsize
+        self.generation_ttl = generation_ttl
+        self.settle_delay = settle_delay
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+        # Last generation read, and the time it was read at
+        self.last_generation = (None, None)
+
+    def get_generation(self):
+        """
+        Return the (generation, updated_at) of the index, read at most every
+        `generation_ttl` seconds.
+        """
+        now = time.monotonic()
+        generation, read_at = self.last_generation
+        if read_at is None or now - read_at >= self.generation_ttl:
+            generation = models.IndexGeneration.objects.get_generation(self.index_name)
+            self.last_generation = (generation, now)
+        return generation
+
+    def get_or_search(self, key, search):
+        """
+        Return the cached results for this key, or call `search` and cache its results.
+        Cached results are shared between requests and must not be mutated.
+        """
+        generation = self.get_generation()
+        cache_key = (generation, key)
+        with self.lock:
+            if cache_key in self.entries:
+                self.entries.move_to_end(cache_key)
+                return self.entries[cache_key]
+
+        results = self.flights.run(cache_key, search)
+
+        if is_generation_settled(generation, self.settle_delay):
+            with self.lock:
+                self.entries[cache_key] = results
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return results
+
+    def clear(self):
+        """
+        Drop all cached results and forget the generation of the index.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.last_generation = (None, None)
@@ -0,0 +1,156 @@
+"""
+Cursor pagination of Elasticsearch searches: each page starts after the sort values of
+the last hit of the previous one, so deep pages cost as much as the first one.
+"""
+
+import base64
+import hashlib
+import json
+
+from elasticsearch.exceptions import NotFoundError
+
+# How long a point in time is kept open between the requests of two pages
+POINT_IN_TIME_KEEP_ALIVE = "2m"
+
+# Keys of a search body that change from a page to the next, or are checked on their own
+PAGE_KEYS = {"from", "size", "sort", "search_after", "pit"}
+
+
+class InvalidCursorError(ValueError):
+    """
+    The cursor cannot continue this search, eg. its sort or query changed.
+    """
+
+
+def get_hash(value):
+    """
+    Identify a part of a search body, whatever the order of its keys.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_sort_hash(sort):
+    """
+    Identify a sort, so a cursor is only used to continue a search sorted the same way.
+    """
+    return get_hash(sort)
+
+
+def get_query_hash(body):
+    """
+    Identify what a search body looks for, so a cursor is only used to continue the same
+    search: its query, filters and returned fields, but not its pagination.
+    """
+    return get_hash({key: value for key, value in body.items() if key not in PAGE_KEYS})
+
+
+def encode_cursor(search_after, body, pit_id=None):
+    """
+    Build the opaque token clients send back to get the next page of the search of this
+    body.
+    """
+    cursor = {
+        "after": search_after,
+        "sort": get_sort_hash(body.get("sort", [])),
+        "query": get_query_hash(body),
+    }
+    if pit_id:
+        cursor["pit"] = pit_id
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(token):
+    """
+    Read a cursor token, raise an InvalidCursorError if it is not one.
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError as error:
+        raise InvalidCursorError("Invalid cursor.") from error
+    if not isinstance(cursor, dict) or not isinstance(cursor.get("after"), list):
+        raise InvalidCursorError("Invalid cursor.")
+    return cursor
+
+
+# pylint: disable=too-many-arguments
+def search_with_cursor(
+    client, index, body, size, tiebreaker, cursor=None, use_pit=False, **kwargs
+):
+    """
+    Search a page of `size` hits, starting after the cursor if any, or at the "from" of
+    the body. The sort of the body is completed with the `tiebreaker` sort clause on a
+    unique field, so no hit is skipped or repeated from a page to the next.
+    With `use_pit`, pages are searched in a point in time of the index opened with the
+    first one, so they are not affected by writes in between (not available on ES6).
+    Return the response and the token of the next page cursor, None on the last page.
+    """
+    sort = [*(body.get("sort") or [{"_score": {"order": "desc"}}])]
+    sort.append(tiebreaker)
+    body = {**body, "size": size, "sort": sort}
+
+    pit_id = None
+    if cursor:
+        if cursor.get("sort") != get_sort_hash(sort):
+            raise InvalidCursorError("The cursor was built for another sort.")
+        if cursor.get("query") != get_query_hash(body):
+            raise InvalidCursorError("The cursor was built for another search.")
+        body.pop("from", None)
+        body["search_after"] = cursor["after"]
+        pit_id = cursor.get("pit")
+    elif use_pit and client.__es_version__ != "6":
+        pit_id = client.open_point_in_time(
+            index=index, keep_alive=POINT_IN_TIME_KEEP_ALIVE
+        )["id"]
+
+    if pit_id:
+        # Searches in a point in time must not name an index
+        body["pit"] = {"id": pit_id, "keep_alive": POINT_IN_TIME_KEEP_ALIVE}
+        response = client.search(body=body, **kwargs)
+        # The id of a point in time may change from a search to the next
+        pit_id = response.get("pit_id", pit_id)
+    else:
+        response = client.search(index=index, body=body, **kwargs)
+
+    # Hits may be left out of a response filtered with a filter_path
+    hits = response.get("hits", {}).get("hits", [])
+    if len(hits) == size and hits:
+        return response, encode_cursor(hits[-1]["sort"], body, pit_id)
+
+    if pit_id:
+        close_point_in_time(client, pit_id)
+    return response, None
+
+
+def close_point_in_time(client, pit_id):
+    """
+    Release a point in time no more page will be searched in.
+    """
+    try:
+        client.close_point_in_time(body={"id": pit_id})
+    except NotFoundError:
+        # It already expired
+        pass
+
+
+def iter_hits(client, index, body, size, tiebreaker, **kwargs):
+    """
+    Yield all the hits of a search, searched `size` at a time in a point in time of the
+    index, so that none is skipped or repeated whatever the writes in between. The
+    point in time is released even if the iteration stops before the last hit.
+    A `filter_path` must keep the "hits.hits.sort" and "pit_id" of the responses.
+    """
+    cursor = None
+    try:
+        while True:
+            response, next_cursor = search_with_cursor(
+                client, index, body, size, tiebreaker, cursor, use_pit=True, **kwargs
+            )
+            yield from response.get("hits", {}).get("hits", [])
+            if next_cursor is None:
+                # The point in time was released with the last page
+                cursor = None
+                return
+            cursor = decode_cursor(next_cursor)
+    finally:
+        if cursor and cursor.get("pit"):
+            close_point_in_time(client, cursor["pit"])
@@ -4,6 +4,7 @@ and the JSON on the API.
 """
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 from rest_framework import serializers
 
@@ -1170,17 +1171,12 @@ class ReferralSerializer(serializers.ModelSerializer):
 
     def save(self, *args, **kwargs):
         """
-        Override the default save method to update the Elasticsearch entry for the
-        referral whenever it is updated.
+        Override the default save method to schedule an update of the Elasticsearch entry
+        for the referral whenever it is updated.
         """
-        super().save(*args, **kwargs)
-        # There is a necessary circular dependency between the referral indexer and
-        # the referral model (and models in general)
-        # We handled it by importing the indexer only at the point we need it here.
-        # pylint: disable=import-outside-toplevel
-        from .indexers import ReferralsIndexer
-
-        ReferralsIndexer.update_referral_document(self.instance)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            models.ReferralIndexOutbox.objects.enqueue(self.instance.id)
 
 
 class ReferralWithNoteSerializer(serializers.ModelSerializer):
@@ -1402,6 +1398,74 @@ class ReferralLiteSerializer(serializers.ModelSerializer):
         return EventLiteSerializer(events, many=True).data
 
 
+class ReferralLitePreloadedSerializer(ReferralLiteSerializer):
+    """
+    Referral lite serializer producing the same data as ReferralLiteSerializer, but reading the
+    related objects from a batch of referrals preloaded by the referrals indexer instead of
+    querying the database for each referral.
+
+    The batch must be passed as "batch" in the serializer context.
+    """
+
+    def get_users(self, referral_lite):
+        """
+        Helper to serialize all users linked to the referral.
+        """
+        return ReferralUserLinkSerializer(
+            self.context["batch"].get_userlinks(referral_lite), many=True
+        ).data
+
+    def get_requesters(self, referral_lite):
+        """
+        Helper to get only users with REQUESTER role in users serialization.
+        """
+        return ReferralUserLinkSerializer(
+            self.context["batch"].get_userlinks(
+                referral_lite, models.ReferralUserLinkRoles.REQUESTER
+            ),
+            many=True,
+        ).data
+
+    def get_observers(self, referral_lite):
+        """
+        Helper to get only users with OBSERVER role in observers serialization.
+        """
+        return ReferralUserLinkSerializer(
+            self.context["batch"].get_userlinks(
+                referral_lite, models.ReferralUserLinkRoles.OBSERVER
+            ),
+            many=True,
+        ).data
+
+    def get_published_date(self, referral_lite):
+        """
+        Helper to get referral answer published date during serialization.
+        """
+        batch = self.context["batch"]
+        if batch.is_referral_answer_v2(referral_lite):
+            if not referral_lite.report:
+                return None
+            return referral_lite.report.published_at
+
+        return batch.get_answer_published_date(referral_lite)
+
+    def get_due_date(self, referral_lite):
+        """
+        Helper to get referral due date during serialization.
+        """
+        return self.context["batch"].get_due_date(referral_lite)
+
+    def get_events(self, referral_lite):
+        """
+        Helper to serialize the active events of the last report version.
+        """
+        batch = self.context["batch"]
+        if not batch.get_last_version(referral_lite):
+            return None
+
+        return batch.get_serialized_events(referral_lite)
+
+
 class FinalReferralReportSerializer(serializers.ModelSerializer):
     """
     Referral report serializer.
@@ -0,0 +1,39 @@
+"""
+Stream CSV files to the client as their rows are built, instead of building the whole
+file in memory first.
+"""
+
+import codecs
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+class EchoBuffer:
+    """
+    File-like object handing back what the CSV writer writes to it, to stream it.
+    """
+
+    def write(self, value):
+        """
+        Return the written value instead of storing it.
+        """
+        return value
+
+
+def stream_csv(filename, header, rows, content_type="text/csv"):
+    """
+    Respond with a CSV file streamed row by row after its header, semicolon separated
+    with all values quoted and a BOM so spreadsheet programs read it as UTF-8.
+    """
+    writer = csv.writer(EchoBuffer(), delimiter=";", quoting=csv.QUOTE_ALL)
+
+    def get_content():
+        yield codecs.BOM_UTF8
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(get_content(), content_type=content_type)
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
@@ -0,0 +1,137 @@
+"""
+Snapshots of the values of the filters of the notes and referrals lists, aggregated once
+per generation of their index instead of on every visit.
+"""
+
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from .. import models
+from ..indexers import ES_CLIENT, ES_INDICES_CLIENT, NotesIndexer
+from ..search_cache import is_generation_settled
+
+# How long a snapshot is kept, a new generation of the index replacing it anyway
+FACET_SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+# Keywords fields of the notes filters
+NOTES_FACETS = {
+    "topic": "topic.filter_keyword",
+    "assigned_units_names": "assigned_units_names",
+    "contributors": "contributors.filter_keyword",
+    "requesters_unit_names": "requesters_unit_names",
+}
+
+# Keywords fields of the referrals filters
+REFERRALS_FACETS = {
+    "topics": "theme.name_keyword",
+    "assignees": "assigned_users.name_keyword",
+    "requesters": "requester_users.name_keyword",
+    "contributors_unit_names": "contributors_unit_names.name_keyword",
+    "requesters_unit_names": "users_unit_name",
+}
+
+
+class FacetSnapshotService:
+    """
+    Compute the values of filters with terms aggregations, and store them compactly in
+    the cache shared by all processes, for each generation of an index and each scope of
+    the documents they are aggregated on.
+    """
+
+    @staticmethod
+    def get_cache_key(index_name, generation, scope):
+        """
+        Key of the snapshot of an index generation for a scope of documents.
+        """
+        number, updated_at = generation
+        scope_hash = hashlib.sha256(
+            json.dumps(scope, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        timestamp = updated_at.timestamp() if updated_at else 0
+        return f"facet_snapshot:{index_name}:{number}:{timestamp}:{scope_hash}"
+
+    @staticmethod
+    def aggregate(index_name, facets, query_filters):
+        """
+        Aggregate the values of each facet field on the documents matching the filters,
+        returning them as sorted lists of values.
+        """
+        # pylint: disable=unexpected-keyword-arg
+        es_response = ES_CLIENT.search(
+            index=index_name,
+            body={
+                "query": {"bool": {"filter": query_filters}},
+                "aggs": {
+                    name: {
+                        "terms": {
+                            "field": field,
+                            "size": 1000,
+                            "order": {"_key": "asc"},
+                        }
+                    }
+                    for name, field in facets.items()
+                },
+            },
+            size=0,
+            filter_path=["aggregations.*.buckets.key"],
+        )
+        aggregations = es_response.get("aggregations", {})
+        return {
+            name: [
+                bucket["key"]
+                for bucket in aggregations.get(name, {}).get("buckets", [])
+            ]
+            for name in facets
+        }
+
+    @classmethod
+    def get_snapshot(cls, index_name, facets, query_filters=None, refresh=False):
+        """
+        Return the values of the facets on the documents matching the filters, from the
+        snapshot of the current generation of the index if there is one. With `refresh`,
+        compute and store the snapshot anyway.
+        """
+        query_filters = query_filters or []
+        generation = models.IndexGeneration.objects.get_generation(index_name)
+        cache_key = cls.get_cache_key(index_name, generation, [facets, query_filters])
+
+        snapshot = None if refresh else cache.get(cache_key)
+        if snapshot is None:
+            snapshot = cls.aggregate(index_name, facets, query_filters)
+            # Unless the index was just refreshed, documents written right before may not
+            # be aggregated yet
+            if refresh or is_generation_settled(generation):
+                cache.set(cache_key, snapshot, FACET_SNAPSHOT_TIMEOUT)
+        return snapshot
+
+    @classmethod
+    def get_notes_snapshot(cls, refresh=False):
+        """
+        Return the values of the notes filters, which are the same for all users.
+        """
+        return cls.get_snapshot(NotesIndexer.index_name, NOTES_FACETS, refresh=refresh)
+
+    @classmethod
+    def refresh_notes_snapshot(cls):
+        """
+        Make the notes just indexed searchable and compute the snapshot of their filters,
+        so the first visit after an indexing does not wait for the aggregations.
+        """
+        ES_INDICES_CLIENT.refresh(index=NotesIndexer.index_name)
+        return cls.get_notes_snapshot(refresh=True)
+
+    @staticmethod
+    def format_filters(snapshot, orders):
+        """
+        Shape a snapshot as the filters endpoints return it, with the display order of
+        each filter.
+        """
+        return {
+            name: {
+                "order": order,
+                "results": [{"name": value, "id": value} for value in snapshot[name]],
+            }
+            for name, order in orders.items()
+        }
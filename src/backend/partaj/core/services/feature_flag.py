@@ -10,6 +10,20 @@ from .. import models
 class FeatureFlagService:
     """FeatureFlag class"""
 
+    @classmethod
+    def get_referral_state(cls, feature_flag, referral):
+        """
+        Compare an already fetched feature flag limit date and sent_at date
+        If sent_at is after the feature flag limit date,
+        the feature is "ON" i.e. 1 else "OFF" i.e. 0
+        A missing feature flag (None) is "OFF"
+        """
+        if feature_flag is None:
+            return 0
+        if not referral.sent_at:
+            return 1 if datetime.now().date() >= feature_flag.limit_date else 0
+        return 1 if referral.sent_at.date() >= feature_flag.limit_date else 0
+
     @classmethod
     def get_working_day_urgency(cls, referral):
         """
@@ -19,9 +33,7 @@ class FeatureFlagService:
         """
         try:
             feature_flag = models.FeatureFlag.objects.get(tag="working_day_urgency")
-            if not referral.sent_at:
-                return 1 if datetime.now().date() >= feature_flag.limit_date else 0
-            return 1 if referral.sent_at.date() >= feature_flag.limit_date else 0
+            return cls.get_referral_state(feature_flag, referral)
 
         except models.FeatureFlag.DoesNotExist:
             return 0
@@ -35,9 +47,7 @@ class FeatureFlagService:
         """
         try:
             feature_flag = models.FeatureFlag.objects.get(tag="referral_version")
-            if not referral.sent_at:
-                return 1 if datetime.now().date() >= feature_flag.limit_date else 0
-            return 1 if referral.sent_at.date() >= feature_flag.limit_date else 0
+            return cls.get_referral_state(feature_flag, referral)
 
         except models.FeatureFlag.DoesNotExist:
             return 0
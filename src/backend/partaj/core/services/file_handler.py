@@ -2,28 +2,191 @@
 Multiple classes that perform operations on files
 """
 
-from io import BytesIO
+import hashlib
+import shutil
+import tempfile
+from importlib import metadata
+from io import StringIO
 
 import mammoth
-from pdfminer.high_level import extract_text
+from mammoth.results import Message
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+# Bump to invalidate cached extractions when the way we extract documents changes
+EXTRACTION_VERSION = 1
+
+# What can be extracted from a document, with the library used to extract it
+PDF_TEXT, DOCX_TEXT, DOCX_HTML = "pdf_text", "docx_text", "docx_html"
+EXTRACTOR_PACKAGES = {
+    PDF_TEXT: "pdfminer.six",
+    DOCX_TEXT: "mammoth",
+    DOCX_HTML: "mammoth",
+}
+
+
+# Files are read by chunks of this size, and kept in memory up to the spool size when
+# copied from the storage, beyond that they are written to disk
+READ_CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 5 * 1024 * 1024
+
+
+def spool_file(file):
+    """
+    Copy a file object, eg. opened from the storage, by chunks to a seekable temporary
+    file that only stays in memory while it is small.
+    """
+    # Returned to the caller, which closes it
+    # pylint: disable=consider-using-with
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(file, spooled, READ_CHUNK_SIZE)
+    spooled.seek(0)
+    return spooled
+
+
+def get_file_hash(file):
+    """
+    Hash the content of a seekable file object by chunks, to look up its cached
+    extractions, and rewind it.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def get_budget_extractor(extractor, max_pages=None, max_chars=None):
+    """
+    Name of an extractor limited to some pages or characters, so its extractions are
+    cached apart from the complete ones.
+    """
+    if not max_pages and not max_chars:
+        return extractor
+    return f"{extractor}:{max_pages or 0}p:{max_chars or 0}c"
+
+
+def get_extractor_version(extractor):
+    """Version of an extractor, changing with the version of the library it uses"""
+    package = EXTRACTOR_PACKAGES[extractor.split(":")[0]]
+    return f"{EXTRACTION_VERSION}/{package}-{metadata.version(package)}"
+
+
+def get_cached_extraction(content_hash, extractor):
+    """
+    Return the (text, messages) already extracted from a file content by the current
+    version of an extractor, or None.
+    """
+    # Models import our services, import them when needed
+    # pylint: disable=import-outside-toplevel
+    from ..models import DocumentExtraction
+
+    cached = DocumentExtraction.objects.get_cached(
+        content_hash, extractor, get_extractor_version(extractor)
+    )
+    if cached is None:
+        return None
+    text, messages = cached
+    return text, [Message(*message) for message in messages]
+
+
+def cache_extraction(content_hash, extractor, text, messages=()):
+    """Record what the current version of an extractor extracted from a file content"""
+    # pylint: disable=import-outside-toplevel
+    from ..models import DocumentExtraction
+
+    DocumentExtraction.objects.store(
+        content_hash,
+        extractor,
+        get_extractor_version(extractor),
+        text,
+        [list(message) for message in messages],
+    )
+
+
+def extract_with_cache(file, extractor, extract):
+    """
+    Return the (text, messages) extracted from a seekable file object, calling `extract`
+    with it only if the current version of the extractor never saw this content.
+    """
+    content_hash = get_file_hash(file)
+    cached = get_cached_extraction(content_hash, extractor)
+    if cached is not None:
+        return cached
+
+    text, messages = extract(file)
+    cache_extraction(content_hash, extractor, text, messages)
+    return text, messages
 
 
 class TextExtractor:
     """Extract files text"""
 
     @staticmethod
-    def from_pdf(document):
-        """Extract pdf text"""
-        with document.file.open("rb") as file:
-            text = extract_text(BytesIO(file.read()))
+    def from_pdf(document, max_pages=None, max_chars=None):
+        """Extract pdf text, optionally limited to some pages or characters"""
+        with document.file.open("rb") as file, spool_file(file) as spooled:
+            text, _ = extract_with_cache(
+                spooled,
+                get_budget_extractor(PDF_TEXT, max_pages, max_chars),
+                lambda pdf_file: (
+                    TextExtractor.from_pdf_file(pdf_file, max_pages, max_chars),
+                    [],
+                ),
+            )
 
         return text
 
+    @staticmethod
+    def from_pdf_file(file, max_pages=None, max_chars=None):
+        """Extract pdf text from a seekable file object"""
+        return "".join(TextExtractor.iter_pdf_text(file, max_pages, max_chars))
+
+    @staticmethod
+    def iter_pdf_text(file, max_pages=None, max_chars=None):
+        """
+        Yield the text of a pdf from a seekable file object, page by page, so the text of
+        the whole document never has to be built at once. Stop after `max_pages` pages, or
+        once `max_chars` characters were yielded. Chunks join to the text pdfminer's
+        `extract_text` returns.
+        """
+        resource_manager = PDFResourceManager(caching=True)
+        remaining_chars = max_chars
+        with StringIO() as output:
+            device = TextConverter(resource_manager, output, laparams=LAParams())
+            interpreter = PDFPageInterpreter(resource_manager, device)
+            # Do not cache parsed objects, eg. decoded page streams, for the whole document
+            for page in PDFPage.get_pages(file, maxpages=max_pages or 0, caching=False):
+                interpreter.process_page(page)
+                text = output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+                if remaining_chars is not None:
+                    text = text[:remaining_chars]
+                    remaining_chars -= len(text)
+                yield text
+                if remaining_chars == 0:
+                    return
+
     @staticmethod
     def from_docx(document):
         """Extract docx text"""
-        with document.file.open("rb") as file:
-            result = mammoth.extract_raw_text(file)
+        with document.file.open("rb") as file, spool_file(file) as spooled:
+            text, _ = extract_with_cache(
+                spooled,
+                DOCX_TEXT,
+                lambda docx_file: (TextExtractor.from_docx_file(docx_file), []),
+            )
+
+        return text
+
+    @staticmethod
+    def from_docx_file(file):
+        """Extract docx text from a file object"""
+        result = mammoth.extract_raw_text(file)
         return result.value
 
 
@@ -33,8 +196,13 @@ class HtmlConverter:
     @staticmethod
     def from_docx(document):
         """Convert docx to html"""
-        with document.file.open("rb") as file:
-            result = mammoth.convert_to_html(file)
+        with document.file.open("rb") as file, spool_file(file) as spooled:
+            return extract_with_cache(spooled, DOCX_HTML, HtmlConverter.from_docx_file)
+
+    @staticmethod
+    def from_docx_file(file):
+        """Convert docx to html from a file object"""
+        result = mammoth.convert_to_html(file)
 
         return result.value, result.messages
 
@@ -0,0 +1,205 @@
+"""
+Extract the text and html of note documents in child processes, each of them bounded in
+time and memory so a pathological document cannot block or exhaust the extraction.
+"""
+
+import multiprocessing
+import resource
+import time
+from multiprocessing.connection import wait
+
+from ..models import SupportedExtensionTypes
+from .file_handler import (
+    DOCX_HTML,
+    DOCX_TEXT,
+    PDF_TEXT,
+    HtmlConverter,
+    TextExtractor,
+    cache_extraction,
+    get_budget_extractor,
+    get_cached_extraction,
+)
+
+# Extractor of each field of a note, by document extension
+NOTE_FIELD_EXTRACTORS = {
+    SupportedExtensionTypes.DOCX: {"text": DOCX_TEXT, "html": DOCX_HTML},
+    SupportedExtensionTypes.PDF: {"text": PDF_TEXT},
+}
+
+# Extra CPU seconds granted after the soft limit, before the child is killed
+CPU_LIMIT_GRACE = 5
+
+
+def get_note_field_extractor(extension, field, max_pages=None, max_chars=None):
+    """
+    Name of the extractor of a note field, pdf text depending on its budget.
+    """
+    extractor = NOTE_FIELD_EXTRACTORS[extension][field]
+    if extractor == PDF_TEXT:
+        return get_budget_extractor(extractor, max_pages, max_chars)
+    return extractor
+
+
+def extract_note_content(extension, file, fields, max_pages=None, max_chars=None):
+    """
+    Extract the given fields ("text" and/or "html") from the seekable file of a note
+    document. Pdf text can be limited to some pages or characters.
+    """
+    extracted = {}
+    for field in fields:
+        file.seek(0)
+        if extension == SupportedExtensionTypes.DOCX and field == "text":
+            extracted["text"] = TextExtractor.from_docx_file(file)
+        elif extension == SupportedExtensionTypes.DOCX and field == "html":
+            extracted["html"] = HtmlConverter.from_docx_file(file)
+        elif extension == SupportedExtensionTypes.PDF and field == "text":
+            extracted["text"] = TextExtractor.from_pdf_file(file, max_pages, max_chars)
+    return extracted
+
+
+def get_cached_note_content(extension, content_hash, fields, **budget):
+    """
+    Return the fields of a note already extracted from the same document content, in the
+    shape `extract_note_content` returns them.
+    """
+    cached = {}
+    for field in fields:
+        extraction = get_cached_extraction(
+            content_hash, get_note_field_extractor(extension, field, **budget)
+        )
+        if extraction is not None:
+            # Html comes with the messages of the converter
+            cached[field] = extraction if field == "html" else extraction[0]
+    return cached
+
+
+def cache_note_content(extension, content_hash, extracted, **budget):
+    """
+    Record the fields extracted from a document content by `extract_note_content`.
+    """
+    for field, value in extracted.items():
+        text, messages = value if field == "html" else (value, [])
+        cache_extraction(
+            content_hash,
+            get_note_field_extractor(extension, field, **budget),
+            text,
+            messages,
+        )
+
+
+def get_address_space_size():
+    """
+    Return the size of the virtual address space of the current process, in bytes.
+    """
+    with open("/proc/self/statm", encoding="utf-8") as statm:
+        return int(statm.read().split()[0]) * resource.getpagesize()
+
+
+def run_limited(connection, function, args, timeout, memory_limit):
+    """
+    Run a function in a child process with its CPU time and the memory it can allocate
+    on top of what it inherited limited, and send its outcome to the parent.
+    """
+    resource.setrlimit(resource.RLIMIT_CPU, (timeout, timeout + CPU_LIMIT_GRACE))
+    address_space_limit = get_address_space_size() + memory_limit
+    resource.setrlimit(resource.RLIMIT_AS, (address_space_limit, address_space_limit))
+
+    started_at = time.monotonic()
+    try:
+        result = function(*args)
+    # Anything may go wrong in a third party parser, report it to the parent
+    # pylint: disable=broad-except
+    except BaseException as error:
+        connection.send((None, repr(error), time.monotonic() - started_at))
+    else:
+        connection.send((result, None, time.monotonic() - started_at))
+    finally:
+        connection.close()
+
+
+def start_limited_process(context, function, args, timeout, memory_limit):
+    """
+    Fork a process running a function within limits, return the reading end of the pipe
+    it reports its outcome to, and the process.
+    """
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(
+        target=run_limited,
+        args=(writer, function, args, timeout, memory_limit),
+        daemon=True,
+    )
+    process.start()
+    writer.close()
+    return reader, process
+
+
+def get_task_outcome(reader, process, deadline, timeout):
+    """
+    Collect the (result, error, elapsed) outcome of a task whose process reported or
+    died, or kill it if it went past its deadline. Return None if it is still running.
+    """
+    if reader.poll():
+        try:
+            outcome = reader.recv()
+        except EOFError:
+            # The process died before reporting, eg. killed on its CPU limit
+            process.join()
+            outcome = (
+                None,
+                f"Exited with code {process.exitcode}",
+                timeout - (deadline - time.monotonic()),
+            )
+        process.join()
+        return outcome
+
+    if time.monotonic() >= deadline:
+        process.kill()
+        process.join()
+        return None, f"Timed out after {timeout}s", timeout
+
+    return None
+
+
+def run_in_limited_processes(tasks, workers, timeout, memory_limit):
+    """
+    Run each (key, function, args) task in its own forked process, `workers` at a time.
+    Each process is limited to `timeout` seconds of CPU and wall time and to `memory_limit`
+    more bytes of memory, and is killed when it goes beyond.
+    Tasks are pulled from the iterable only when a process slot is free. Yield
+    (key, result, error, elapsed) as tasks finish, `error` being None on success.
+    """
+    context = multiprocessing.get_context("fork")
+    tasks = iter(tasks)
+    # Reading end of the pipe of each running task, with its key, process and deadline
+    running = {}
+
+    try:
+        while True:
+            while len(running) < workers:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                key, function, args = task
+                reader, process = start_limited_process(
+                    context, function, args, timeout, memory_limit
+                )
+                running[reader] = (key, process, time.monotonic() + timeout)
+
+            if not running:
+                return
+
+            next_deadline = min(deadline for _, _, deadline in running.values())
+            wait(list(running), timeout=max(0, next_deadline - time.monotonic()))
+
+            for reader, (key, process, deadline) in list(running.items()):
+                outcome = get_task_outcome(reader, process, deadline, timeout)
+                if outcome is not None:
+                    reader.close()
+                    del running[reader]
+                    yield (key, *outcome)
+    finally:
+        # Do not leave processes behind if the caller stops early
+        for reader, (_, process, _) in running.items():
+            process.kill()
+            process.join()
+            reader.close()
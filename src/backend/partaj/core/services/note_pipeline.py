@@ -0,0 +1,324 @@
+"""
+Bring notes from their publication to the knowledge base index: extract the text of the
+documents of received notes, then send the notes to ElasticSearch or remove them from it.
+Note states are the queue of the pipeline:
+RECEIVED -> (extraction) -> TO_SEND -> (indexing) -> ACTIVE
+TO_DELETE -> (removal from the index) -> INACTIVE
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..indexers import NotesIndexer
+from ..models import ReferralNote, ReferralNoteStatus, SupportedExtensionTypes
+from .facet_snapshot import FacetSnapshotService
+from .file_handler import get_file_hash, spool_file
+from .note_extraction import (
+    cache_note_content,
+    extract_note_content,
+    get_cached_note_content,
+    run_in_limited_processes,
+)
+
+# States of the notes the pipeline still has work to do on
+PENDING_NOTE_STATES = [
+    ReferralNoteStatus.RECEIVED,
+    ReferralNoteStatus.TO_SEND,
+    ReferralNoteStatus.TO_DELETE,
+]
+
+# Key of the database advisory lock held while the pipeline runs
+NOTE_PIPELINE_LOCK_ID = 7_365_701
+
+# A note being extracted, with its spooled document file, its size and the fields found
+# in the cache
+PendingNote = namedtuple(
+    "PendingNote", ["note", "extension", "file", "size", "content_hash", "cached"]
+)
+
+
+def has_pending_notes():
+    """
+    Whether some notes wait to be extracted, indexed or removed from the index.
+    """
+    return ReferralNote.objects.filter(state__in=PENDING_NOTE_STATES).exists()
+
+
+@contextmanager
+def note_pipeline_lock():
+    """
+    Hold a database advisory lock while the pipeline runs, so the update_notes cron job
+    and the process_notes workers never process the same notes at once.
+    Yield whether the lock was acquired, ie. no other pipeline is running.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [NOTE_PIPELINE_LOCK_ID])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [NOTE_PIPELINE_LOCK_ID])
+
+
+# pylint: disable=broad-except
+class NotePipeline:
+    """
+    Run the notes through extraction and indexing. Extraction runs each document in its
+    own process, bounded in time and memory, `workers` at a time. Pdf text extraction can
+    be limited to some pages or characters with a `budget` of max_pages and max_chars.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        workers=None,
+        timeout=300,
+        memory_limit=1024 * 1024 * 1024,
+        budget=None,
+        logger=None,
+    ):
+        self.workers = workers or os.cpu_count()
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.budget = budget or {"max_pages": None, "max_chars": None}
+        self.logger = logger or logging.getLogger("partaj")
+
+    def run(self, force=False):
+        """
+        Extract the received notes, then send the notes to the index and remove the
+        deleted ones from it. With `force`, active notes are sent again as well.
+        The run is skipped if another pipeline is already running.
+        """
+        with note_pipeline_lock() as acquired:
+            if not acquired:
+                self.logger.info("Notes are already being processed, skipping")
+                return
+
+            self.extract_received_notes()
+            self.send_notes(force=force)
+            self.delete_notes()
+            self.refresh_filters()
+
+    def get_extraction_tasks(self, notes, pending_notes):
+        """
+        Yield an extraction task for each received note that has fields to extract, and
+        settle the other ones right away. Document files are only copied from the storage
+        when the task is pulled, ie. when a process is free to run it, and the process
+        reads it from the spooled copy it inherits.
+        """
+        for note in notes:
+            try:
+                extension = note.document.get_extension()
+                self.logger.info("Found %s type", extension)
+
+                if extension not in SupportedExtensionTypes.values:
+                    self.logger.warning(
+                        "Extension %s not supported, ignoring", extension
+                    )
+                    self.settle_note(note, ReferralNoteStatus.ERROR)
+                    continue
+
+                fields = []
+                if not note.text:
+                    fields.append("text")
+                if extension == SupportedExtensionTypes.DOCX and not note.html:
+                    fields.append("html")
+
+                if not fields:
+                    self.settle_note(note, ReferralNoteStatus.TO_SEND)
+                    continue
+
+                with note.document.file.open("rb") as file:
+                    spooled = spool_file(file)
+                size = spooled.seek(0, os.SEEK_END)
+                spooled.seek(0)
+
+                # The same document may have been extracted already
+                content_hash = get_file_hash(spooled)
+                cached = get_cached_note_content(
+                    extension, content_hash, fields, **self.budget
+                )
+                if len(cached) == len(fields):
+                    spooled.close()
+                    self.save_extracted_note(note, cached)
+                    continue
+            except (ValueError, Exception) as error:
+                self.fail_note(note, error.args)
+                continue
+
+            pending_notes[note.id] = PendingNote(
+                note, extension, spooled, size, content_hash, cached
+            )
+            yield note.id, extract_note_content, (
+                extension,
+                spooled,
+                [field for field in fields if field not in cached],
+                self.budget["max_pages"],
+                self.budget["max_chars"],
+            )
+
+    def fail_note(self, note, reasons):
+        """
+        Mark a note whose text could not be extracted as failed.
+        """
+        self.settle_note(note, ReferralNoteStatus.ERROR)
+        self.logger.warning(
+            "Value Error: Referral n° %s :failed to create notice :",
+            note.referral_id,
+        )
+        for reason in reasons:
+            self.logger.info(reason)
+
+    @staticmethod
+    def settle_note(note, state, extracted=None):
+        """
+        Move a received note to its next state, saving only the fields extracted from its
+        document. A note that is not received anymore, eg. deleted by a user during the
+        extraction, is left as is.
+        Return whether the note was saved.
+        """
+        with transaction.atomic():
+            if (
+                not ReferralNote.objects.select_for_update()
+                .filter(id=note.id, state=ReferralNoteStatus.RECEIVED)
+                .exists()
+            ):
+                return False
+
+            extracted = extracted or {}
+            for field, value in extracted.items():
+                setattr(note, field, value)
+            note.state = state
+            note.save(update_fields=[*extracted, "state", "updated_at"])
+        return True
+
+    def save_extracted_note(self, note, extracted):
+        """
+        Save the fields extracted from the document of a note, which is then ready to be
+        sent to Elasticsearch.
+        """
+        self.settle_note(note, ReferralNoteStatus.TO_SEND, extracted)
+
+    def extract_received_notes(self):
+        """
+        Extract the text and html of received notes, each document in its own process
+        bounded in time and memory. Each note is saved as soon as its extraction ends.
+        """
+        pending_notes = {}
+        stats = defaultdict(lambda: defaultdict(int))
+        started_at = time.monotonic()
+
+        for note_id, result, error, elapsed in run_in_limited_processes(
+            self.get_extraction_tasks(
+                ReferralNote.objects.filter(
+                    state=ReferralNoteStatus.RECEIVED
+                ).select_related("document"),
+                pending_notes,
+            ),
+            workers=self.workers,
+            timeout=self.timeout,
+            memory_limit=self.memory_limit,
+        ):
+            pending = pending_notes.pop(note_id)
+            pending.file.close()
+            stats[pending.extension]["documents"] += 1
+            stats[pending.extension]["bytes"] += pending.size
+            stats[pending.extension]["seconds"] += elapsed
+
+            if error:
+                stats[pending.extension]["failures"] += 1
+                self.fail_note(pending.note, [error])
+                continue
+
+            cache_note_content(
+                pending.extension, pending.content_hash, result, **self.budget
+            )
+            self.save_extracted_note(pending.note, {**pending.cached, **result})
+
+        if stats:
+            self.log_extraction_stats(stats, time.monotonic() - started_at)
+
+    def log_extraction_stats(self, stats, elapsed):
+        """
+        Log the extraction throughput for each document extension.
+        """
+        for extension, extension_stats in stats.items():
+            self.logger.info(
+                "Extracted %s %s documents (%s failed, %s bytes) in %.1fs, "
+                "%.2f documents/s per process",
+                extension_stats["documents"],
+                extension,
+                extension_stats["failures"],
+                extension_stats["bytes"],
+                extension_stats["seconds"],
+                extension_stats["documents"] / (extension_stats["seconds"] or 1),
+            )
+        self.logger.info(
+            "Extracted %s documents in %.1fs with %s processes",
+            sum(extension_stats["documents"] for extension_stats in stats.values()),
+            elapsed,
+            self.workers,
+        )
+
+    def send_notes(self, force=False):
+        """
+        Send the notes ready to be indexed to ElasticSearch and mark them as active.
+        Notes updated while they are sent are left for the next run, so a note is never
+        marked as active with a content the index did not receive.
+        """
+        started_at = timezone.now()
+        states = (
+            [ReferralNoteStatus.TO_SEND, ReferralNoteStatus.ACTIVE]
+            if force
+            else [ReferralNoteStatus.TO_SEND]
+        )
+        try:
+            upsert_result = NotesIndexer.upsert_notes_documents_by_state(
+                states=states, updated_before=started_at, logger=self.logger
+            )
+            self.logger.info("Result: %s", upsert_result)
+            ReferralNote.objects.filter(
+                state=ReferralNoteStatus.TO_SEND, updated_at__lte=started_at
+            ).update(state=ReferralNoteStatus.ACTIVE)
+        except (ValueError, Exception) as error:
+            self.logger.error("Unable to upsert notes:")
+            for i in error.args:
+                self.logger.error(i)
+
+    def delete_notes(self):
+        """
+        Remove the deleted notes from ElasticSearch and mark them as inactive.
+        """
+        started_at = timezone.now()
+        try:
+            delete_result = NotesIndexer.delete_notes_documents_by_state(
+                states=[ReferralNoteStatus.TO_DELETE],
+                updated_before=started_at,
+                logger=self.logger,
+            )
+            self.logger.info("Delete result: %s", delete_result)
+            ReferralNote.objects.filter(
+                state=ReferralNoteStatus.TO_DELETE, updated_at__lte=started_at
+            ).update(state=ReferralNoteStatus.INACTIVE)
+        except (ValueError, Exception) as error:
+            self.logger.error("Unable to delete notes:")
+            for i in error.args:
+                self.logger.error(i)
+
+    def refresh_filters(self):
+        """
+        Compute the snapshot of the notes filters for the notes just indexed.
+        """
+        try:
+            FacetSnapshotService.refresh_notes_snapshot()
+        except (ValueError, Exception) as error:
+            # The snapshot is computed on the next visit to the notes list instead
+            self.logger.warning("Unable to refresh the notes filters: %s", error)
@@ -2,8 +2,6 @@
 Common views that serve a purpose for any Partaj user.
 """
 
-import codecs
-import csv
 import mimetypes
 
 from django.conf import settings
@@ -26,9 +24,14 @@ from ..models import (
     ReferralState,
     VersionDocument,
 )
+from ..services.csv_stream import stream_csv
 from ..services.files.referral_to_docx import ReferralDocx
 from ..transform_prosemirror_docx import TransformProsemirrorDocx
 
+# Number of referrals read from the database, with their related objects, at a time
+# by the csv export
+EXPORT_CHUNK_SIZE = 500
+
 
 class ExportReferralView(LoginRequiredMixin, View):
     """
@@ -80,16 +83,18 @@ class ExportNewReferralView(LoginRequiredMixin, View):
 
 class ExportView(LoginRequiredMixin, View):
     """
-    Return a list of referrals as a csv file to authenticated users.
+    Return a list of referrals as a csv file to authenticated users. Referrals are read
+    by chunks, with their related objects prefetched for each chunk, and written to the
+    file as they are read.
     """
 
     def get_queryset(self):
         """
-        fFilter referrals and return a ready-to-use queryset.
+        Filter referrals and return a ready-to-use queryset.
         """
-
-        queryset = (
-            models.Referral.objects.select_related("report")
+        return (
+            models.Referral.objects.select_related("report", "topic")
+            .prefetch_related("users", "units", "assignees")
             .exclude(state=ReferralState.DRAFT)
             .annotate(
                 due_date=ExpressionWrapper(
@@ -97,33 +102,53 @@ class ExportView(LoginRequiredMixin, View):
                     output_field=DateTimeField(),
                 )
             )
-        )
-
-        queryset = (
-            queryset.annotate(
-                is_user_related_unit_member=Exists(
-                    models.UnitMembership.objects.filter(
-                        unit=OuterRef("units"), user=self.request.user
+            # Only include referral where the user is part of a linked unit, without
+            # joining their units so that each referral is read once
+            .filter(
+                Exists(
+                    models.ReferralUnitAssignment.objects.filter(
+                        referral=OuterRef("pk"),
+                        unit__in=models.UnitMembership.objects.filter(
+                            user=self.request.user
+                        ).values("unit"),
                     )
                 )
             )
-            # Only include referral where the user is part of a linked unit
-            .filter(is_user_related_unit_member=True).distinct()
         )
 
-        return queryset
+    @staticmethod
+    def get_row(ref):
+        """
+        Format a referral as a row of the csv file.
+        """
+        requesters = ref.users.all()
+        return [
+            str(ref.id),
+            ref.sent_at.strftime("%m/%d/%Y"),
+            ref.due_date.strftime("%m/%d/%Y"),
+            models.ReferralStatus(ref.status).label,
+            ref.topic.name,
+            ref.object,
+            " - ".join([user.unit_name for user in requesters]),
+            " - ".join([user.get_full_name() for user in requesters]),
+            " - ".join([unit.name for unit in ref.units.all()]),
+            " - ".join([user.get_full_name() for user in ref.assignees.all()]),
+            models.ReferralState(ref.state).label,
+            (
+                ref.report.published_at.strftime("%m/%d/%Y")
+                if ref.report is not None and ref.report.published_at is not None
+                else None
+            ),
+        ]
 
     def get(self, request):
         """
-        Build and return the csv file
+        Build and stream the csv file
         """
-        queryset = self.get_queryset()
+        referrals = self.get_queryset().iterator(chunk_size=EXPORT_CHUNK_SIZE)
 
-        response = HttpResponse(content_type="application/force-download")
-        response["Content-Disposition"] = "attachment; filename=saisines.csv"
-        response.write(codecs.BOM_UTF8)
-        writer = csv.writer(response, delimiter=";", quoting=csv.QUOTE_ALL)
-        writer.writerow(
+        return stream_csv(
+            "saisines.csv",
             [
                 _("export id"),
                 _("export send at"),
@@ -137,31 +162,10 @@ class ExportView(LoginRequiredMixin, View):
                 _("export assignees"),
                 _("export state"),
                 _("export published date"),
-            ]
+            ],
+            (self.get_row(ref) for ref in referrals),
+            content_type="application/force-download",
         )
-        for ref in queryset.all():
-            writer.writerow(
-                [
-                    str(ref.id),
-                    ref.sent_at.strftime("%m/%d/%Y"),
-                    ref.due_date.strftime("%m/%d/%Y"),
-                    models.ReferralStatus(ref.status).label,
-                    ref.topic.name,
-                    ref.object,
-                    " - ".join([user.unit_name for user in ref.users.all()]),
-                    " - ".join([user.get_full_name() for user in ref.users.all()]),
-                    " - ".join([unit.name for unit in ref.units.all()]),
-                    " - ".join([user.get_full_name() for user in ref.assignees.all()]),
-                    models.ReferralState(ref.state).label,
-                    (
-                        ref.report.published_at.strftime("%m/%d/%Y")
-                        if ref.report is not None
-                        and ref.report.published_at is not None
-                        else None
-                    ),
-                ]
-            )
-        return response
 
 
 class AuthenticatedFilesView(LoginRequiredMixin, View):
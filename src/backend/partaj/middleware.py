@@ -10,6 +10,8 @@ from django.shortcuts import redirect
 
 from ipware import get_client_ip
 
+from partaj.core.indexers import referral_index_scope
+
 logger = logging.getLogger("partaj")
 
 
@@ -60,6 +62,22 @@ class ParticuliersBlockMiddleware:
         return self.get_response(request)
 
 
+class ReferralIndexScopeMiddleware:
+    """
+    Middleware sending each referral changed by a request to Elasticsearch only once,
+    when the request is over, instead of on every save
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with referral_index_scope() as scope:
+            # Keep the scope on the request so tests can check what was sent
+            request.referral_index_scope = scope
+            return self.get_response(request)
+
+
 class AdminIPWhitelistMiddleware:
     """
     Middleware restricting the access to the admin with a whitelist of IP addresses
@@ -19,6 +19,15 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Pagination - results per page for the knowledge base
 KNOWLEDGE_BASE_PAGINATION_SIZE = 10
+# Highlighting of the knowledge base search hits: fragments of the text for each hit,
+# their size in characters, and how long the highlights of a hit are cached in seconds
+KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENTS = 5
+KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENT_SIZE = 100
+KNOWLEDGE_BASE_HIGHLIGHT_CACHE_TIMEOUT = 600
+# Number of knowledge base search results kept in memory by each process
+KNOWLEDGE_BASE_CACHE_SIZE = 256
+# Number of dashboard responses kept in memory by each process
+DASHBOARD_CACHE_SIZE = 512
 
 
 def get_release():
@@ -252,6 +261,7 @@ class Base(ElasticSearchMixin, SendinblueMixin, DRFMixin, Configuration):
         "dockerflow.django.middleware.DockerflowMiddleware",
         "partaj.middleware.HeadersMiddleware",
         "partaj.middleware.AdminIPWhitelistMiddleware",
+        "partaj.middleware.ReferralIndexScopeMiddleware",
     ]
 
     ROOT_URLCONF = "partaj.urls"
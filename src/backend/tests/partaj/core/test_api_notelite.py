@@ -0,0 +1,231 @@
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from partaj.core import factories, models
+from partaj.core.api import note_lite
+from partaj.core.elasticsearch import (
+    ElasticsearchClientCompat7to6,
+    ElasticsearchIndicesClientCompat7to6,
+)
+from partaj.core.index_manager import partaj_bulk
+from partaj.core.indexers import NotesIndexer
+
+ES_CLIENT = ElasticsearchClientCompat7to6(["elasticsearch"], timeout=30)
+ES_INDICES_CLIENT = ElasticsearchIndicesClientCompat7to6(ES_CLIENT)
+
+
+class NoteLiteApiTestCase(TestCase):
+    """
+    Test API routes and actions related to NoteLite endpoints.
+    """
+
+    def setUp(self):
+        note_lite.NOTES_RESULTS_CACHE.clear()
+
+    @staticmethod
+    def setup_elasticsearch():
+        """
+        Set up ES indices and their settings with existing instances.
+        """
+        # Delete any existing indices so we get a clean slate
+        ES_INDICES_CLIENT.delete(index="_all")
+        # Create an index we'll use to test the ES features
+        ES_INDICES_CLIENT.create(index=NotesIndexer.index_name)
+        ES_INDICES_CLIENT.close(index=NotesIndexer.index_name)
+        ES_INDICES_CLIENT.put_settings(
+            body=NotesIndexer.ANALYSIS_SETTINGS, index=NotesIndexer.index_name
+        )
+        ES_INDICES_CLIENT.open(index=NotesIndexer.index_name)
+
+        # Use the default notes mapping from the Indexer
+        ES_INDICES_CLIENT.put_mapping(
+            body=NotesIndexer.mapping, index=NotesIndexer.index_name
+        )
+
+        # Actually insert our notes in the index
+        partaj_bulk(
+            actions=NotesIndexer.get_es_documents_by_state(
+                [models.ReferralNoteStatus.TO_SEND]
+            )
+        )
+        ES_INDICES_CLIENT.refresh()
+
+    @staticmethod
+    def create_note(referral_id, text):
+        document = models.NoteDocument.objects.create(
+            file=SimpleUploadedFile("note.pdf", b"pdf"), name="note"
+        )
+        return models.ReferralNote.objects.create(
+            referral_id=referral_id,
+            publication_date=timezone.now(),
+            object="Object",
+            topic="Topic",
+            author="Author",
+            text=text,
+            document=document,
+            state=models.ReferralNoteStatus.TO_SEND,
+        )
+
+    def test_list_notelites_projection(self):
+        """
+        The notes list only returns the fields the list shows, with the highlighted
+        fragments of the text instead of the text itself.
+        """
+        user = factories.UserFactory()
+        self.create_note("1", "Le droit des contrats publics " + "lorem ipsum " * 500)
+        self.create_note("2", "Autre sujet " + "lorem ipsum " * 500)
+
+        self.setup_elasticsearch()
+        response = self.client.get(
+            "/api/noteslites/?query=contrats",
+            HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+        results = response.json()["results"]
+        self.assertEqual(results["hits"]["total"]["value"], 1)
+        hit = results["hits"]["hits"][0]
+        self.assertEqual(set(hit), {"_id", "_source", "highlight"})
+        self.assertEqual(hit["_id"], "1")
+        self.assertNotIn("text", hit["_source"])
+        self.assertEqual(hit["_source"]["referral_id"], "1")
+        self.assertEqual(hit["_source"]["document"]["name"], "note")
+        self.assertIn('<span class="highlight">contrats', hit["highlight"]["text"][0])
+        self.assertIn("search;dur=", response["Server-Timing"])
+        self.assertIn("highlight;dur=", response["Server-Timing"])
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENTS=1,
+        KNOWLEDGE_BASE_HIGHLIGHT_FRAGMENT_SIZE=50,
+    )
+    def test_list_notelites_highlights(self):
+        """
+        Hits are highlighted within the fragment budget in a second search, which is
+        skipped when their highlights are cached or when there is no full text query.
+        """
+        user = factories.UserFactory()
+        self.create_note("1", "contrats " + "lorem ipsum " * 50 + " contrats")
+
+        self.setup_elasticsearch()
+        # Do not serve the second request from the results cache
+        with mock.patch.object(
+            note_lite.NOTES_RESULTS_CACHE, "settle_delay", 3600
+        ), mock.patch.object(
+            note_lite.ES_CLIENT, "search", wraps=note_lite.ES_CLIENT.search
+        ) as search_mock:
+            for _ in range(2):
+                response = self.client.get(
+                    "/api/noteslites/?query=contrats",
+                    HTTP_AUTHORIZATION=(
+                        f"Token {Token.objects.get_or_create(user=user)[0]}"
+                    ),
+                )
+                highlight = response.json()["results"]["hits"]["hits"][0]["highlight"]
+                self.assertEqual(len(highlight["text"]), 1)
+            # Two searches for the first request, one for the second one
+            self.assertEqual(search_mock.call_count, 3)
+
+            response = self.client.get(
+                "/api/noteslites/",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+            )
+            self.assertEqual(search_mock.call_count, 4)
+            self.assertEqual(
+                response.json()["results"]["hits"]["hits"][0]["highlight"], {}
+            )
+
+    def test_list_notelites_without_hits(self):
+        """
+        A search matching no note returns an empty list.
+        """
+        user = factories.UserFactory()
+        self.create_note("1", "Le droit des contrats publics")
+
+        self.setup_elasticsearch()
+        response = self.client.get(
+            "/api/noteslites/?query=introuvable",
+            HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 0)
+        self.assertEqual(
+            response.json()["results"],
+            {"hits": {"total": {"value": 0, "relation": "eq"}, "hits": []}},
+        )
+
+    def test_list_notelites_results_cache(self):
+        """
+        Repeated searches are served from the results cache until the notes index is
+        written to.
+        """
+        user = factories.UserFactory()
+        self.create_note("1", "Le droit des contrats publics")
+
+        self.setup_elasticsearch()
+        with mock.patch.object(
+            note_lite.NOTES_RESULTS_CACHE, "settle_delay", 0
+        ), mock.patch.object(
+            note_lite.NOTES_RESULTS_CACHE, "generation_ttl", 0
+        ), mock.patch.object(
+            note_lite.ES_CLIENT, "search", wraps=note_lite.ES_CLIENT.search
+        ) as search_mock:
+            for query in ["?topic=b&topic=a", "?topic=a&topic=b"]:
+                response = self.client.get(
+                    f"/api/noteslites/{query}",
+                    HTTP_AUTHORIZATION=(
+                        f"Token {Token.objects.get_or_create(user=user)[0]}"
+                    ),
+                )
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(search_mock.call_count, 1)
+            self.assertIn("cache;dur=", response["Server-Timing"])
+
+            self.create_note("2", "Autre sujet")
+            self.setup_elasticsearch()
+            response = self.client.get(
+                "/api/noteslites/?topic=a&topic=b",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+            )
+            self.assertEqual(search_mock.call_count, 2)
+
+    @override_settings(KNOWLEDGE_BASE_PAGINATION_SIZE=2)
+    def test_list_notelites_cursor(self):
+        """
+        Notes are paginated with the cursor returned with each page but the last one.
+        """
+        user = factories.UserFactory()
+        for referral_id in ["1", "2", "3"]:
+            self.create_note(referral_id, "Text")
+
+        self.setup_elasticsearch()
+        referral_ids = []
+        url = "/api/noteslites/"
+        for _ in range(2):
+            response = self.client.get(
+                url,
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+            )
+            self.assertEqual(response.status_code, 200)
+            referral_ids += [
+                hit["_id"] for hit in response.json()["results"]["hits"]["hits"]
+            ]
+            url = f"/api/noteslites/?cursor={response.json()['next']}"
+
+        self.assertEqual(sorted(referral_ids), ["1", "2", "3"])
+        self.assertIsNone(response.json()["next"])
+
+        response = self.client.get(
+            "/api/noteslites/?cursor=invalid",
+            HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+        )
+        self.assertEqual(response.status_code, 400)
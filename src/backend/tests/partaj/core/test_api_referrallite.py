@@ -11,6 +11,7 @@ import arrow
 from rest_framework.authtoken.models import Token
 
 from partaj.core import factories, models
+from partaj.core.api import referral_lite
 from partaj.core.elasticsearch import (
     ElasticsearchClientCompat7to6,
     ElasticsearchIndicesClientCompat7to6,
@@ -1851,3 +1852,217 @@ class ReferralLiteApiTestCase(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["count"], 0)
+
+    def test_dashboard_and_export_referrals_projection(self):
+        """
+        Dashboard lists only fetch the lite payload of the referrals, which is stored
+        without being indexed, and the export only fetches the columns it writes.
+        """
+        owner = factories.UserFactory()
+        topic = factories.TopicFactory()
+        models.UnitMembership.objects.create(
+            role=models.UnitMembershipRole.OWNER,
+            user=owner,
+            unit=topic.unit,
+        )
+        referral = factories.ReferralFactory(
+            state=models.ReferralState.RECEIVED,
+            topic=topic,
+            urgency_level=models.ReferralUrgency.objects.get(
+                duration=datetime.timedelta(days=1)
+            ),
+        )
+
+        self.setup_elasticsearch()
+        self.assertEqual(
+            ES_INDICES_CLIENT.get_mapping(index="partaj_referrals")["partaj_referrals"][
+                "mappings"
+            ]["properties"]["_lite"],
+            {"type": "object", "enabled": False},
+        )
+
+        with mock.patch.object(
+            referral_lite.ES_CLIENT, "msearch", wraps=referral_lite.ES_CLIENT.msearch
+        ) as msearch_mock:
+            response = self.client.get(
+                "/api/referrallites/dashboard/",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=owner)[0]}",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["all"]["count"], 1)
+            self.assertEqual(response.json()["all"]["items"][0]["id"], referral.id)
+            self.assertEqual(response.json()["done"], {"count": 0, "items": []})
+            searches = msearch_mock.call_args.kwargs["body"]
+            # The counts search, then a search for the referrals of each tab
+            self.assertEqual(searches[1]["size"], 0)
+            self.assertEqual(
+                [body["_source"] for body in searches[3::2]],
+                [["_lite"]] * (len(searches) // 2 - 1),
+            )
+
+        with mock.patch.object(
+            referral_lite.ES_CLIENT, "search", wraps=referral_lite.ES_CLIENT.search
+        ) as search_mock:
+            response = self.client.get(
+                "/api/referrallites/export/dashboard/",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=owner)[0]}",
+            )
+            self.assertEqual(response.status_code, 200)
+            content = b"".join(response.streaming_content).decode("utf-8-sig")
+            self.assertIn(f'"{referral.id}"', content)
+            self.assertEqual(
+                search_mock.call_args.kwargs["body"]["_source"],
+                referral_lite.REFERRAL_EXPORT_SOURCE,
+            )
+
+    def test_export_referrals_pages(self):
+        """
+        The CSV export streams all the referrals of the tab, searched page by page.
+        """
+        owner = factories.UserFactory()
+        topic = factories.TopicFactory()
+        models.UnitMembership.objects.create(
+            role=models.UnitMembershipRole.OWNER,
+            user=owner,
+            unit=topic.unit,
+        )
+        referrals = [
+            factories.ReferralFactory(
+                state=models.ReferralState.RECEIVED,
+                topic=topic,
+                urgency_level=models.ReferralUrgency.objects.get(
+                    duration=datetime.timedelta(days=1)
+                ),
+            )
+            for _ in range(3)
+        ]
+
+        self.setup_elasticsearch()
+        with mock.patch.object(referral_lite, "EXPORT_PAGE_SIZE", 2), mock.patch.object(
+            referral_lite.ES_CLIENT, "search", wraps=referral_lite.ES_CLIENT.search
+        ) as search_mock:
+            response = self.client.get(
+                "/api/referrallites/export/dashboard/assign/",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=owner)[0]}",
+            )
+            rows = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(search_mock.call_count, 2)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            sorted(row.split(";")[0] for row in rows[1:]),
+            sorted(f'"{referral.id}"' for referral in referrals),
+        )
+
+    def test_dashboard_referrals_selected_tabs(self):
+        """
+        Only the referrals of the requested tabs are searched, all tabs being counted
+        by a single aggregation.
+        """
+        owner = factories.UserFactory()
+        topic = factories.TopicFactory()
+        models.UnitMembership.objects.create(
+            role=models.UnitMembershipRole.OWNER,
+            user=owner,
+            unit=topic.unit,
+        )
+        _, closed = [
+            factories.ReferralFactory(
+                state=state,
+                topic=topic,
+                urgency_level=models.ReferralUrgency.objects.get(
+                    duration=datetime.timedelta(days=1)
+                ),
+            )
+            for state in [models.ReferralState.RECEIVED, models.ReferralState.CLOSED]
+        ]
+
+        self.setup_elasticsearch()
+        with mock.patch.object(
+            referral_lite.ES_CLIENT, "msearch", wraps=referral_lite.ES_CLIENT.msearch
+        ) as msearch_mock:
+            response = self.client.get(
+                "/api/referrallites/dashboard/?tabs=done",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=owner)[0]}",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        msearch_mock.assert_called_once()
+        self.assertEqual(len(msearch_mock.call_args.kwargs["body"]), 4)
+        self.assertEqual(response.json()["all"], {"count": 2, "items": []})
+        self.assertEqual(response.json()["assign"], {"count": 1, "items": []})
+        self.assertEqual(response.json()["done"]["count"], 1)
+        self.assertEqual(
+            [item["id"] for item in response.json()["done"]["items"]], [closed.id]
+        )
+
+    def test_dashboard_referrals_cache(self):
+        """
+        Dashboard responses are cached for each user and query until the referrals
+        index is written to.
+        """
+        owner = factories.UserFactory()
+        topic = factories.TopicFactory()
+        models.UnitMembership.objects.create(
+            role=models.UnitMembershipRole.OWNER,
+            user=owner,
+            unit=topic.unit,
+        )
+        factories.ReferralFactory(
+            state=models.ReferralState.RECEIVED,
+            topic=topic,
+            urgency_level=models.ReferralUrgency.objects.get(
+                duration=datetime.timedelta(days=1)
+            ),
+        )
+
+        self.setup_elasticsearch()
+        with mock.patch.object(
+            referral_lite.REFERRALS_DASHBOARD_CACHE, "settle_delay", 0
+        ), mock.patch.object(
+            referral_lite.REFERRALS_DASHBOARD_CACHE, "generation_ttl", 0
+        ), mock.patch.object(
+            referral_lite.ES_CLIENT, "msearch", wraps=referral_lite.ES_CLIENT.msearch
+        ) as msearch_mock:
+            for query in ["?tabs=all&tabs=done", "?tabs=done&tabs=all"]:
+                response = self.client.get(
+                    f"/api/referrallites/dashboard/{query}",
+                    HTTP_AUTHORIZATION=(
+                        f"Token {Token.objects.get_or_create(user=owner)[0]}"
+                    ),
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["all"]["count"], 1)
+            self.assertEqual(msearch_mock.call_count, 1)
+
+            # Another user gets their own dashboard
+            other_owner = factories.UserFactory()
+            models.UnitMembership.objects.create(
+                role=models.UnitMembershipRole.OWNER,
+                user=other_owner,
+                unit=factories.UnitFactory(),
+            )
+            response = self.client.get(
+                "/api/referrallites/dashboard/?tabs=all&tabs=done",
+                HTTP_AUTHORIZATION=(
+                    f"Token {Token.objects.get_or_create(user=other_owner)[0]}"
+                ),
+            )
+            self.assertEqual(response.json()["all"]["count"], 0)
+            self.assertEqual(msearch_mock.call_count, 2)
+
+            factories.ReferralFactory(
+                state=models.ReferralState.RECEIVED,
+                topic=topic,
+                urgency_level=models.ReferralUrgency.objects.get(
+                    duration=datetime.timedelta(days=1)
+                ),
+            )
+            self.setup_elasticsearch()
+            response = self.client.get(
+                "/api/referrallites/dashboard/?tabs=all&tabs=done",
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=owner)[0]}",
+            )
+            self.assertEqual(response.json()["all"]["count"], 2)
+            self.assertEqual(msearch_mock.call_count, 3)
@@ -0,0 +1,295 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from elasticsearch.helpers import BulkIndexError
+
+from partaj.core import factories, models
+from partaj.core.index_manager import (
+    INCREMENTAL_INDEXING_OVERLAP,
+    MISSING,
+    ORPHANED,
+    STALE,
+    compare_fingerprints,
+    get_id_partitions,
+    perform_create_index,
+    perform_incremental_indexing,
+    perform_parallel_referrals_indexing,
+    regenerate_indices,
+)
+from partaj.core.indexers import ReferralsIndexer, partaj_bulk
+from partaj.core.indexers.common import (
+    REBUILD_INDICES,
+    REBUILD_INDICES_TTL,
+    BulkLoadStats,
+    mirror_actions,
+)
+
+
+class InProcessPool:
+    """
+    Stand-in for a pool of worker processes running the tasks in the test process, which
+    alone sees the data of the test transaction.
+    """
+
+    def __init__(self, processes=None, initializer=None):
+        self.processes = processes
+        if initializer:
+            initializer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, function, iterable):
+        """Run the tasks one after the other."""
+        return map(function, iterable)
+
+
+def in_process_workers():
+    """
+    Run the worker processes of a parallel indexing in the test process, without closing
+    the database connection of the test.
+    """
+    return mock.patch.multiple(
+        "partaj.core.index_manager",
+        connections=mock.DEFAULT,
+        multiprocessing=mock.Mock(
+            get_context=mock.Mock(return_value=mock.Mock(Pool=InProcessPool))
+        ),
+    )
+
+
+class IndexManagerTestCase(TestCase):
+    """
+    Test helpers from the index manager.
+    """
+
+    def test_get_id_partitions(self):
+        """
+        Id ranges are split in contiguous partitions covering the whole range.
+        """
+        self.assertEqual(
+            get_id_partitions(1, 10, 3),
+            [(1, 4), (5, 8), (9, 10)],
+        )
+        self.assertEqual(get_id_partitions(5, 5, 4), [(5, 5)])
+        self.assertEqual(
+            get_id_partitions(1, 3, 8),
+            [(1, 1), (2, 2), (3, 3)],
+        )
+
+    def test_perform_parallel_referrals_indexing(self):
+        """
+        Every referral is loaded once by the workers, and their stats are merged.
+        """
+        referrals = [factories.ReferralFactory() for _ in range(5)]
+        loaded_ids = []
+
+        def load(actions, stats, **kwargs):
+            documents = list(actions)
+            loaded_ids.extend(document["_id"] for document in documents)
+            stats.add_chunk(len(documents), 100, 0.1, 0)
+            return stats
+
+        stats = BulkLoadStats()
+        with in_process_workers(), mock.patch(
+            "partaj.core.index_manager.partaj_bulk_load", side_effect=load
+        ) as bulk_load:
+            self.assertEqual(
+                perform_parallel_referrals_indexing("referrals_new", 2, stats=stats), 5
+            )
+
+        self.assertEqual(
+            sorted(loaded_ids), sorted(referral.id for referral in referrals)
+        )
+        self.assertEqual(stats.documents, 5)
+        self.assertEqual(len(stats.chunks), bulk_load.call_count)
+        self.assertGreater(bulk_load.call_count, 1)
+
+    def test_regenerate_indices_failing_worker(self):
+        """
+        A worker failing to load its referrals makes the regeneration fail before the
+        aliases are swapped, and the rebuild is not mirrored to anymore.
+        """
+        factories.ReferralFactory()
+
+        with in_process_workers(), mock.patch(
+            "partaj.core.index_manager.ES_INDICES_CLIENT"
+        ) as indices_client, mock.patch(
+            "partaj.core.index_manager.time.sleep"
+        ), mock.patch(
+            "partaj.core.index_manager.partaj_bulk_load",
+            side_effect=BulkIndexError("1 document(s) failed to index.", []),
+        ), self.assertRaises(
+            BulkIndexError
+        ):
+            regenerate_indices(workers=2)
+
+        indices_client.update_aliases.assert_not_called()
+        self.assertEqual(models.IndexState.objects.get_rebuild_indices(), {})
+
+    def test_bulk_load_stats(self):
+        """
+        Bulk load stats sum up chunks, including the ones merged from worker processes.
+        """
+        stats = BulkLoadStats()
+        for latency in [0.4, 0.1, 0.3, 0.2]:
+            stats.add_chunk(200, 1000, latency, 0)
+        worker_stats = BulkLoadStats()
+        worker_stats.add_chunk(50, 300, 1.5, 2)
+        stats.merge(worker_stats)
+
+        summary = stats.get_summary()
+        self.assertEqual(summary["documents"], 850)
+        self.assertEqual(summary["chunks"], 5)
+        self.assertEqual(summary["bytes_sent"], 4300)
+        self.assertEqual(summary["latency_p50"], 0.3)
+        self.assertEqual(summary["latency_p95"], 1.5)
+        self.assertEqual(summary["latency_max"], 1.5)
+        self.assertEqual(summary["failures"], 2)
+        self.assertEqual(summary["chunks_with_failures"], 1)
+        self.assertEqual(BulkLoadStats().get_latency_percentile(50), 0)
+
+    def test_rebuild_mirrors_writes(self):
+        """
+        While a rebuild is registered, actions on its alias are copied to the new index.
+        """
+        alias = ReferralsIndexer.index_name
+        models.IndexState.objects.start_rebuild(alias, f"{alias}_new")
+        self.assertEqual(
+            models.IndexState.objects.get_rebuild_indices(), {alias: f"{alias}_new"}
+        )
+
+        actions = [
+            {"_id": 1, "_index": alias, "_op_type": "index", "title": "A"},
+            {"_id": 2, "_index": "other", "_op_type": "delete"},
+        ]
+        mirrored = []
+        self.assertEqual(
+            list(mirror_actions(actions, {alias: f"{alias}_new"}, mirrored)), actions
+        )
+        self.assertEqual(
+            mirrored,
+            [{"_id": 1, "_index": f"{alias}_new", "_op_type": "index", "title": "A"}],
+        )
+
+        models.IndexState.objects.finish_rebuilds([alias])
+        self.assertEqual(models.IndexState.objects.get_rebuild_indices(), {})
+
+    def test_partaj_bulk_mirrors_writes_ignoring_missing_documents(self):
+        """
+        Mirrored actions are sent after the others, ignoring documents the new index
+        does not have yet.
+        """
+        alias = ReferralsIndexer.index_name
+        models.IndexState.objects.start_rebuild(alias, f"{alias}_new")
+        REBUILD_INDICES.clear()
+        self.addCleanup(REBUILD_INDICES.clear)
+        action = {"_id": 1, "_index": alias, "_op_type": "delete"}
+
+        with mock.patch(
+            "partaj.core.indexers.common.bulk_compat",
+            side_effect=lambda actions, **kwargs: (len(list(actions)), 0),
+        ) as bulk_compat:
+            partaj_bulk([action])
+
+        mirror_call = bulk_compat.call_args_list[1].kwargs
+        self.assertEqual(mirror_call["actions"], [{**action, "_index": f"{alias}_new"}])
+        self.assertEqual(mirror_call["ignore_status"], (404,))
+
+    def test_perform_create_index_catches_up_writes_since_the_rebuild(self):
+        """
+        The database is loaded only once processes had the time to mirror their writes,
+        and the writes of processes that did not are caught up from the start of the
+        rebuild, with some overlap.
+        """
+        started_at = timezone.now()
+        steps = mock.Mock()
+        steps.start_rebuild.return_value = started_at
+
+        with mock.patch(
+            "partaj.core.index_manager.ES_INDICES_CLIENT"
+        ), mock.patch.object(
+            models.IndexState.objects, "start_rebuild", steps.start_rebuild
+        ), mock.patch(
+            "partaj.core.index_manager.time.sleep", steps.sleep
+        ), mock.patch(
+            "partaj.core.index_manager.partaj_bulk_load", steps.partaj_bulk_load
+        ), mock.patch.object(
+            ReferralsIndexer,
+            "get_es_documents_changed_since",
+            steps.get_es_documents_changed_since,
+        ), mock.patch(
+            "partaj.core.index_manager.partaj_bulk", return_value=(0, [])
+        ):
+            new_index = perform_create_index(ReferralsIndexer)
+
+        self.assertEqual(
+            [step[0] for step in steps.mock_calls],
+            [
+                "start_rebuild",
+                "sleep",
+                "partaj_bulk_load",
+                "get_es_documents_changed_since",
+            ],
+        )
+        steps.start_rebuild.assert_called_once_with(
+            ReferralsIndexer.index_name, new_index
+        )
+        steps.sleep.assert_called_once_with(REBUILD_INDICES_TTL)
+        steps.get_es_documents_changed_since.assert_called_once_with(
+            started_at - INCREMENTAL_INDEXING_OVERLAP, index=new_index
+        )
+
+    def test_perform_incremental_indexing(self):
+        """
+        An incremental indexing resumes from the last watermark, with some overlap, and
+        moves the watermark only when it succeeds.
+        """
+        calls = []
+
+        def upsert_changed_since(since, logger=None):
+            calls.append(since)
+            return 1
+
+        with self.assertRaises(ValueError):
+            perform_incremental_indexing(ReferralsIndexer, upsert_changed_since)
+
+        since = timezone.now() - timedelta(days=1)
+        before = timezone.now()
+        perform_incremental_indexing(ReferralsIndexer, upsert_changed_since, since)
+        watermark = models.IndexState.objects.get_watermark(ReferralsIndexer.index_name)
+        self.assertGreaterEqual(watermark, before)
+
+        def failing_upsert_changed_since(since, logger=None):
+            raise ValueError("Elasticsearch is down")
+
+        with self.assertRaises(ValueError):
+            perform_incremental_indexing(ReferralsIndexer, failing_upsert_changed_since)
+        self.assertEqual(
+            models.IndexState.objects.get_watermark(ReferralsIndexer.index_name),
+            watermark,
+        )
+
+        perform_incremental_indexing(ReferralsIndexer, upsert_changed_since)
+        self.assertEqual(calls, [since, watermark - INCREMENTAL_INDEXING_OVERLAP])
+
+    def test_compare_fingerprints(self):
+        """
+        Sorted fingerprints from the database and from the index are compared id by id.
+        """
+        self.assertEqual(
+            list(
+                compare_fingerprints(
+                    [(1, "a"), (2, "b"), (4, "d"), (6, "f")],
+                    [(2, "b"), (3, "c"), (4, "x"), (7, "g")],
+                )
+            ),
+            [(1, MISSING), (3, ORPHANED), (4, STALE), (6, MISSING), (7, ORPHANED)],
+        )
+        self.assertEqual(list(compare_fingerprints([], [])), [])
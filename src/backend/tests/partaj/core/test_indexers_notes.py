@@ -0,0 +1,68 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from partaj.core import factories, models
+from partaj.core.indexers import NotesIndexer
+
+
+class NotesIndexerTestCase(TestCase):
+    """
+    Test the notes indexer.
+    """
+
+    @staticmethod
+    def create_note(referral=None, **kwargs):
+        note = models.ReferralNote.objects.create(
+            referral_id=str(referral.id if referral else 999),
+            publication_date=timezone.now(),
+            object="Object",
+            topic="Topic",
+            author="Author",
+            requesters_unit_names=["Requester unit"],
+            assigned_units_names=["Assigned unit"],
+            text="Text",
+            state=models.ReferralNoteStatus.TO_SEND,
+            **kwargs,
+        )
+        if referral:
+            referral.note = note
+            referral.save()
+        return note
+
+    def test_get_es_documents_for_queryset(self):
+        """
+        Notes documents are built by batch in a fixed number of queries, with the same
+        content as documents built one note at a time.
+        """
+        group = models.ReferralGroup.objects.create()
+        referrals = [
+            factories.ReferralFactory(state=state)
+            for state in [
+                models.ReferralState.ANSWERED,
+                models.ReferralState.ANSWERED,
+                models.ReferralState.PROCESSING,
+            ]
+        ]
+        for referral in referrals:
+            models.ReferralSection.objects.create(referral=referral, group=group)
+            self.create_note(referral)
+        # A note whose referral is not part of a group
+        self.create_note(factories.ReferralFactory())
+        # A note whose referral does not exist anymore
+        self.create_note()
+
+        notes = models.ReferralNote.objects.order_by("referral_id")
+        with self.assertNumQueries(2):
+            documents = list(NotesIndexer.get_es_documents_for_queryset(notes))
+
+        self.assertEqual(len(documents), 5)
+        self.assertEqual(
+            documents,
+            [NotesIndexer.get_es_document_for_note(note) for note in notes],
+        )
+        siblings = {document["_id"]: document["siblings"] for document in documents}
+        self.assertEqual(siblings[str(referrals[0].id)], [referrals[1].id])
+        self.assertEqual(
+            siblings[str(referrals[2].id)], sorted([referrals[0].id, referrals[1].id])
+        )
+        self.assertEqual(siblings["999"], [])
@@ -0,0 +1,437 @@
+from datetime import date, timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from elasticsearch.exceptions import ConnectionTimeout
+from rest_framework.authtoken.models import Token
+
+from partaj.core import factories, models
+from partaj.core.elasticsearch import (
+    ElasticsearchClientCompat7to6,
+    ElasticsearchIndicesClientCompat7to6,
+)
+from partaj.core.index_manager import MISSING, ORPHANED, STALE, reconcile_index
+from partaj.core.indexers import ReferralsIndexer, partaj_bulk, referral_index_scope
+from partaj.core.indexers.common import ES_FLUSH_CLIENT
+
+ES_CLIENT = ElasticsearchClientCompat7to6(["elasticsearch"], timeout=30)
+ES_INDICES_CLIENT = ElasticsearchIndicesClientCompat7to6(ES_CLIENT)
+
+
+class ReferralsIndexerTestCase(TestCase):
+    """
+    Test the referrals indexer and the way referral changes reach Elasticsearch.
+    """
+
+    @staticmethod
+    def setup_elasticsearch():
+        # Delete any existing indices so we get a clean slate
+        ES_INDICES_CLIENT.delete(index="_all")
+        # Create an empty index we'll use to test the ES features
+        ES_INDICES_CLIENT.create(index="partaj_referrals")
+        ES_INDICES_CLIENT.close(index="partaj_referrals")
+        ES_INDICES_CLIENT.put_settings(
+            body=ReferralsIndexer.ANALYSIS_SETTINGS, index="partaj_referrals"
+        )
+        ES_INDICES_CLIENT.open(index="partaj_referrals")
+        ES_INDICES_CLIENT.put_mapping(
+            body=ReferralsIndexer.mapping, index="partaj_referrals"
+        )
+
+    def test_save_referral_enqueues_outbox_entry(self):
+        """
+        Saving a referral records its id in the outbox instead of calling Elasticsearch.
+        """
+        referral = factories.ReferralFactory()
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        referral.title = "New title"
+        referral.save()
+
+        self.assertEqual(
+            list(
+                models.ReferralIndexOutbox.objects.values_list("referral_id", flat=True)
+            ),
+            [referral.id],
+        )
+
+    def test_process_outbox(self):
+        """
+        Processing the outbox indexes every referral it holds once, deletes the documents
+        of referrals that do not exist anymore and empties the outbox.
+        """
+        self.setup_elasticsearch()
+        referral = factories.ReferralFactory()
+        deleted_referral = factories.ReferralFactory()
+        ReferralsIndexer.update_referral_document(deleted_referral)
+        deleted_referral_id = deleted_referral.id
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        deleted_referral.delete()
+        referral.save()
+        referral.save()
+        self.assertEqual(models.ReferralIndexOutbox.objects.count(), 3)
+
+        self.assertEqual(ReferralsIndexer.process_outbox(), 2)
+        self.assertEqual(models.ReferralIndexOutbox.objects.count(), 0)
+        self.assertEqual(ReferralsIndexer.process_outbox(), 0)
+
+        ES_INDICES_CLIENT.refresh()
+        self.assertEqual(
+            ES_CLIENT.get(index="partaj_referrals", id=referral.id)["_id"],
+            str(referral.id),
+        )
+        self.assertFalse(
+            ES_CLIENT.exists(index="partaj_referrals", id=deleted_referral_id)
+        )
+
+    @staticmethod
+    def create_indexed_referral():
+        """
+        Create a referral with most of the related objects that feed its document.
+        """
+        referral = factories.ReferralFactory(state=models.ReferralState.ASSIGNED)
+        factories.ReferralAssignmentFactory(
+            referral=referral, unit=referral.units.get()
+        )
+        factories.ReferralUserLinkFactory(
+            referral=referral, role=models.ReferralUserLinkRoles.OBSERVER
+        )
+        answer = factories.ReferralAnswerFactory(
+            referral=referral, state=models.ReferralAnswerState.PUBLISHED
+        )
+        factories.ReferralAnswerValidationRequestFactory(answer=answer)
+        return referral
+
+    def test_batch_documents_are_identical(self):
+        """
+        Documents built by chunks are serialized exactly like documents built one by one.
+        """
+        referrals = [self.create_indexed_referral() for _ in range(3)]
+        factories.FeatureFlagFactory(
+            tag="referral_version", limit_date=date.today() - timedelta(days=1)
+        )
+        referrals.append(
+            factories.ReferralFactory(report=factories.ReferralReportFactory())
+        )
+        serializer = ES_CLIENT.transport.serializer
+
+        batch_documents = list(ReferralsIndexer.get_es_documents())
+
+        self.assertEqual(len(batch_documents), 4)
+        for referral, batch_document in zip(referrals, batch_documents):
+            referral = models.Referral.objects.get(id=referral.id)
+            self.assertEqual(
+                serializer.dumps(batch_document),
+                serializer.dumps(
+                    ReferralsIndexer.get_es_document_for_referral(referral)
+                ),
+            )
+
+    def test_batch_documents_constant_queries(self):
+        """
+        The number of queries needed to build documents does not depend on the number
+        of referrals in a chunk.
+        """
+        self.create_indexed_referral()
+        with CaptureQueriesContext(connection) as one_referral_queries:
+            list(ReferralsIndexer.get_es_documents())
+
+        for _ in range(4):
+            self.create_indexed_referral()
+        with CaptureQueriesContext(connection) as five_referrals_queries:
+            list(ReferralsIndexer.get_es_documents())
+
+        self.assertEqual(
+            len(one_referral_queries.captured_queries),
+            len(five_referrals_queries.captured_queries),
+        )
+
+    def test_referral_ids_changed_since(self):
+        """
+        Referrals are found as changed when one of the rows feeding their document was
+        updated, including report events updated in bulk.
+        """
+        linked_referral = factories.ReferralFactory()
+        report_referral = factories.ReferralFactory(
+            report=factories.ReferralReportFactory()
+        )
+        event = factories.ReportEventFactory(report=report_referral.report)
+        factories.ReferralFactory()
+        since = timezone.now()
+
+        self.assertEqual(ReferralsIndexer.get_referral_ids_changed_since(since), set())
+
+        factories.ReferralUserLinkFactory(referral=linked_referral)
+        models.ReportEvent.objects.filter(id=event.id).update(
+            state=models.ReportEventState.OBSOLETE
+        )
+
+        self.assertEqual(
+            ReferralsIndexer.get_referral_ids_changed_since(since),
+            {linked_referral.id, report_referral.id},
+        )
+
+    def test_save_referral_enqueues_field_groups(self):
+        """
+        Saving a referral after changing fields that feed only some groups of fields of
+        its document records these groups, other changes record a full rebuild.
+        """
+        referral = factories.ReferralFactory(state=models.ReferralState.RECEIVED)
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        referral = models.Referral.objects.get(id=referral.id)
+        referral.title = "New title"
+        referral.mark_index_field_groups(models.ReferralIndexFieldGroup.USERS)
+        referral.save()
+        referral.context = "New context"
+        referral.save()
+        # State transitions change the related objects the document is built from
+        referral.state = models.ReferralState.ASSIGNED
+        referral.save()
+        referral.status = models.ReferralStatus.SENSITIVE
+        referral.save()
+        referral.save()
+
+        self.assertEqual(
+            list(
+                models.ReferralIndexOutbox.objects.order_by("id").values_list(
+                    "field_groups", flat=True
+                )
+            ),
+            [["title", "users"], [], [], [], []],
+        )
+
+    def test_partial_documents_match_full_document(self):
+        """
+        Each group of fields of a partial update holds the same values as the full
+        document.
+        """
+        referral = models.Referral.objects.get(id=self.create_indexed_referral().id)
+        factories.ReferralUserLinkFactory(referral=referral)
+        serializer = ES_CLIENT.transport.serializer
+        document = serializer.loads(
+            serializer.dumps(ReferralsIndexer.get_es_document_for_referral(referral))
+        )
+
+        for field_group in models.ReferralIndexFieldGroup:
+            partial_document = serializer.loads(
+                serializer.dumps(
+                    ReferralsIndexer.get_partial_es_document_for_referral(
+                        referral, [field_group]
+                    )
+                )
+            )
+            self.assertEqual(partial_document["_op_type"], "update")
+            self.assertIsNone(partial_document["doc"].pop("fingerprint"))
+            for key, value in partial_document["doc"].items():
+                if key == "_lite":
+                    for lite_key, lite_value in value.items():
+                        self.assertEqual(lite_value, document["_lite"][lite_key])
+                else:
+                    self.assertEqual(value, document[key])
+
+    def test_process_outbox_partial_update(self):
+        """
+        Field groups are sent as partial updates, documents missing from the index are
+        sent in full.
+        """
+        self.setup_elasticsearch()
+        indexed_referral = factories.ReferralFactory()
+        ReferralsIndexer.update_referral_document(indexed_referral)
+        missing_referral = factories.ReferralFactory()
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        for referral in models.Referral.objects.all():
+            referral.title = f"New title {referral.id}"
+            referral.save()
+
+        self.assertEqual(ReferralsIndexer.process_outbox(), 2)
+
+        ES_INDICES_CLIENT.refresh()
+        for referral in [indexed_referral, missing_referral]:
+            source = ES_CLIENT.get(index="partaj_referrals", id=referral.id)["_source"]
+            self.assertEqual(source["title"], f"New title {referral.id}")
+            self.assertEqual(source["_lite"]["title"], f"New title {referral.id}")
+            self.assertEqual(source["_lite"]["id"], referral.id)
+
+    def test_referral_index_scope(self):
+        """
+        Inside a referral index scope, a referral saved several times gets a single outbox
+        entry, sent to Elasticsearch once the transaction is committed.
+        """
+        self.setup_elasticsearch()
+        referral = factories.ReferralFactory(state=models.ReferralState.RECEIVED)
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with referral_index_scope() as scope:
+                referral.title = "New title"
+                referral.save()
+                referral.add_observer(factories.UserFactory(), factories.UserFactory())
+                referral.save()
+                referral.context = "New context"
+                referral.save()
+
+                self.assertEqual(
+                    list(
+                        models.ReferralIndexOutbox.objects.values_list(
+                            "referral_id", "field_groups"
+                        )
+                    ),
+                    [(referral.id, [])],
+                )
+                self.assertEqual(scope.written, {})
+
+        self.assertEqual(scope.written, {referral.id: 1})
+        self.assertEqual(models.ReferralIndexOutbox.objects.count(), 0)
+        ES_INDICES_CLIENT.refresh()
+        self.assertEqual(
+            ES_CLIENT.get(index="partaj_referrals", id=referral.id)["_source"]["title"],
+            "New title",
+        )
+
+    def test_referral_index_scope_leaves_slow_writes_to_the_outbox(self):
+        """
+        A referral index scope is flushed with a client that fails fast, leaving the
+        outbox entries to the worker when Elasticsearch is slow.
+        """
+        referral = factories.ReferralFactory(state=models.ReferralState.RECEIVED)
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        with mock.patch(
+            "partaj.core.indexers.common.bulk_compat",
+            side_effect=ConnectionTimeout("TIMEOUT", "Read timed out", None),
+        ) as bulk_compat, self.captureOnCommitCallbacks(execute=True):
+            with referral_index_scope() as scope:
+                referral.title = "New title"
+                referral.save()
+
+        self.assertIs(bulk_compat.call_args.kwargs["client"], ES_FLUSH_CLIENT)
+        self.assertEqual(scope.written, {})
+        self.assertEqual(
+            list(
+                models.ReferralIndexOutbox.objects.values_list("referral_id", flat=True)
+            ),
+            [referral.id],
+        )
+
+    def test_request_indexes_referral_once(self):
+        """
+        A request indexes each referral it changes once.
+        """
+        self.setup_elasticsearch()
+        referral = factories.ReferralFactory(state=models.ReferralState.RECEIVED)
+        user = factories.UnitMembershipFactory(
+            role=models.UnitMembershipRole.MEMBER, unit=referral.units.get()
+        ).user
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/referrals/{referral.id}/update_title/",
+                {"title": "New title"},
+                HTTP_AUTHORIZATION=f"Token {Token.objects.get_or_create(user=user)[0]}",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.wsgi_request.referral_index_scope.written, {referral.id: 1}
+        )
+
+    def test_unit_membership_change_does_not_reindex(self):
+        """
+        No field of referral documents depends on unit memberships, adding or removing a
+        member does not schedule any update.
+        """
+        referral = factories.ReferralFactory()
+        unit = referral.units.get()
+        user = factories.UserFactory()
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        unit.members.add(user)
+        unit.members.remove(user)
+
+        self.assertEqual(models.ReferralIndexOutbox.objects.count(), 0)
+
+    def test_enqueue_dependent_referrals(self):
+        """
+        Referrals depending on a changed model are scheduled by chunks, for the groups of
+        fields that depend on this model.
+        """
+        referrals = [factories.ReferralFactory() for _ in range(3)]
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                ReferralsIndexer.enqueue_dependent_referrals(
+                    models.ReferralUrgency, models.Referral.objects.all(), chunk_size=2
+                ),
+                3,
+            )
+
+        # Referral ids are streamed, and outbox entries inserted once per chunk
+        self.assertLessEqual(len(queries.captured_queries), 3)
+        self.assertEqual(
+            list(
+                models.ReferralIndexOutbox.objects.order_by("referral_id").values_list(
+                    "referral_id", "field_groups"
+                )
+            ),
+            [(referral.id, ["due_date"]) for referral in referrals],
+        )
+
+    def test_urgency_duration_change_updates_due_dates(self):
+        """
+        Changing the duration of an urgency schedules an update of the due date of the
+        referrals with this urgency only.
+        """
+        urgency = factories.ReferralUrgencyFactory()
+        referral = factories.ReferralFactory(urgency_level=urgency)
+        factories.ReferralFactory()
+        models.ReferralIndexOutbox.objects.all().delete()
+
+        urgency.name = "New name"
+        urgency.save(update_fields=["name"])
+        self.assertEqual(models.ReferralIndexOutbox.objects.count(), 0)
+
+        urgency.duration = timedelta(days=30)
+        urgency.save()
+        self.assertEqual(
+            list(
+                models.ReferralIndexOutbox.objects.values_list(
+                    "referral_id", "field_groups"
+                )
+            ),
+            [(referral.id, ["due_date"])],
+        )
+
+    def test_reconcile_index(self):
+        """
+        Reconciling the index reports missing, stale and orphaned documents, and repairs
+        them on demand. Partially updated documents are compared on their content.
+        """
+        self.setup_elasticsearch()
+        referrals = [factories.ReferralFactory() for _ in range(4)]
+        partaj_bulk(ReferralsIndexer.get_es_documents())
+        models.Referral.objects.filter(id=referrals[0].id).delete()
+        models.Referral.objects.filter(id=referrals[1].id).update(title="Stale")
+        ES_CLIENT.delete(index="partaj_referrals", id=referrals[2].id)
+        partaj_bulk(
+            [
+                ReferralsIndexer.get_partial_es_document_for_referral(
+                    referrals[3], [models.ReferralIndexFieldGroup.TITLE]
+                )
+            ]
+        )
+        ES_INDICES_CLIENT.refresh()
+
+        self.assertEqual(
+            reconcile_index(ReferralsIndexer, repair=True),
+            {ORPHANED: 1, STALE: 1, MISSING: 1},
+        )
+        ES_INDICES_CLIENT.refresh()
+        self.assertEqual(reconcile_index(ReferralsIndexer), {})
@@ -0,0 +1,159 @@
+import queue
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from partaj.core import models
+from partaj.core.indexers import partaj_bulk
+from partaj.core.search_cache import IndexResultsCache, SingleFlight
+
+
+class IndexResultsCacheTestCase(TestCase):
+    """
+    Test the cache of search results of an index.
+    """
+
+    def test_get_or_search(self):
+        """
+        Results are cached until the index is written to, the least recently used ones
+        being dropped beyond the size of the cache.
+        """
+        cache = IndexResultsCache("notes", maxsize=2, generation_ttl=0, settle_delay=0)
+        search = mock.Mock(side_effect=lambda: {"hits": search.call_count})
+
+        self.assertEqual(cache.get_or_search("a", search), {"hits": 1})
+        self.assertEqual(cache.get_or_search("a", search), {"hits": 1})
+        self.assertEqual(search.call_count, 1)
+
+        # Writing to the index invalidates the cached results
+        models.IndexGeneration.objects.bump_generations(["notes"])
+        self.assertEqual(cache.get_or_search("a", search), {"hits": 2})
+        self.assertEqual(models.IndexGeneration.objects.get(name="notes").generation, 1)
+
+        # Writing to another index does not
+        models.IndexGeneration.objects.bump_generations(["referrals"])
+        self.assertEqual(cache.get_or_search("a", search), {"hits": 2})
+
+        # "a" is the least recently used when "c" comes in
+        cache.get_or_search("b", search)
+        cache.get_or_search("c", search)
+        self.assertEqual(search.call_count, 4)
+        self.assertEqual(cache.get_or_search("c", search), {"hits": 4})
+        self.assertEqual(cache.get_or_search("a", search), {"hits": 5})
+
+    def test_get_or_search_settle_delay(self):
+        """
+        Results are not cached right after a write, the index may not be refreshed yet.
+        """
+        cache = IndexResultsCache("notes", generation_ttl=0, settle_delay=60)
+        search = mock.Mock(return_value={"hits": []})
+
+        cache.get_or_search("a", search)
+        cache.get_or_search("a", search)
+        self.assertEqual(search.call_count, 1)
+
+        models.IndexGeneration.objects.bump_generations(["notes"])
+        cache.get_or_search("a", search)
+        cache.get_or_search("a", search)
+        self.assertEqual(search.call_count, 3)
+
+    def test_bump_generations_skips_unread_indices(self):
+        """
+        Only indices whose generation was read get one, writes to the physical indices
+        behind the aliases do not create one.
+        """
+        self.assertEqual(
+            models.IndexGeneration.objects.get_generation("notes"), (0, None)
+        )
+        models.IndexGeneration.objects.bump_generations(
+            ["notes", "notes_2026-01-01-00h00m00.000000s"]
+        )
+
+        self.assertEqual(
+            list(models.IndexGeneration.objects.values_list("name", "generation")),
+            [("notes", 1)],
+        )
+
+    def test_partaj_bulk_bumps_generations_on_commit(self):
+        """
+        Writes bump the generation of their indices once their transaction is committed,
+        not while it holds the locks of the outbox.
+        """
+        models.IndexGeneration.objects.get_generation("notes")
+
+        with mock.patch(
+            "partaj.core.indexers.common.bulk_compat",
+            side_effect=lambda actions, **kwargs: (len(list(actions)), 0),
+        ), self.captureOnCommitCallbacks(execute=True) as callbacks:
+            partaj_bulk([{"_id": 1, "_index": "notes", "_op_type": "delete"}])
+            self.assertEqual(
+                models.IndexGeneration.objects.get(name="notes").generation, 0
+            )
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(models.IndexGeneration.objects.get(name="notes").generation, 1)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """
+    Test the coalescing of concurrent calls.
+    """
+
+    def test_run_concurrent_calls(self):
+        """
+        Concurrent calls for the same key share the results of a single call.
+        """
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def search():
+            started.set()
+            release.wait(5)
+            return {"hits": []}
+
+        function = mock.Mock(side_effect=search)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flights.run("a", function)))
+            for _ in range(3)
+        ]
+        threads[0].start()
+        started.wait(5)
+
+        # Let the first call end once the other callers wait for it
+        done = flights.calls["a"]["done"]
+        waiting = queue.Queue()
+        wait = done.wait
+
+        def wait_for_call(*args):
+            waiting.put(None)
+            return wait(*args)
+
+        done.wait = wait_for_call
+        for thread in threads[1:]:
+            thread.start()
+        for _ in threads[1:]:
+            waiting.get(timeout=5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        function.assert_called_once()
+        self.assertEqual(results, [{"hits": []}] * 3)
+        self.assertEqual(flights.calls, {})
+
+        # Calls made after the first one ended are made again
+        self.assertEqual(flights.run("a", function), {"hits": []})
+        self.assertEqual(function.call_count, 2)
+
+    def test_run_failed_call(self):
+        """
+        The error of a call is raised to its caller only, and the key can be called
+        again.
+        """
+        flights = SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.run("a", mock.Mock(side_effect=ValueError))
+        self.assertEqual(flights.run("a", lambda: 1), 1)
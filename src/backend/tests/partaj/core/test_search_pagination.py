@@ -0,0 +1,127 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from partaj.core.search_pagination import (
+    InvalidCursorError,
+    decode_cursor,
+    encode_cursor,
+    iter_hits,
+    search_with_cursor,
+)
+
+TIEBREAKER = {"case_number": {"order": "asc"}}
+
+
+class SearchPaginationTestCase(SimpleTestCase):
+    """
+    Test the cursor pagination of searches.
+    """
+
+    @staticmethod
+    def get_client(*pages):
+        client = mock.Mock(__es_version__="7")
+        client.search.side_effect = [
+            {"hits": {"hits": [{"_id": str(key), "sort": [key]} for key in page]}}
+            for page in pages
+        ]
+        return client
+
+    def test_search_with_cursor(self):
+        """
+        Pages continue after the sort values of the last hit of the previous page, until
+        a page is not full.
+        """
+        client = self.get_client([1, 2], [3])
+        body = {"query": {"match_all": {}}, "from": 0}
+
+        _response, cursor = search_with_cursor(client, "referrals", body, 2, TIEBREAKER)
+        self.assertEqual(
+            client.search.call_args.kwargs["body"]["sort"],
+            [{"_score": {"order": "desc"}}, TIEBREAKER],
+        )
+        self.assertEqual(decode_cursor(cursor)["after"], [2])
+
+        response, cursor = search_with_cursor(
+            client, "referrals", body, 2, TIEBREAKER, cursor=decode_cursor(cursor)
+        )
+        sent_body = client.search.call_args.kwargs["body"]
+        self.assertEqual(sent_body["search_after"], [2])
+        self.assertNotIn("from", sent_body)
+        self.assertEqual(len(response["hits"]["hits"]), 1)
+        self.assertIsNone(cursor)
+
+        # A cursor cannot continue a search sorted another way
+        with self.assertRaises(InvalidCursorError):
+            search_with_cursor(
+                client,
+                "referrals",
+                {**body, "sort": [{"due_date": {"order": "asc"}}]},
+                2,
+                TIEBREAKER,
+                cursor=decode_cursor(
+                    encode_cursor([2], {**body, "sort": [TIEBREAKER]})
+                ),
+            )
+
+        # Nor a search for other hits
+        with self.assertRaisesMessage(InvalidCursorError, "another search"):
+            search_with_cursor(
+                client,
+                "referrals",
+                {"query": {"term": {"state": "received"}}, "from": 2},
+                2,
+                TIEBREAKER,
+                cursor=decode_cursor(
+                    encode_cursor([2], {**body, "sort": sent_body["sort"]})
+                ),
+            )
+
+    def test_search_with_cursor_point_in_time(self):
+        """
+        Pages are searched in a point in time opened with the first page and closed
+        after the last one.
+        """
+        client = self.get_client([1, 2], [3])
+        client.open_point_in_time.return_value = {"id": "pit"}
+
+        _response, cursor = search_with_cursor(
+            client, "referrals", {}, 2, TIEBREAKER, use_pit=True
+        )
+        self.assertEqual(decode_cursor(cursor)["pit"], "pit")
+        self.assertNotIn("index", client.search.call_args.kwargs)
+
+        search_with_cursor(
+            client, "referrals", {}, 2, TIEBREAKER, cursor=decode_cursor(cursor)
+        )
+        self.assertEqual(client.open_point_in_time.call_count, 1)
+        client.close_point_in_time.assert_called_once_with(body={"id": "pit"})
+
+    def test_iter_hits(self):
+        """
+        All the hits are searched page by page in a point in time, which is released
+        when the iteration stops early.
+        """
+        client = self.get_client([1, 2], [3, 4], [5])
+        client.open_point_in_time.return_value = {"id": "pit"}
+
+        hits = iter_hits(client, "referrals", {}, 2, TIEBREAKER)
+        self.assertEqual([hit["_id"] for hit in hits], ["1", "2", "3", "4", "5"])
+        self.assertEqual(client.search.call_count, 3)
+        client.close_point_in_time.assert_called_once_with(body={"id": "pit"})
+
+        client = self.get_client([1, 2], [3, 4])
+        client.open_point_in_time.return_value = {"id": "pit"}
+        hits = iter_hits(client, "referrals", {}, 2, TIEBREAKER)
+        self.assertEqual([next(hits)["_id"] for _ in range(3)], ["1", "2", "3"])
+        client.close_point_in_time.assert_not_called()
+        hits.close()
+        client.close_point_in_time.assert_called_once_with(body={"id": "pit"})
+
+    def test_decode_cursor(self):
+        """
+        Tokens which are not cursors are rejected.
+        """
+        for token in ["", "not a cursor", encode_cursor([1], {})[:-4] + "AAAA"]:
+            with self.assertRaises(InvalidCursorError):
+                decode_cursor(token)
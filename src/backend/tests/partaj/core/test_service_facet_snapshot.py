@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from partaj.core import models
+from partaj.core.indexers import NotesIndexer
+from partaj.core.services.facet_snapshot import NOTES_FACETS, FacetSnapshotService
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class FacetSnapshotServiceTestCase(TestCase):
+    """
+    Test the snapshots of the values of the lists filters.
+    """
+
+    def test_get_snapshot(self):
+        """
+        Filters values are aggregated once per generation of the index and scope of
+        documents, unless the snapshot is refreshed.
+        """
+        index_name = NotesIndexer.index_name
+        with mock.patch.object(
+            FacetSnapshotService, "aggregate", return_value={"topic": ["Topic"]}
+        ) as aggregate_mock:
+            for _ in range(2):
+                self.assertEqual(
+                    FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS),
+                    {"topic": ["Topic"]},
+                )
+            self.assertEqual(aggregate_mock.call_count, 1)
+
+            # Another scope of documents gets its own snapshot
+            scope = [{"terms": {"units": ["unit"]}}]
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS, scope)
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS, scope)
+            self.assertEqual(aggregate_mock.call_count, 2)
+
+            # Snapshots are not stored until a write to the index is searchable...
+            models.IndexGeneration.objects.bump_generations([index_name])
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS)
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS)
+            self.assertEqual(aggregate_mock.call_count, 4)
+
+            # ...unless they are refreshed once the index is
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS, refresh=True)
+            FacetSnapshotService.get_snapshot(index_name, NOTES_FACETS)
+            self.assertEqual(aggregate_mock.call_count, 5)
+
+    def test_format_filters(self):
+        """
+        Snapshots are returned as the filters endpoints always did.
+        """
+        self.assertEqual(
+            FacetSnapshotService.format_filters(
+                {"topic": ["A", "B"], "contributors": []},
+                {"topic": 1, "contributors": 2},
+            ),
+            {
+                "topic": {
+                    "order": 1,
+                    "results": [{"name": "A", "id": "A"}, {"name": "B", "id": "B"}],
+                },
+                "contributors": {"order": 2, "results": []},
+            },
+        )
@@ -0,0 +1,83 @@
+from io import BytesIO
+
+from django.test import TestCase
+
+from fpdf import FPDF
+from mammoth.results import Message
+from pdfminer.high_level import extract_text
+
+from partaj.core import models
+from partaj.core.services.file_handler import (
+    DOCX_HTML,
+    EXTRACTION_VERSION,
+    TextExtractor,
+    extract_with_cache,
+    get_extractor_version,
+    get_file_hash,
+)
+
+
+class FileHandlerTestCase(TestCase):
+    """
+    Test the extraction of files.
+    """
+
+    def test_extract_with_cache(self):
+        """
+        A file content is extracted once by each version of an extractor.
+        """
+        calls = []
+
+        def convert(file):
+            calls.append(file.read())
+            return "<p>Note</p>", [Message("warning", "Unrecognised style")]
+
+        for _ in range(2):
+            self.assertEqual(
+                extract_with_cache(BytesIO(b"docx content"), DOCX_HTML, convert),
+                ("<p>Note</p>", [Message("warning", "Unrecognised style")]),
+            )
+        self.assertEqual(calls, [b"docx content"])
+
+        extract_with_cache(BytesIO(b"other docx content"), DOCX_HTML, convert)
+        self.assertEqual(len(calls), 2)
+
+        # Extractions of another version of the extractor are ignored
+        models.DocumentExtraction.objects.update(extractor_version="0/mammoth-0")
+        extract_with_cache(BytesIO(b"docx content"), DOCX_HTML, convert)
+        self.assertEqual(len(calls), 3)
+
+        extraction = models.DocumentExtraction.objects.get(
+            content_hash=get_file_hash(BytesIO(b"docx content")),
+            extractor_version=get_extractor_version(DOCX_HTML),
+        )
+        self.assertTrue(
+            extraction.extractor_version.startswith(f"{EXTRACTION_VERSION}/")
+        )
+        self.assertEqual(extraction.messages, [["warning", "Unrecognised style"]])
+
+    def test_iter_pdf_text(self):
+        """
+        Pdf text is extracted page by page, within an optional budget, and matches the
+        text extracted at once by pdfminer.
+        """
+        pdf = FPDF()
+        pdf.set_font("helvetica", size=12)
+        for page in range(3):
+            pdf.add_page()
+            pdf.multi_cell(0, 10, f"Page {page} " + "lorem ipsum " * 20)
+        content = bytes(pdf.output())
+
+        chunks = list(TextExtractor.iter_pdf_text(BytesIO(content)))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[1].startswith("Page 1"))
+        self.assertEqual("".join(chunks), extract_text(BytesIO(content)))
+
+        self.assertEqual(
+            TextExtractor.from_pdf_file(BytesIO(content), max_pages=2),
+            "".join(chunks[:2]),
+        )
+        self.assertEqual(
+            TextExtractor.from_pdf_file(BytesIO(content), max_chars=len(chunks[0]) + 5),
+            "".join(chunks)[: len(chunks[0]) + 5],
+        )
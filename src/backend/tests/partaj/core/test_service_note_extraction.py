@@ -0,0 +1,56 @@
+import time
+
+from django.test import SimpleTestCase
+
+from partaj.core.services.note_extraction import run_in_limited_processes
+
+
+def extract(value):
+    return {"text": value}
+
+
+def fail(value):
+    raise ValueError(value)
+
+
+def hang(value):
+    time.sleep(30)
+    return {"text": value}
+
+
+def allocate(value):
+    return {"text": value * 512 * 1024 * 1024}
+
+
+class NoteExtractionTestCase(SimpleTestCase):
+    """
+    Test the extraction of note documents in limited processes.
+    """
+
+    def test_run_in_limited_processes(self):
+        """
+        Each task reports its result or its error, and tasks going beyond their time or
+        memory limit are stopped without blocking the other ones.
+        """
+        started_at = time.monotonic()
+        outcomes = {
+            key: (result, error)
+            for key, result, error, _elapsed in run_in_limited_processes(
+                [
+                    ("hang", hang, ("a",)),
+                    ("extract", extract, ("b",)),
+                    ("fail", fail, ("c",)),
+                    ("allocate", allocate, ("d",)),
+                ],
+                workers=2,
+                timeout=2,
+                memory_limit=64 * 1024 * 1024,
+            )
+        }
+
+        self.assertLess(time.monotonic() - started_at, 10)
+        self.assertEqual(outcomes["extract"], ({"text": "b"}, None))
+        self.assertEqual(outcomes["fail"], (None, "ValueError('c')"))
+        self.assertEqual(outcomes["hang"], (None, "Timed out after 2s"))
+        self.assertIsNone(outcomes["allocate"][0])
+        self.assertIn("MemoryError", outcomes["allocate"][1])
@@ -0,0 +1,105 @@
+from contextlib import nullcontext
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from partaj.core import models
+from partaj.core.indexers import NotesIndexer
+from partaj.core.services.note_pipeline import NotePipeline, has_pending_notes
+
+
+class NotePipelineTestCase(TestCase):
+    """
+    Test the pipeline bringing notes to the knowledge base index.
+    """
+
+    @staticmethod
+    def create_note(referral_id, state):
+        return models.ReferralNote.objects.create(
+            referral_id=referral_id,
+            publication_date=timezone.now(),
+            object="Object",
+            topic="Topic",
+            author="Author",
+            text="Text",
+            state=state,
+        )
+
+    def test_send_notes(self):
+        """
+        Sent notes become active, but a note updated while notes are sent stays to send
+        so its new content reaches the index on the next run.
+        """
+        sent = self.create_note("1", models.ReferralNoteStatus.TO_SEND)
+        updated = self.create_note("2", models.ReferralNoteStatus.TO_SEND)
+        self.assertTrue(has_pending_notes())
+
+        sent_ids = []
+
+        def upsert(states, updated_before, logger=None):
+            sent_ids.extend(
+                sorted(
+                    document["_id"]
+                    for document in NotesIndexer.get_es_documents_by_state(
+                        states, updated_before=updated_before
+                    )
+                )
+            )
+            # The note is published again while the bulk request is running
+            updated.text = "New text"
+            updated.save()
+
+        with mock.patch.object(
+            NotesIndexer, "upsert_notes_documents_by_state", side_effect=upsert
+        ) as upsert_mock:
+            NotePipeline().send_notes()
+
+        upsert_mock.assert_called_once()
+        self.assertEqual(sent_ids, ["1", "2"])
+        sent.refresh_from_db()
+        updated.refresh_from_db()
+        self.assertEqual(sent.state, models.ReferralNoteStatus.ACTIVE)
+        self.assertEqual(updated.state, models.ReferralNoteStatus.TO_SEND)
+        self.assertTrue(has_pending_notes())
+
+        with mock.patch.object(NotesIndexer, "upsert_notes_documents_by_state"):
+            NotePipeline().send_notes()
+
+        updated.refresh_from_db()
+        self.assertEqual(updated.state, models.ReferralNoteStatus.ACTIVE)
+        self.assertFalse(has_pending_notes())
+
+    def test_save_extracted_note(self):
+        """
+        Extracted fields are saved on received notes only: a note deleted by a user while
+        its document was extracted stays to delete.
+        """
+        received = self.create_note("1", models.ReferralNoteStatus.RECEIVED)
+        deleted = self.create_note("2", models.ReferralNoteStatus.RECEIVED)
+        models.ReferralNote.objects.filter(id=deleted.id).update(
+            state=models.ReferralNoteStatus.TO_DELETE
+        )
+
+        pipeline = NotePipeline()
+        pipeline.save_extracted_note(received, {"text": "Extracted"})
+        pipeline.save_extracted_note(deleted, {"text": "Extracted"})
+
+        received.refresh_from_db()
+        deleted.refresh_from_db()
+        self.assertEqual(received.state, models.ReferralNoteStatus.TO_SEND)
+        self.assertEqual(received.text, "Extracted")
+        self.assertEqual(deleted.state, models.ReferralNoteStatus.TO_DELETE)
+        self.assertEqual(deleted.text, "Text")
+
+    def test_run_skipped_while_another_pipeline_runs(self):
+        """
+        A run does nothing while another pipeline holds the lock.
+        """
+        with mock.patch(
+            "partaj.core.services.note_pipeline.note_pipeline_lock",
+            return_value=nullcontext(False),
+        ), mock.patch.object(NotePipeline, "extract_received_notes") as extract:
+            NotePipeline().run()
+
+        extract.assert_not_called()
@@ -0,0 +1,57 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from partaj.core import factories, models
+
+
+class ExportViewTestCase(TestCase):
+    """
+    Test the csv export of the referrals of the units of a user.
+    """
+
+    @staticmethod
+    def create_referral(topic):
+        return factories.ReferralFactory(
+            state=models.ReferralState.RECEIVED,
+            topic=topic,
+            urgency_level=models.ReferralUrgency.objects.get(
+                duration=datetime.timedelta(days=1)
+            ),
+        )
+
+    def export(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/export/")
+            rows = b"".join(response.streaming_content).decode("utf-8-sig")
+        self.assertEqual(response.status_code, 200)
+        return rows.splitlines(), len(queries)
+
+    def test_export_referrals(self):
+        """
+        The referrals of the units of the user are exported, in a number of queries
+        that does not depend on the number of referrals.
+        """
+        user = factories.UserFactory()
+        topic = factories.TopicFactory()
+        models.UnitMembership.objects.create(
+            role=models.UnitMembershipRole.MEMBER, user=user, unit=topic.unit
+        )
+        referral = self.create_referral(topic)
+        # Referrals of other units and drafts are not exported
+        self.create_referral(factories.TopicFactory())
+        factories.ReferralFactory(state=models.ReferralState.DRAFT, topic=topic)
+
+        self.client.force_login(user)
+        rows, queries_count = self.export()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith(f'"{referral.id}";'))
+        self.assertIn(f'"{topic.name}"', rows[1])
+
+        for _ in range(3):
+            self.create_referral(topic)
+        rows, more_queries_count = self.export()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(more_queries_count, queries_count)
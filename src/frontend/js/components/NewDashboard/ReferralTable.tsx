@@ -224,7 +224,9 @@ export const ReferralTable: React.FC<{
     },
   ];
 
-  const { status, data: lites } = useReferralLitesV2(params, url, unitId);
+  const { status, data: lites } = useReferralLitesV2(params, url, unitId, [
+    activeTab.name,
+  ]);
 
   useEffect(() => {
     if (lites) {
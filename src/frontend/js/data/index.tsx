@@ -273,6 +273,7 @@ export const useReferralLitesV2 = (
   params: URLSearchParams,
   url: string,
   unitId?: string,
+  tabs?: Array<ReferralTab>,
   queryOptions?: FetchListQueryOptions<ReferralLitesV2Response>,
 ) => {
   const normalizedParams: { [key: string]: any } = {};
@@ -288,6 +289,11 @@ export const useReferralLitesV2 = (
     normalizedParams['unit_id'] = [unitId];
   }
 
+  // Only fetch the referrals of these tabs, the other ones are just counted
+  if (tabs) {
+    normalizedParams['tabs'] = tabs;
+  }
+
   return useQuery({
     queryKey: [
       `referrallites/${url}`,
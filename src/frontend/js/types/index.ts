@@ -754,23 +754,15 @@ export enum NoteHighlightKeys {
 
 export interface NoteLite {
   _id: string;
-  _index: string;
-  _score: number;
   _source: {
-    _lite: string;
-    _type: string;
     id: string;
     referral_id: string;
     publication_date: string;
-    created_at: string;
     assigned_units_names: Array<string>;
-    author: string;
     siblings: number[];
-    contributors: string[];
     document: NoteDocument;
     object: 'Version 2 PDF';
     requesters_unit_names: Array<string>;
-    text: string;
     topic: string;
   };
   highlight: {